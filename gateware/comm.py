@@ -27,6 +27,9 @@ from .spi import SPISlave
 
 mem_layout = [("data", 16)]
 
+# CRC-8-CCITT, CRC-16-CCITT, CRC-32
+crc_polynomials = {8: 0x07, 16: 0x1021, 32: 0x04c11db7}
+
 
 class ResetGen(Module):
     """Reset generator.
@@ -113,14 +116,30 @@ class Protocol(Module):
     """Handles the memory write protocol and writes data to the channel
     memories.
 
+    The checksum register at address 1 is ``crc_width`` bits wide. It is
+    read and written as ``crc_width//8`` bytes, least significant byte
+    first. A write sets the register to the first byte and then sets the
+    following bytes in order.
+
+    The status register at address 3 is ``status_width`` bits wide and is
+    read the same way. A one byte write to it asserts :attr:`status_clear`
+    instead.
+
     Args:
-        board (Value): Address of this board.
-        dacs (list): List of :mod:`gateware.dac.Dac`.
+        mems (list[Memory]): Channel memories.
+        crc_width (int): Checksum width: 8, 16 or 32 bits. See
+            :data:`crc_polynomials`.
+        status_width (int): Status register width, a multiple of 8 bits.
 
     Attributes:
         sink (Endpoint[mem_layout]): 16 bit data sink.
+        checksum (Signal(crc_width)): Checksum register.
+        status (Signal(status_width)): Status register at address 3.
+            Input.
+        status_clear (Signal): Asserted for one cycle when the status
+            register is written. Output.
     """
-    def __init__(self, mems):
+    def __init__(self, mems, crc_width=8, status_width=8):
         self.sink = Endpoint(bus_layout)
         self.source = Endpoint(bus_layout)
         self.board = Signal(4)
@@ -134,21 +153,24 @@ class Protocol(Module):
             ("aux_miso", 1),
             ("aux_dac", 3),
         ])
-        self.checksum = Signal(8)
+        self.checksum = Signal(crc_width)
         self.frame = Signal(max=32)
+        self.status = Signal(status_width)
+        self.status_clear = Signal()
 
         ###
 
-        # CRC8-CCIT
-        crc = LiteEthMACCRCEngine(data_width=8, width=8, polynom=0x07)
+        crc = LiteEthMACCRCEngine(data_width=8, width=crc_width,
+                                  polynom=crc_polynomials[crc_width])
         self.submodules += crc
 
+        crc_we = Signal()
         self.comb += [
             crc.data.eq(self.sink.data[::-1]),
             crc.last.eq(self.checksum),
         ]
         self.sync += [
-            If(self.sink.stb & ~self.sink.eop & ~self.source.stb,
+            If(self.sink.stb & ~self.sink.eop & ~self.source.stb & ~crc_we,
                 self.checksum.eq(crc.next),
             ),
         ]
@@ -163,11 +185,46 @@ class Protocol(Module):
         self.comb += cmd_cur.raw_bits().eq(self.sink.data)
         cmd = Record(cmd_layout)
 
-        reg_map = Array([self.config.raw_bits(), self.checksum, self.frame])
+        reg_map = Array([self.config.raw_bits(), self.checksum, self.frame,
+                         self.status])
         reg_we = Signal()
+        # byte index into the checksum and status registers
+        crc_bytes = Array([self.checksum[i:i + 8]
+                           for i in range(0, crc_width, 8)])
+        status_bytes = Array([self.status[i:i + 8]
+                              for i in range(0, status_width, 8)])
+        reg_byte = Signal(max=max(len(crc_bytes), len(status_bytes), 2))
+        reg_last = Signal()
+        reg_data = Signal(8)
+        self.comb += [
+            If(cmd.adr == 1,
+                reg_last.eq(reg_byte == len(crc_bytes) - 1),
+            ).Elif((cmd.adr == 3) & ~cmd.we,
+                reg_last.eq(reg_byte == len(status_bytes) - 1),
+            ).Else(
+                reg_last.eq(1),
+            ),
+            crc_we.eq(reg_we & (cmd.adr == 1)),
+            If(cmd.adr == 1,
+                reg_data.eq(crc_bytes[reg_byte]),
+            ).Elif(cmd.adr == 3,
+                reg_data.eq(status_bytes[reg_byte]),
+            ).Else(
+                reg_data.eq(reg_map[cmd.adr]),
+            ),
+            self.status_clear.eq(reg_we & (cmd.adr == 3)),
+        ]
         self.sync += [
             If(reg_we,
-                reg_map[cmd.adr].eq(self.sink.data),
+                Case(cmd.adr, {
+                    0: self.config.raw_bits().eq(self.sink.data),
+                    1: If(reg_byte == 0,
+                        self.checksum.eq(self.sink.data),
+                    ).Else(
+                        crc_bytes[reg_byte].eq(self.sink.data),
+                    ),
+                    2: self.frame.eq(self.sink.data),
+                }),
             )
         ]
 
@@ -216,12 +273,16 @@ class Protocol(Module):
             NextState("IGNORE"))
         fsm.act("REG_WRITE",
             reg_we.eq(self.sink.stb),
-            NextState("IGNORE"),
+            If(reg_last,
+                NextState("IGNORE"),
+            ),
         )
         fsm.act("REG_READ",
             self.source.stb.eq(self.sink.stb),
-            self.source.data.eq(reg_map[cmd.adr]),
-            NextState("IGNORE"),
+            self.source.data.eq(reg_data),
+            If(reg_last,
+                NextState("IGNORE"),
+            ),
         )
         fsm.act("MEM_ADRL",
             NextState("MEM_ADRH"),
@@ -244,6 +305,12 @@ class Protocol(Module):
             If(fsm.before_leaving("CMD"),
                 cmd.raw_bits().eq(self.sink.data),
             ),
+            If(self.sink.stb & (fsm.ongoing("REG_WRITE") |
+                                fsm.ongoing("REG_READ")),
+                reg_byte.eq(reg_byte + 1),
+            ).Elif(fsm.ongoing("CMD"),
+                reg_byte.eq(0),
+            ),
             If(fsm.before_leaving("MEM_ADRL"),
                 mem_adr[:8].eq(self.sink.data),
             ),
@@ -272,21 +339,27 @@ class Comm(Module):
     Controls the input and output TTL signals, handles the excaped control
     commands.
 
+    The status register holds an external status byte followed by the
+    ``underruns`` and ``level_max`` counters of each DAC. Writing it clears
+    the counters.
+
     Args:
         pads (Record): Pads containing the TTL input and output control signals
         dacs (list): List of :mod:`gateware.dac.Dac`.
+        crc_width (int): Checksum width. See :class:`Protocol`.
 
     Attributes:
         reset (Signal): Reset output from :class:`ResetGen`. Active high.
         dcm_sel (Signal): DCM slock select. Enable clock doubler. Output.
         sink (Endpoint[bus_layout]): 8 bit control data sink. Input.
     """
-    def __init__(self, ctrl_pads, dacs):
+    def __init__(self, ctrl_pads, dacs, crc_width=8):
         rg = ResetGen()
         spi = SPISlave(width=8)
         f2s = FTDI2SPI()
         arb = Arbiter()
-        proto = Protocol([dac.parser.mem for dac in dacs])
+        proto = Protocol([dac.parser.mem for dac in dacs], crc_width,
+                         status_width=8*(1 + 2*len(dacs)))
         self.submodules += proto, rg, spi, f2s, arb
         self.spi = spi
         self.proto = proto
@@ -318,8 +391,11 @@ class Comm(Module):
                        Cat([dac.out.aux for dac in dacs]) != 0),
         ]
 
-        for dac in dacs:
+        for i, dac in enumerate(dacs):
             self.comb += [
+                    proto.status[8 + 16*i:24 + 16*i].eq(
+                        Cat(dac.underruns, dac.level_max)),
+                    dac.clear.eq(proto.status_clear),
                     dac.parser.frame.eq(proto.frame),
                     dac.out.trigger.eq(proto.config.enable &
                                        (trigger | proto.config.trigger)),
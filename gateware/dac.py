@@ -26,7 +26,7 @@ from misoc.cores.cordic import Cordic
 line_layout = [
         ("header", [
             ("length", 4), # length in shorts
-            ("typ", 2), # volt, dds
+            ("typ", 2), # volt, dds, repeat/call
             ("trigger", 1), # wait for trigger before
             ("silence", 1), # shut down clock
             ("aux", 1), # aux channel value
@@ -46,25 +46,54 @@ class Parser(Module):
     Reads memory controlled by TTL signals, builds lines, and submits
     them to its output.
 
+    Lines of type 2 are not submitted but repeat a block of lines or call
+    a subroutine.
+
+    A repeat line (``shift`` of zero) repeats the preceding block: the
+    duration field is the total number of times the block is executed and
+    the first data word is the distance in words from the end of the
+    repeat line back to the first header of the block. The repeat line is
+    read after each execution of the block. It takes four cycles to read.
+    The block is executed once more if the remaining count is nonzero.
+    Otherwise the parser continues after the repeat line, or returns (see
+    below) if the repeat line has the ``end`` flag set. The other header
+    flags are ignored. Repeat lines can not be nested.
+
+    A call line (``shift`` of one) pushes the address of the next line and
+    the repeat state onto the return stack and continues at the absolute
+    address given by the first data word. It takes four cycles to read.
+    A line with the ``end`` flag returns to the address on top of the
+    return stack if it is not empty and to the frame address table
+    otherwise. Calls nested deeper than ``stack_depth`` are ignored.
+    Returning to the frame address table clears the return stack.
+
     Args:
         mem_depth (int): Memory depth in 16 bit entries.
+        stack_depth (int): Depth of the return stack.
 
     Attributes:
         mem (Memory): Memory to read from.
-        source (Endpoint[line_layout]): Endpoint of lines read from memory. Output.
+        source (Endpoint[line_layout]): Endpoint of lines read from memory.
+            ``eop`` is set on the last line of a frame, after which the
+            parser returns to the frame address table. Output.
         arm (Signal): Allow triggers. If disarmed, the next line will not be
             read. Instead, the Parser will return to the frame address table.
             Input.
         start (Signal): Allow leaving the frame address table. Input.
+        idle (Signal): All lines submitted have been accepted downstream.
+            The frame address table is not left (and the frame selection
+            not read) before. Input.
         frame (Signal[3]): Values of the frame selection lines. Input.
     """
-    def __init__(self, mem_depth=4*(1 << 10)):  # XC3S500E: 20x18bx1024
+    def __init__(self, mem_depth=4*(1 << 10),  # XC3S500E: 20x18bx1024
+                 stack_depth=4):
         self.specials.mem = Memory(width=16, depth=mem_depth)
         self.specials.read = read = self.mem.get_port()
 
         self.source = Endpoint(line_layout)
         self.arm = Signal()
         self.start = Signal()
+        self.idle = Signal(reset=1)
         self.frame = Signal(3)
 
         ###
@@ -78,11 +107,23 @@ class Parser(Module):
         lpa = Array([raw[i:i + len(read.dat_r)] for i in
             range(0, len(raw), len(read.dat_r))])
         data_read = Signal.like(lp.header.length)
+        repeat = Signal(16)
+        repeat_next = Signal(16)
+        self.comb += repeat_next.eq(Mux(repeat == 0, lp.dt - 1, repeat - 1))
+
+        ret_adr = Array(Signal.like(adr) for i in range(stack_depth))
+        ret_repeat = Array(Signal.like(repeat) for i in range(stack_depth))
+        sp = Signal(max=stack_depth + 1)
+        ret = Signal()
+        self.comb += [
+                ret.eq(lp.header.end & (sp != 0)),
+                self.source.eop.eq(lp.header.end & ~ret),
+        ]
 
         self.submodules.fsm = fsm = FSM(reset_state="JUMP")
         fsm.act("JUMP",
                 read.adr.eq(self.frame),
-                If(self.start,
+                If(self.start & self.idle,
                     NextState("FRAME")
                 )
         )
@@ -103,17 +144,53 @@ class Parser(Module):
         fsm.act("LINE",
                 read.adr.eq(adr),
                 If(data_read == lp.header.length,
-                    NextState("STB")
+                    If(lp.header.typ == 2,
+                        If(lp.header.shift == 1,
+                            NextState("CALL")
+                        ).Else(
+                            NextState("REPEAT")
+                        )
+                    ).Else(
+                        NextState("STB")
+                    )
                 ).Else(
                     inc.eq(1),
                 )
         )
+        fsm.act("REPEAT",
+                If(repeat_next != 0,
+                    read.adr.eq(adr - lp.data[:16]),
+                ).Elif(ret,
+                    read.adr.eq(ret_adr[sp - 1]),
+                ).Else(
+                    read.adr.eq(adr),
+                ),
+                inc.eq(1),
+                If(~self.arm | ((repeat_next == 0) & lp.header.end & ~ret),
+                    NextState("JUMP")
+                ).Else(
+                    NextState("HEADER")
+                )
+        )
+        fsm.act("CALL",
+                read.adr.eq(lp.data[:16]),
+                inc.eq(1),
+                If(~self.arm,
+                    NextState("JUMP")
+                ).Else(
+                    NextState("HEADER")
+                )
+        )
         fsm.act("STB",
-                read.adr.eq(adr),
+                If(ret,
+                    read.adr.eq(ret_adr[sp - 1]),
+                ).Else(
+                    read.adr.eq(adr),
+                ),
                 self.source.stb.eq(1),
                 If(self.source.ack,
                     inc.eq(1),
-                    If(lp.header.end,
+                    If(lp.header.end & ~ret,
                         NextState("JUMP")
                     ).Else(
                         NextState("HEADER")
@@ -135,6 +212,29 @@ class Parser(Module):
                 If(fsm.ongoing("LINE"),
                     lpa[data_read].eq(read.dat_r),
                     data_read.eq(data_read + 1),
+                ),
+                If(fsm.ongoing("REPEAT"),
+                    repeat.eq(repeat_next),
+                    If((repeat_next == 0) & ret,
+                        repeat.eq(ret_repeat[sp - 1]),
+                        sp.eq(sp - 1),
+                    )
+                ),
+                If(fsm.ongoing("STB") & self.source.ack & ret,
+                    repeat.eq(ret_repeat[sp - 1]),
+                    sp.eq(sp - 1),
+                ),
+                If(fsm.ongoing("CALL"),
+                    repeat.eq(0),
+                    If(sp != stack_depth,
+                        ret_adr[sp].eq(adr),
+                        ret_repeat[sp].eq(repeat),
+                        sp.eq(sp + 1),
+                    )
+                ),
+                If(fsm.ongoing("JUMP"),
+                    repeat.eq(0),
+                    sp.eq(0),
                 )
         ]
 
@@ -154,6 +254,9 @@ class Sequencer(Module):
         aux (Signal): TTL AUX (F5) output.
         silence (Signal): Silence DAC clocks output.
         data (Signal[16]): Output value to be send to the DAC.
+        underrun (Signal): Asserted for one cycle when a line has finished
+            and the next line is not available. Not asserted before the
+            first line and after the last line of a frame (``eop``). Output.
     """
     def __init__(self):
         self.sink = Endpoint(line_layout)
@@ -163,10 +266,13 @@ class Sequencer(Module):
         self.silence = Signal()
         self.arm = Signal()
         self.data = Signal(16)
+        self.underrun = Signal()
 
         ###
 
         line = Record(line_layout)
+        # no underruns at the end of a frame and before the first line
+        last = Signal(reset=1)
         dt_dec = Signal(16)
         dt_end = Signal(16)
         dt = Signal(16)
@@ -176,6 +282,8 @@ class Sequencer(Module):
         stb = Signal()
         toc0 = Signal()
         inc = Signal()
+        stall = Signal()
+        stall0 = Signal()
 
         lp = self.sink.payload
 
@@ -188,6 +296,8 @@ class Sequencer(Module):
                 stb.eq(tic & toc & adv),
                 self.sink.ack.eq(stb),
                 inc.eq(self.arm & tic & (~toc | (~toc0 & ~adv))),
+                stall.eq(self.arm & tic & toc & ~self.sink.stb & ~last),
+                self.underrun.eq(stall & ~stall0),
         ]
 
         subs = [
@@ -200,6 +310,7 @@ class Sequencer(Module):
 
         self.sync += [
                 toc0.eq(toc),
+                stall0.eq(stall),
                 self.data.eq(reduce(add, [sub.data for sub in subs])),
                 self.aux.eq(line.header.aux),
                 self.silence.eq(line.header.silence),
@@ -211,6 +322,7 @@ class Sequencer(Module):
                     dt.eq(dt + 1),
                 ).Elif(stb,
                     line.header.eq(lp.header),
+                    last.eq(self.sink.eop),
                     line.dt.eq(lp.dt - 1),
                     dt_end.eq((1<<lp.header.shift) - 1),
                     dt_dec.eq(0),
@@ -323,6 +435,13 @@ class Dac(Module):
     Holds the Memory, the :class:`Parser`, the :class:`Sequencer`, and its two
     output line executors.
 
+    With a FIFO, the :class:`Parser` reads ahead up to ``fifo`` lines while
+    the :class:`Sequencer` executes long lines and sustains shorter lines
+    after them. The FIFO is cleared while the parser is disarmed. At the
+    end of a frame the :class:`Parser` waits until the FIFO has drained
+    and the last line has been accepted by the :class:`Sequencer` before it
+    reads the frame selection, as without a FIFO.
+
     Args:
         fifo (int): Number of lines to buffer between :class:`Parser` and
             :class:`Sequencer`.
@@ -332,15 +451,43 @@ class Dac(Module):
         parser: The memory :class:`Parser`.
         out: The :class:`Sequencer` and output executor. Connect its ``data``
             to the DAC.
+        underruns (Signal[8]): Number of times the :class:`Sequencer` had
+            to wait for a line (see :attr:`Sequencer.underrun`). Saturates.
+        level_max (Signal[8]): Highest number of lines in the FIFO.
+        clear (Signal): Clear :attr:`underruns` and :attr:`level_max`.
+            Input.
     """
     def __init__(self, fifo=0, **kwargs):
+        self.underruns = Signal(8)
+        self.level_max = Signal(8)
+        self.clear = Signal()
+
+        ###
+
         self.submodules.parser = Parser(**kwargs)
         self.submodules.out = Sequencer()
         if fifo:
-            self.submodules.fifo = SyncFIFO(line_layout, fifo)
+            self.submodules.fifo = ResetInserter()(SyncFIFO(line_layout, fifo))
+            level = self.fifo.fifo.level
             self.comb += [
                     self.parser.source.connect(self.fifo.sink),
                     self.fifo.source.connect(self.out.sink),
+                    self.fifo.reset.eq(~self.parser.arm),
+                    self.parser.idle.eq(~self.fifo.source.stb),
+            ]
+            self.sync += [
+                    If(self.clear,
+                        self.level_max.eq(0),
+                    ).Elif(level > self.level_max,
+                        self.level_max.eq(level),
+                    )
             ]
         else:
             self.comb += self.parser.source.connect(self.out.sink)
+        self.sync += [
+                If(self.clear,
+                    self.underruns.eq(0),
+                ).Elif(self.out.underrun & (self.underruns != 0xff),
+                    self.underruns.eq(self.underruns + 1),
+                )
+        ]
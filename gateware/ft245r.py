@@ -19,59 +19,99 @@ from math import ceil
 import random
 
 from migen import *
-from migen.genlib.misc import timeline
 from migen.genlib.record import Record
 from migen.genlib.cdc import MultiReg
-from misoc.interconnect.stream import Endpoint
+from misoc.interconnect.stream import Endpoint, SyncFIFO
 
 
 class SimFt245r_rx_w(Module):
-    t_fill = [0, 3]
-    t_delay = [0, 1]
-    t_setup = [0, 4]  # 5 - wr
+    """FT245R receive FIFO model.
 
-    def __init__(self, pads, data):
+    Serves bytes on the read side of the FT245R with timings drawn at random
+    from the datasheet ranges (in ns) and records protocol violations.
+
+    The board-to-board ``g1`` chain is modeled as a register from
+    ``g1_out`` to ``g1_in``.
+
+    Args:
+        pads (Record[ft245r_layout]): Pads to the FT245R.
+        data (list[int]): Bytes to serve.
+        clk (float): Clock period in ns.
+
+    Attributes:
+        errors (list[str]): Protocol violations.
+    """
+    t_fill = [80, 160]  # T6: RXF# inactive after RD# cycle, + refill
+    t_delay = [0, 25]  # T5: RD# inactive to RXF# inactive
+    t_setup = [20, 50]  # T3: RD# active to valid data
+    t_rd = 50  # T1: RD# active pulse width
+
+    def __init__(self, pads, data, clk=10.):
         self.pads = pads
-        self.data = data
-        self.sync += pads.rd_in.eq(pads.rd_out)
+        self.data = list(data)
+        self.clk = clk
+        self.errors = []
         pads.rxfl.reset = 1
-        self.dat = Signal.like(pads.data)
-        self.comb += [
-                If(~pads.rdl,
-                    pads.data.eq(self.dat),
-                ).Else(
-                    pads.data.eq(0x55),
-                )
-        ]
-        self.state = "fill"
-        self.wait = 10
-
-    def do_simulation(self, selfp):
-        self.wait = max(0, self.wait - 1)
-        if self.state == "fill":
-            selfp.pads.rxfl = 1
-            if self.data and self.wait == 0:
-                selfp.pads.rxfl = 0
-                self.state = "read"
-        elif self.state == "read":
-            if selfp.pads.rdl == 0:
-                self.wait = random.choice(self.t_setup)
-                self.state = "setup"
-        elif self.state == "setup":
-            if self.wait == 0:
-                selfp.dat = self.data.pop(0)
-                self.state = "wait"
-            if selfp.pads.rdl == 1:
-                self.wait = random.choice(self.t_delay)
-                self.state = "delay"
-        elif self.state == "wait":
-            if selfp.pads.rdl == 1:
-                self.wait = random.choice(self.t_delay)
-                self.state = "delay"
-        elif self.state == "delay":
-            if self.wait == 0:
-                self.wait = random.choice(self.t_fill)
-                self.state = "fill"
+        self.sync += pads.g1_in.eq(pads.g1_out)
+
+    def _cycles(self, t):
+        return int(ceil(random.uniform(*t)/self.clk))
+
+    @passive
+    def run(self):
+        pads = self.pads
+        n = 0
+        while True:
+            yield
+            n += 1
+            if not (yield pads.rdl):
+                self.errors.append("{}: RD# active with RXF# inactive"
+                                   .format(n))
+            if not self.data:
+                continue
+            yield pads.rxfl.eq(0)
+            while (yield pads.rdl):
+                yield
+                n += 1
+            setup = self._cycles(self.t_setup)
+            yield pads.data.eq(0x55)
+            byte = self.data.pop(0)
+            t = 0
+            while not (yield pads.rdl):
+                if t == setup - 1:
+                    yield pads.data.eq(byte)
+                yield
+                n += 1
+                t += 1
+            if t*self.clk < self.t_rd:
+                self.errors.append("{}: RD# pulse {} ns".format(
+                    n, t*self.clk))
+            if t < setup:
+                self.errors.append("{}: RD# released before data valid"
+                                   .format(n))
+            # RXF# may stay active for T5, a read during T5 is a violation
+            for i in range(max(self._cycles(self.t_delay), 1) - 1):
+                yield
+                n += 1
+                if not (yield pads.rdl):
+                    self.errors.append("{}: RD# active during T5"
+                                       .format(n))
+            yield pads.rxfl.eq(1)
+            for i in range(self._cycles(self.t_fill)):
+                yield
+                n += 1
+                if not (yield pads.rdl):
+                    self.errors.append("{}: RD# active with RXF# inactive"
+                                       .format(n))
+
+
+ft245r_layout = [
+    ("data", 8),
+    ("rdl", 1),
+    ("rxfl", 1),
+    ("g1_in", 1),
+    ("g1_out", 1),
+]
 
 
 bus_layout = [("data", 8)]
@@ -80,70 +120,127 @@ bus_layout = [("data", 8)]
 class Ft245r_rx(Module):
     """FTDI FT345R synchronous reader.
 
+    The read strobe timing is derived from the datasheet in units of the
+    system clock period. If ``clk2x`` is given, both the timings for
+    ``clk`` and ``clk/2`` are generated and selected at run time.
+
+    Received bytes are buffered. The next read is started as soon as the
+    FT245R has data and there is room in the buffer, independent of the
+    sink accepting the previous bytes.
+
+    The read cycle is referenced to ``g1_in``, the read strobe as seen
+    through the board chain. ``skew`` has to cover the strobe skew between
+    the boards in the chain.
+
     Args:
-        pads (Record[ft345r_layout]): Pads to the FT245R.
+        pads (Record[ft245r_layout]): Pads to the FT245R.
         clk (float): Clock period in ns.
+        clk2x (Value): Clock doubler enabled. The clock period is ``clk/2``
+            while asserted. Input.
+        depth (int): Receive buffer depth.
+        skew (int): Timing margin in cycles.
+        window (int): Throughput measurement window, log2 of cycles.
 
     Attributes:
         source (Endpoint[bus_layout]): 8 bit data source. Output.
         busy (Signal): Data available but not acknowledged by sink. Output.
+        count (Signal(32)): Number of bytes read. Output.
+        rate (Signal(8)): Number of bytes read in the last measurement
+            window, saturating. ``rate*f/(1 << window)`` bytes per second.
+            Output.
     """
-    def __init__(self, pads, clk=10.):
-        self.source = do = Endpoint(bus_layout)
+    latency = 2  # synchronizer latency
+    t_rd = 50  # T3: RD# active to valid data, >= T1 RD# pulse width
+    t_rxf = 25  # T5: RD# inactive to RXF# inactive
+
+    def __init__(self, pads, clk=10., clk2x=None, depth=4, skew=1,
+                 window=12):
+        self.source = Endpoint(bus_layout)
         self.busy = Signal()
+        self.count = Signal(32)
+        self.rate = Signal(8)
+
+        ###
 
-        # t_RDLl_Dv = 50 ns (setup)
-        # t_RDLh_Di = 0ns (hold)
-        # t_RDLl_RDLh = 50 ns (redundant, <= r_RDLl_Dv)
-        # t_RDLh_RXFLh = 25ns (from FT245R) (redundant, <= t_RDLh_RDLl)
-        # t_RXFLh_RXFLl = 80ns (from FT245R)
-        # t_RDLh_RDLl = 50ns + t_RXh_RXl (we understand this as a
-        #    conditional addition)
-
-        # we read every t_hold + t_precharge + t_setup + 2 cycles
-        # can only sustain 1MByte/s anyway at full speed USB
-        # stb implicitly needs to be acked within a read cycle
-        #clk /= 4 # slow it down
-        t_latch = int(ceil(50/clk)) + 2 # t_RDLl_Dv + slave skew
-        t_drop = t_latch + 2  # slave skew
-        t_refill = t_drop + int(ceil(50/clk))  # t_RDLh_RDLl
+        fifo = SyncFIFO(bus_layout, depth)
+        self.submodules += fifo
+
+        timings = [self.timing(clk, skew)]
+        if clk2x is not None:
+            timings.append(self.timing(clk/2, skew))
+        t_latch, t_drop, t_refill = timings[0]
+        if clk2x is not None:
+            t_latch, t_drop, t_refill = (Mux(clk2x, b, a)
+                                         for a, b in zip(*timings))
+        counter = Signal(max=max(t[2] for t in timings) + 1)
 
         reading = Signal()
         rxfl = Signal()
         rd_in = Signal()
-        # proxy rxfl to slaves, drive rdl
-        self.comb += [
-                pads.rdl.eq(~pads.g1_out),
-                self.busy.eq(~do.stb | do.ack)
-        ]
+        start = Signal()
         self.specials += [
-            MultiReg(pads.rxfl, rxfl),
+            MultiReg(pads.rxfl, rxfl, reset=1),
             MultiReg(pads.g1_in, rd_in),
         ]
+        self.comb += [
+            pads.rdl.eq(~pads.g1_out),
+            start.eq(~rxfl & ~rd_in & fifo.sink.ack),
+            fifo.sink.data.eq(pads.data),
+            fifo.sink.stb.eq(reading & (counter == t_latch)),
+            fifo.source.connect(self.source),
+            self.busy.eq(~self.source.stb | self.source.ack),
+        ]
         self.sync += [
-                If(~reading & ~rd_in,
-                   pads.g1_out.eq(~rxfl),
+            If(reading,
+                counter.eq(counter + 1),
+                If(counter == t_drop,
+                    pads.g1_out.eq(0),
+                ),
+                If(counter == t_refill,
+                    reading.eq(0),
+                    pads.g1_out.eq(start),
                 ),
-                do.stb.eq(do.stb & ~do.ack),
-                timeline(rd_in, [
-                    (0, [reading.eq(1)]),
-                    (t_latch, [do.stb.eq(1), do.payload.data.eq(pads.data)]),
-                    (t_drop, [pads.g1_out.eq(0)]),
-                    (t_refill, [reading.eq(0)]),
-                ])
+            ).Elif(rd_in,
+                reading.eq(1),
+                counter.eq(0),
+            ).Else(
+                pads.g1_out.eq(start),
+            ),
+            If(fifo.sink.stb,
+                self.count.eq(self.count + 1),
+            ),
         ]
 
+        gate = Signal(window)
+        n = Signal(8)
+        self.sync += [
+            gate.eq(gate + 1),
+            If(gate == 0,
+                self.rate.eq(n),
+                n.eq(fifo.sink.stb),
+            ).Elif(fifo.sink.stb & (n != 0xff),
+                n.eq(n + 1),
+            ),
+        ]
 
-class SimFt245r_rx(Ft245r_rx):
-    comm_layout = [
-        ("rxfl", 1),
-        ("rdl", 1),
-        ("rd_in", 1),
-        ("rd_out", 1),
-        ("data", 8),
-    ]
-
-    def __init__(self, data):
-        pads = Record(self.comm_layout)
-        Ft245r_rx.__init__(self, pads)
-        self.submodules.ft245r_w = SimFt245r_rx_w(pads, data)
+    @classmethod
+    def timing(cls, clk, skew=1):
+        """Read cycle timing.
+
+        Args:
+            clk (float): Clock period in ns.
+            skew (int): Timing margin in cycles.
+
+        Returns:
+            tuple[int]: Cycles after the read strobe is seen on ``g1_in``
+            to latch the data, to release the strobe, and to start the next
+            read.
+        """
+        # g1_in is seen at least `latency` cycles after RD# went low
+        t_latch = max(int(ceil(cls.t_rd/clk)) - cls.latency, 0) + skew
+        # T4: data hold after RD# inactive is 0 ns
+        t_drop = t_latch + skew
+        # RXF# is trustworthy again after T5 and the synchronizer; T6
+        # (RXF# inactive for 80 ns) then holds off the next read
+        t_refill = t_drop + int(ceil(cls.t_rxf/clk)) + cls.latency + skew
+        return t_latch, t_drop, t_refill
@@ -19,9 +19,10 @@ from migen import *
 from migen.genlib.record import Record
 from migen.genlib.resetsync import AsyncResetSynchronizer
 
+from host.emulator import fifo_depths
 from .dac import Dac
 from .comm import Comm
-from .ft245r import Ft245r_rx  # , SimFt245r_rx
+from .ft245r import Ft245r_rx
 
 
 class Pdq2Base(Module):
@@ -35,18 +36,25 @@ class Pdq2Base(Module):
     Args:
         ctrl_pads (Record): Control pads for :mod:`gateware.comm.Comm`.
         mem_depth (list[int]): Memory depths for the DAC channels.
+        crc_width (int): Checksum width. See :class:`gateware.comm.Protocol`.
+        fifo (int): Depth of the line FIFO of each DAC. See
+            :class:`gateware.dac.Dac`. Defaults to the entry of
+            :data:`host.emulator.fifo_depths` for the number of DACs.
 
     Attributes:
         dacs (list): List of :mod:`gateware.dac.Dac`.
         comm (Module): :mod:`gateware.comm.Comm`.
     """
-    def __init__(self, ctrl_pads, mem_depths=(1 << 13, 1 << 13, 1 << 12)):
+    def __init__(self, ctrl_pads, mem_depths=(1 << 13, 1 << 13, 1 << 12),
+                 crc_width=8, fifo=None):
+        if fifo is None:
+            fifo = fifo_depths[len(mem_depths)]
         self.dacs = []
         for i, depth in enumerate(mem_depths):
-            dac = Dac(mem_depth=depth)
+            dac = Dac(fifo=fifo, mem_depth=depth)
             setattr(self.submodules, "dac{}".format(i), dac)
             self.dacs.append(dac)
-        self.submodules.comm = Comm(ctrl_pads, self.dacs)
+        self.submodules.comm = Comm(ctrl_pads, self.dacs, crc_width)
 
 
 class Pdq2Sim(Module):
@@ -86,8 +94,10 @@ class Pdq2Sim(Module):
     def record(self):
         while True:
             yield
-            self.outputs.append((yield from [(yield dac.out.data)
-                                             for dac in self.dut.dacs]))
+            outputs = []
+            for dac in self.dut.dacs:
+                outputs.append((yield dac.out.data))
+            self.outputs.append(outputs)
             self.aux.append((yield self.ctrl_pads.aux))
 
 
@@ -176,9 +186,11 @@ class Pdq2(Pdq2Base):
         Pdq2Base.__init__(self, ctrl_pads, **kwargs)
         self.submodules.crg = CRG(platform)
         comm_pads = platform.request("comm")
-        self.submodules.reader = Ft245r_rx(comm_pads)
+        self.submodules.reader = Ft245r_rx(
+            comm_pads, clk=20., clk2x=self.comm.proto.config.clk2x)
         self.comb += [
                 self.reader.source.connect(self.comm.ftdi_bus),
+                self.comm.proto.status[:8].eq(self.reader.rate),
                 self.crg.rst.eq(self.comm.rg.reset),
                 ctrl_pads.g2_out.eq(self.crg.dcm_locked),
                 self.crg.dcm_sel.eq(self.comm.proto.config.clk2x),
@@ -21,6 +21,7 @@ import numpy as np
 from scipy import interpolate
 
 from .pdq2 import Pdq2
+from .compile import compress
 
 import argparse
 import time
@@ -44,6 +45,10 @@ def get_argparser():
     parser.add_argument("-o", "--order", default=3, type=int,
                         help="interpolation (0: const, 1: lin, 2: quad,"
                         " 3: cubic) [%(default)s]")
+    parser.add_argument("-z", "--tolerance", default=None, type=float,
+                        help="compress the samples into few lines with this "
+                        "maximum error (V) instead of interpolating "
+                        "[%(default)s]")
     parser.add_argument("-a", "--aux-miso", default=False, action="store_true",
                         help="route MISO to AUX/F5 TTL output [%(default)s]")
     parser.add_argument("-k", "--aux-dac", default=0b111, type=int,
@@ -102,22 +107,27 @@ def main(dev=None):
                    trigger=False, aux_miso=args.aux_miso,
                    aux_dac=args.aux_dac, board=0xf)
 
-    dt = np.diff(times.astype(np.int))
-    if args.order:
-        tck = interpolate.splrep(times, voltages, k=args.order, s=0)
-        u = interpolate.spalde(times, tck)
+    if args.tolerance is not None:
+        compressed = compress(times/freq, voltages, args.tolerance, freq,
+                              order=args.order)
+        segment = compressed.lines
     else:
-        u = voltages[:, None]
-    segment = []
-    for dti, ui in zip(dt, u):
-        segment.append({
-            "duration": int(dti),
-            "channel_data": [{
-                "bias": {
-                    "amplitude": [float(uij) for uij in ui]
-                }
-            }]
-        })
+        dt = np.diff(times.astype(int))
+        if args.order:
+            tck = interpolate.splrep(times, voltages, k=args.order, s=0)
+            u = interpolate.spalde(times, tck)
+        else:
+            u = voltages[:, None]
+        segment = []
+        for dti, ui in zip(dt, u):
+            segment.append({
+                "duration": int(dti),
+                "channel_data": [{
+                    "bias": {
+                        "amplitude": [float(uij) for uij in ui]
+                    }
+                }]
+            })
     program = [[] for i in range(dev.channels[args.channel].num_frames)]
     program[args.frame] = segment
     dev.program(program, [args.channel])
@@ -0,0 +1,268 @@
+# Copyright 2013-2016 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Waveform compiler.
+
+Compresses a sampled voltage trace into few polynomial ``bias`` lines.
+
+Each line is fitted directly in the basis the Volt accumulators evaluate
+after ``n`` steps of ``2**shift`` cycles,
+``v0 + n*v1 + C(n, 2)*v2 + C(n, 3)*v3``. The coefficients are quantized
+like :meth:`host.pdq2.Segment.bias` packs them (16, 32, 48 and 48 bit),
+jointly using :func:`host.pdq2.quantize_spline`, and the output of the
+quantized line is evaluated exactly at the sample times. The amplitudes
+of the resulting lines are chosen such that
+:meth:`host.pdq2.Segment.bias` reproduces the quantized coefficients
+after discrete time compensation (:func:`host.pdq2.discrete_compensate`).
+"""
+
+import logging
+
+import numpy as np
+
+from .pdq2 import Pdq2, Segment, quantize_spline
+
+
+logger = logging.getLogger(__name__)
+
+
+# fractional bits of the accumulator coefficients as packed by
+# Segment.bias() and the words used by them
+_frac = [0, 16, 32, 32]
+_words = [1, 2, 3, 3]
+
+
+def _binomials(n, order):
+    """Basis ``C(n, k)`` for ``k <= order``."""
+    n = np.asarray(n, np.int64)
+    basis = [np.ones_like(n)]
+    for k in range(1, order + 1):
+        basis.append(basis[-1]*(n - k + 1)//k)
+    return basis
+
+
+def _evaluate(q, n):
+    """Exact output (DAC LSB) of the Volt accumulators with quantized
+    coefficients ``q`` after ``n`` steps."""
+    acc = np.zeros(len(n), np.uint64)
+    for qk, bk, frac in zip(q, _binomials(n, len(q) - 1), _frac):
+        acc += (np.uint64(qk & (1 << 64) - 1) << np.uint64(32 - frac)
+                )*bk.astype(np.uint64)
+    acc = (acc >> np.uint64(32)).astype(np.int64) & 0xffff
+    return acc - ((acc >> 15) << 16)
+
+
+def _fit(n, y, order):
+    """Fit and quantize the accumulator coefficients.
+
+    Args:
+        n (array[int]): Steps since the line start.
+        y (array[float]): Target output in DAC LSB.
+        order (int): Polynomial order.
+
+    Returns:
+        q (list[int]): Quantized coefficients. ``None`` if they can not be
+            packed.
+        out (array[int]): Output at ``n``.
+    """
+    order = min(order, len(np.unique(n)) - 1)
+    scale = max(int(n[-1]), 1)
+    basis = np.array(_binomials(n, order), np.float64).T
+    norm = np.array([scale**k for k in range(order + 1)], np.float64)
+    # the output is the integer part of the accumulator
+    c = np.linalg.lstsq(basis/norm, y + .5, rcond=None)[0]/norm
+    c, _ = quantize_spline(list(c), scale + 1)
+    q = [int(round(ck*(1 << frac))) for ck, frac in zip(c, _frac)]
+    for qk, frac, words in zip(q, _frac, _words):
+        if not -(1 << 16*words - 1) <= qk < 1 << 16*words - 1:
+            return None, None
+    return q, _evaluate(q, n)
+
+
+class Compressed:
+    """Result of :func:`compress`.
+
+    Attributes:
+        lines (list[dict]): Wavesynth lines for a single channel. See
+            :meth:`host.pdq2.Pdq2.program`.
+        samples (int): Number of samples in the trace.
+        words (int): Number of 16 bit memory words used by the lines.
+        ratio (float): Compression ratio, samples per line.
+        error (float): Maximum absolute deviation of the output at the
+            sample times from the trace. In Volt.
+        output (array[float]): Output at the sample times. In Volt.
+    """
+    def __init__(self, lines, samples, words, output, error):
+        self.lines = lines
+        self.samples = samples
+        self.words = words
+        self.ratio = samples/max(len(lines), 1)
+        self.output = output
+        self.error = error
+
+    def __repr__(self):
+        return ("<Compressed {} samples in {} lines ({} words), "
+                "ratio {:.3g}, error {:.3g} V>").format(
+                    self.samples, len(self.lines), self.words, self.ratio,
+                    self.error)
+
+
+def compress(times, voltages, tolerance, freq=Pdq2.freq, order=3,
+             min_duration=12, trigger=True):
+    """Compress a sampled voltage trace into few ``bias`` lines.
+
+    Starting at the first sample, each line is greedily extended over as
+    many samples as possible while the output of the quantized line stays
+    within ``tolerance`` of the samples it covers. The line end is found by
+    doubling and then bisecting the number of samples covered. The lowest
+    polynomial order that meets the tolerance over the final span is used.
+    Lines longer than :attr:`host.pdq2.Segment.max_time` cycles are given
+    a ``dac_divider`` (``2**shift``) and end on a multiple of it.
+
+    A line starts at the time of its first sample and ends where the next
+    line starts. The last line ends one cycle after the last sample. Lines
+    are at least ``min_duration`` cycles long so that the memory parser can
+    read the next line in time. If even such a line can not meet the
+    tolerance, it is used anyway and :attr:`Compressed.error` exceeds the
+    tolerance. The output is quantized to the DAC resolution, tolerances
+    below half of it can generally not be met.
+
+    Args:
+        times (array[float]): Increasing sample times in seconds. They are
+            rounded to clock cycles, relative to the first sample.
+        voltages (array[float]): Sample voltages in Volt.
+        tolerance (float): Maximum absolute deviation. In Volt.
+        freq (float): Sample clock frequency.
+        order (int): Maximum polynomial order, up to 3.
+        min_duration (int): Minimum line duration in cycles.
+        trigger (bool): Trigger the first line.
+
+    Returns:
+        Compressed: Lines and compression report.
+    """
+    t = np.rint(np.asarray(times, np.float64)*freq).astype(np.int64)
+    t -= t[0]
+    if np.any(np.diff(t) <= 0):
+        raise ValueError("sample times must increase by at least one cycle")
+    v = np.asarray(voltages, np.float64)
+    y = v*Segment.out_scale
+    if len(y) != len(t):
+        raise ValueError("times and voltages must have the same length")
+    if not 0 <= order <= 3:
+        raise ValueError("only splines up to cubic order are supported")
+    tol = tolerance*Segment.out_scale
+    max_steps = Segment.max_time - 1
+    end_time = int(t[-1]) + 1
+
+    def span(start, j):
+        """Line from ``start`` covering up to sample ``j`` (exclusive)."""
+        duration = (int(t[j]) if j < len(t) else end_time) - start
+        shift = 0
+        while duration >> shift > max_steps:
+            shift += 1
+        steps = duration >> shift
+        if j == len(t) and steps << shift < duration:
+            # the last line covers the last sample
+            steps += 1
+            if steps > max_steps:
+                shift += 1
+                steps = -(-duration >> shift)
+        return shift, steps
+
+    def fit(start, i, shift, steps, order):
+        end = start + (steps << shift)
+        k = i + int(np.searchsorted(t[i:], end))
+        if k == i:
+            # a line ending on a multiple of 2**shift may cover no samples
+            return 0., [int(round(y[i]))], np.empty(0, np.int64), k
+        n = (t[i:k] - start) >> shift
+        q, out = _fit(n, y[i:k], order)
+        if q is None:
+            return None
+        err = np.abs(out - y[i:k]).max()
+        return err, q, out, k
+
+    out = np.empty(len(t), np.int64)
+    lines = []
+    words = 0
+    start, i = 0, 0
+    while i < len(t):
+        # first candidate end sample
+        j0 = i + 1 + int(np.searchsorted(t[i + 1:], start + min_duration))
+        j0 = min(j0, len(t))
+
+        def good(j):
+            r = fit(start, i, *span(start, j), order)
+            return r is not None and r[0] <= tol
+
+        lo = j0
+        if good(j0):
+            hi = None
+            step = 1
+            while hi is None:
+                j = min(lo + step, len(t))
+                if j == lo:
+                    break
+                if good(j):
+                    lo = j
+                    step *= 2
+                else:
+                    hi = j
+            while hi is not None and hi - lo > 1:
+                j = (lo + hi)//2
+                if good(j):
+                    lo = j
+                else:
+                    hi = j
+        shift, steps = span(start, lo)
+        for o in range(order + 1):
+            r = fit(start, i, shift, steps, o)
+            if r is not None and (r[0] <= tol or o == order):
+                break
+        if r is None:
+            raise ValueError("can not represent the trace at sample "
+                             "{}".format(i))
+        err, q, o_out, k = r
+        out[i:k] = o_out
+        # invert the discrete time compensation of Segment.bias()
+        c = [qk/(1 << frac) for qk, frac in zip(q, _frac)]
+        if len(c) > 3:
+            c[2] -= c[3]
+            c[1] -= c[3]/6.
+        if len(c) > 2:
+            c[1] -= c[2]/2.
+        line = {
+            "duration": steps,
+            "channel_data": [{"bias": {
+                "amplitude": [ck/Segment.out_scale for ck in c]}}],
+        }
+        if shift:
+            line["dac_divider"] = 1 << shift
+        lines.append(line)
+        words += 2 + sum(_words[:len(q)])
+        start += steps << shift
+        i = k
+    if lines and trigger:
+        lines[0]["trigger"] = True
+    output = out/Segment.out_scale
+    result = Compressed(lines, len(t), words, output,
+                        float(np.abs(output - v).max()))
+    logger.info("%s", result)
+    if result.error > tolerance:
+        logger.warning("tolerance %g V exceeded: %g V", tolerance,
+                       result.error)
+    return result
@@ -0,0 +1,482 @@
+# Copyright 2013-2016 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Software model of the DAC channel output path.
+
+Bit-exact model of :class:`gateware.dac.Dac` (:class:`gateware.dac.Parser`,
+:class:`gateware.dac.Sequencer`, :class:`gateware.dac.Volt` and
+:class:`gateware.dac.Dds` including the pipelined CORDIC) that renders the
+output of a channel memory image as produced by
+:meth:`host.pdq2.Channel.serialize`.
+
+Instead of stepping every clock cycle, the times at which lines are
+accepted are computed per line and the accumulators are evaluated in
+closed form: after ``n`` increments the chained accumulators
+``v0 += v1, v1 += v2, v2 += v3`` hold
+``v0 + n*v1 + C(n, 2)*v2 + C(n, 3)*v3``. The output can thus be evaluated
+at arbitrary cycles without stepping through the cycles in between.
+"""
+
+from math import atan, pi, sqrt
+
+import numpy as np
+
+
+_mask16 = (1 << 16) - 1
+_mask32 = (1 << 32) - 1
+_mask48 = (1 << 48) - 1
+
+
+def _signed(v, bits):
+    """Interpret the low ``bits`` of integer array ``v`` as signed."""
+    v = np.asarray(v, np.int64) & ((1 << bits) - 1)
+    return v - ((v >> (bits - 1)) << bits)
+
+
+class Line:
+    """A line decoded from channel memory.
+
+    Args:
+        mem (array[uint16]): Channel memory.
+        addr (int): Address of the line header.
+
+    Attributes:
+        addr (int): Address of the line header.
+        length (int): Number of words following the header.
+        typ, trigger, silence, aux, shift, end, clear, wait: Header
+            fields. See :meth:`host.pdq2.Segment.line`.
+        dt (int): Duration field.
+        data (list[int]): The 14 data words, zero padded.
+        duration (int): Duration in units of ``2**shift`` cycles.
+            A duration field of zero is executed as ``1 << 16``.
+    """
+    def __init__(self, mem, addr):
+        header = int(mem[addr])
+        self.addr = addr
+        self.length = header & 0xf
+        if not self.length:
+            raise ValueError("invalid line at {:#06x}".format(addr))
+        self.typ = header >> 4 & 3
+        self.trigger = bool(header >> 6 & 1)
+        self.silence = bool(header >> 7 & 1)
+        self.aux = bool(header >> 8 & 1)
+        self.shift = header >> 9 & 0xf
+        self.end = bool(header >> 13 & 1)
+        self.clear = bool(header >> 14 & 1)
+        self.wait = bool(header >> 15 & 1)
+        words = [int(w) for w in mem[addr + 1:addr + 1 + self.length]]
+        words += [0] * (self.length - len(words))
+        self.dt = words[0]
+        self.data = words[1:] + [0] * (15 - self.length)
+        self.duration = ((self.dt - 1) & _mask16) + 1
+
+    def coefficients(self):
+        """Spline coefficients as loaded into the accumulators.
+
+        Returns:
+            x (list[int]): Amplitude accumulators (48 bit).
+            z (list[int]): Phase offset, frequency and chirp accumulators
+                (32 bit). Only meaningful for DDS lines.
+        """
+        d = self.data
+        x = [d[0] << 32, (d[1] | d[2] << 16) << 16,
+             d[3] | d[4] << 16 | d[5] << 32,
+             d[6] | d[7] << 16 | d[8] << 32]
+        z = [d[9] << 16, d[10] | d[11] << 16, d[12] | d[13] << 16]
+        return x, z
+
+    def __repr__(self):
+        return "<Line {:#06x} typ={} dt={} shift={}{}{}{}>".format(
+            self.addr, self.typ, self.dt, self.shift,
+            " trigger" if self.trigger else "",
+            " wait" if self.wait else "", " end" if self.end else "")
+
+
+def parse_frame(mem, frame):
+    """Decode the lines of a frame.
+
+    Args:
+        mem (array[uint16]): Channel memory.
+        frame (int): Frame index.
+
+    Returns:
+        lines (list[Line]): The lines from the frame address table entry up
+            to and including the first line with the ``end`` flag.
+            Empty if the frame address table entry is zero.
+    """
+    addr = int(mem[frame])
+    lines = []
+    while addr:
+        line = Line(mem, addr)
+        lines.append(line)
+        if line.end:
+            break
+        addr += 1 + line.length
+    return lines
+
+
+class Cordic:
+    """Model of the pipelined, four quadrant, rotating CORDIC used by
+    :class:`gateware.dac.Dds`.
+
+    Args:
+        width (int): Data width.
+        guard (int): Guard bits.
+        stages (int): Number of stages. Also the latency in cycles.
+
+    Attributes:
+        gain (float): Amplitude gain.
+    """
+    chunk = 1 << 16
+
+    def __init__(self, width=16, guard=4, stages=17):
+        self.width = width
+        self.guard = guard
+        self.stages = stages
+        bits = width + guard
+        self.a = [round(atan(2**-i)*2**(bits - 1)/pi) for i in range(stages)]
+        self.gain = 1.
+        for i in range(stages):
+            self.gain *= sqrt(1 + 2**(-2*i))
+
+    def __call__(self, xi, zi):
+        """Rotate ``(xi, 0)`` by ``zi``.
+
+        Args:
+            xi (array[int]): Signed input amplitude.
+            zi (array[int]): Signed input phase. Full scale is a full turn.
+
+        Returns:
+            xo (array[int]): Signed output.
+        """
+        w, g = self.width, self.guard
+        xi = _signed(xi, w)
+        zi = _signed(zi, w)
+        xo = np.zeros(xi.shape, np.int64)
+        # zero amplitude remains zero
+        nz = np.flatnonzero(xi)
+        for i in range(0, len(nz), self.chunk):
+            j = nz[i:i + self.chunk]
+            xo[j] = self._rotate(xi[j], zi[j])
+        return xo
+
+    def _rotate(self, xi, zi):
+        w, g = self.width, self.guard
+        # quadrant mapping
+        q = ((zi >> w - 2) ^ (zi >> w - 1)) & 1 == 1
+        x = (_signed(np.where(q, -xi, xi), w) << g).astype(np.int32)
+        z = (_signed(np.where(q, zi + (1 << w - 1), zi), w) << g
+             ).astype(np.int32)
+        y = np.zeros_like(x)
+        # the x and y registers can only overflow for large amplitudes
+        wrap = np.abs(xi).max()*self.gain >= (1 << w - 1) - 2
+        for i, a in enumerate(self.a):
+            d = z >> w + g - 1 | 1  # -1 if z < 0 else 1
+            x, y, z = x - d*(y >> i), y + d*(x >> i), z - d*a
+            if wrap:
+                x, y = _signed(x, w + g), _signed(y, w + g)
+        return _signed(x >> g, w)
+
+
+def _binomials(n):
+    n = np.asarray(n, np.uint64)
+    n2 = n*(n - np.uint64(1))//np.uint64(2)
+    n3 = n2*(n - np.uint64(2))//np.uint64(3)
+    return n, n2, n3
+
+
+def _evaluate(v, n):
+    """Value of the first of the chained accumulators ``v`` after ``n``
+    increments (modulo ``2**64``)."""
+    n1, n2, n3 = _binomials(n)
+    return v[0] + n1*v[1] + n2*v[2] + n3*v[3]
+
+
+def _advance(v, n):
+    """State of the chained accumulators ``v`` after ``n`` increments."""
+    n2 = n*(n - 1)//2
+    n3 = n2*(n - 2)//3
+    return [(v[0] + n*v[1] + n2*v[2] + n3*v[3]) & _mask48,
+            (v[1] + n*v[2] + n2*v[3]) & _mask48,
+            (v[2] + n*v[3]) & _mask48,
+            v[3]]
+
+
+def _increments(u, shift, n_max, extra):
+    """Number of increments ``u`` cycles into a line and their sum over
+    the first ``u`` cycles.
+
+    Increments happen at the end of each ``2**shift`` cycle step except for
+    the last one and, if ``u >= extra``, once more.
+
+    Works on integers and (broadcasting) integer arrays.
+    """
+    step = 1 << shift
+    n = np.minimum(u >> shift, n_max) + (u >= extra)
+    # sum of min(j >> shift, n_max) for j < u
+    limit = (n_max + 1) << shift
+    m = np.minimum(u, limit)
+    q, r = m >> shift, m & (step - 1)
+    total = (step*(q*(q - 1)//2) + q*r + n_max*np.maximum(u - limit, 0) +
+             np.maximum(u - extra, 0))
+    return n, total
+
+
+# depths of the line FIFOs of :class:`gateware.pdq2.Pdq2Base` by number of
+# DACs: the memories use all block RAM, the FIFOs use distributed RAM
+fifo_depths = [None, 16, 8, 4]
+
+
+class Dac:
+    """Model of a :class:`gateware.dac.Dac`.
+
+    The parser and sequencer are armed and started at a given cycle and
+    remain so. The frame selection is constant. Repeat and call lines are
+    executed like the parser does.
+
+    Args:
+        mem (bytes or array[uint16]): Channel memory image.
+        fifo (int): Depth of the line FIFO between parser and sequencer.
+
+    Attributes:
+        mem (array[uint16]): Channel memory.
+        fifo (int): Depth of the line FIFO.
+        cordic (Cordic): CORDIC model.
+        stack_depth (int): Return stack depth of the parser.
+    """
+    chunk = 1 << 16
+    stack_depth = 4
+
+    def __init__(self, mem, fifo=0):
+        if isinstance(mem, (bytes, bytearray)):
+            mem = np.frombuffer(mem, "<u2")
+        self.mem = np.asarray(mem, np.uint16)
+        self.fifo = fifo
+        self.cordic = Cordic()
+
+    def schedule(self, cycles, frame=0, start=0, trigger=True):
+        """Compute the cycles at which lines are accepted.
+
+        The lines are followed one by one: the cost is linear in the number
+        of lines (including repeat and call lines) executed before
+        ``cycles``, not in the number of cycles.
+
+        Args:
+            cycles (int): Number of cycles to consider.
+            frame (int): Frame selection.
+            start (int): Cycle from which on the parser and sequencer are
+                armed and started.
+            trigger (bool or array[bool]): Trigger input. Either constant or
+                one value per cycle.
+
+        Returns:
+            schedule (list[tuple[int, Line]]): Acceptance cycle and line.
+        """
+        if np.ndim(trigger):
+            triggers = np.flatnonzero(trigger)
+        elif trigger:
+            triggers = None
+        else:
+            triggers = np.array([], np.int64)
+        first = int(self.mem[frame])
+        lines = {}
+        schedule = []
+        ready = start
+        wait = False
+        repeat = 0
+        stack = []
+        # the parser leaves the jump state at `start`, reads the frame
+        # table and the header, then one cycle per word
+        avail = start + 3
+        addr = first
+        while first:
+            line = lines.get(addr)
+            if line is None:
+                line = lines[addr] = Line(self.mem, addr)
+            t = avail + line.length
+            if line.typ == 2:
+                # repeat and call lines are executed by the parser
+                if t >= cycles:
+                    break
+                avail = t + 2
+                if line.shift == 1:
+                    if len(stack) < self.stack_depth:
+                        stack.append((addr + 1 + line.length, repeat))
+                    repeat = 0
+                    addr = line.data[0]
+                    continue
+                repeat = (line.dt - 1 if repeat == 0 else repeat - 1
+                          ) & _mask16
+                addr += 1 + line.length
+                if repeat:
+                    addr -= line.data[0]
+                elif line.end and stack:
+                    addr, repeat = stack.pop()
+                elif line.end:
+                    # the parser waits for the FIFO to drain
+                    if schedule:
+                        t = max(t, schedule[-1][0])
+                    avail = t + 4
+                    addr = first
+                continue
+            if self.fifo:
+                # the line enters the FIFO once the line `fifo` lines
+                # before it has left and is available a cycle later
+                if len(schedule) >= self.fifo:
+                    t = max(t, schedule[-self.fifo][0] + 1)
+                w, t = t, t + 1
+            t = max(t, ready)
+            if (wait or line.trigger) and triggers is not None:
+                i = np.searchsorted(triggers, t)
+                if i == len(triggers):
+                    break
+                t = int(triggers[i])
+            if t >= cycles:
+                break
+            if not self.fifo:
+                # the parser holds the line until it is accepted
+                w = t
+            schedule.append((t, line))
+            ready = t + (line.duration << line.shift)
+            wait = line.wait
+            if line.end and stack:
+                avail = w + 2
+                addr, repeat = stack.pop()
+            elif line.end:
+                # the parser waits until the line has been accepted
+                avail = t + 4
+                addr = first
+                repeat = 0
+            else:
+                avail = w + 2
+                addr += 1 + line.length
+        return schedule
+
+    def _lines(self, schedule, cycles):
+        """Compute the accumulator state of each line when it starts
+        executing.
+
+        Returns:
+            lines (dict[str, array]): Line parameters, the first entry
+                represents the reset state before the first line.
+        """
+        v = [0]*4  # volt accumulators
+        x = [0]*4  # dds amplitude accumulators
+        z = [0]*3  # dds phase offset, frequency, chirp
+        za = 0  # dds phase accumulator
+        rows = [(-1, 0, 0, cycles, v, x, z, za)]
+        for k, (a, line) in enumerate(schedule):
+            # the registers load after the acceptance cycle, the phase
+            # accumulator still uses the previous frequency
+            if line.typ == 1 and line.clear:
+                za = 0
+            else:
+                za = (za + z[1]) & _mask32
+            if line.typ == 0:
+                v = line.coefficients()[0]
+            elif line.typ == 1:
+                x, z = line.coefficients()
+            n_max = line.duration - 1
+            # without shift the accumulators increment once more if the next
+            # line is not accepted at the end of this one
+            end = line.duration << line.shift
+            if k + 1 < len(schedule):
+                b = schedule[k + 1][0]
+            else:
+                b = cycles
+            if line.shift == 0 and n_max > 0 and b > a + end:
+                extra = end
+            else:
+                extra = cycles
+            rows.append((a, line.shift, n_max, extra, v, x, z, za))
+            # state at the next acceptance
+            n, total = _increments(b - 1 - a, line.shift, n_max, extra)
+            n, total = int(n), int(total)
+            v, x = _advance(v, n), _advance(x, n)
+            za = (za + (b - 1 - a)*z[1] + total*z[2]) & _mask32
+            z = [z[0], (z[1] + n*z[2]) & _mask32, z[2]]
+        a, shift, n_max, extra, v, x, z, za = zip(*rows)
+        return dict(
+            a=np.array(a, np.int64), shift=np.array(shift, np.int64),
+            n_max=np.array(n_max, np.int64), extra=np.array(extra, np.int64),
+            v=np.array(v, np.uint64).T, x=np.array(x, np.uint64).T,
+            z=np.array(z, np.uint64).T, za=np.array(za, np.uint64))
+
+    def _registers(self, lines, t):
+        """Evaluate the Volt output and the CORDIC inputs at cycles ``t``."""
+        k = np.searchsorted(lines["a"][1:], t) if len(t) else t
+        u = np.maximum(t - 1 - lines["a"][k], 0)
+        n, total = _increments(u, lines["shift"][k], lines["n_max"][k],
+                               lines["extra"][k])
+        volt = _evaluate(lines["v"][:, k], n)
+        amp = _evaluate(lines["x"][:, k], n)
+        z = lines["z"][:, k]
+        phase = (lines["za"][k] + np.asarray(u, np.uint64)*z[1] +
+                 np.asarray(total, np.uint64)*z[2]) >> np.uint64(16)
+        phase += z[0] >> np.uint64(16)
+        return (_signed(volt >> np.uint64(32), 16),
+                _signed(amp >> np.uint64(32), 16), _signed(phase, 16))
+
+    def evaluate(self, t, frame=0, start=0, trigger=True):
+        """Evaluate the DAC output at arbitrary cycles.
+
+        Apart from computing the :meth:`schedule` up to the last evaluated
+        cycle, which is linear in the number of lines executed, the cost is
+        independent of the number of cycles between the evaluated cycles.
+
+        Args:
+            t (array[int]): Cycles to evaluate the output at.
+            frame, start, trigger: See :meth:`schedule`.
+
+        Returns:
+            out (array[int16]): Output data at each cycle.
+        """
+        t = np.asarray(t, np.int64)
+        cycles = int(t.max()) + 1 if t.size else 0
+        lines = self._lines(self.schedule(cycles, frame, start, trigger),
+                            cycles)
+        # output register, CORDIC pipeline latency
+        volt, _, _ = self._registers(lines, t - 1)
+        td = t - 1 - self.cordic.stages
+        _, amp, phase = self._registers(lines, td)
+        dds = np.where(td >= 0, self.cordic(amp, phase), 0)
+        out = np.where(t >= 1, volt + dds, 0)
+        return _signed(out, 16).astype(np.int16)
+
+    def run(self, cycles, frame=0, start=0, trigger=True):
+        """Render the DAC output.
+
+        Args:
+            cycles (int): Number of cycles to render.
+            frame, start, trigger: See :meth:`schedule`.
+
+        Returns:
+            out (array[int16]): Output data for each cycle.
+        """
+        lines = self._lines(self.schedule(cycles, frame, start, trigger),
+                            cycles)
+        volt = np.empty(cycles, np.int64)
+        dds = np.empty(cycles, np.int64)
+        for i in range(0, cycles, self.chunk):
+            j = min(i + self.chunk, cycles)
+            volt[i:j], amp, phase = self._registers(lines, np.arange(i, j))
+            dds[i:j] = self.cordic(amp, phase)
+        # CORDIC pipeline latency and output register
+        lat = self.cordic.stages
+        volt[lat:] += dds[:cycles - lat]
+        out = np.concatenate([[0], volt[:-1]])
+        return _signed(out, 16).astype(np.int16)
@@ -15,12 +15,25 @@
 # You should have received a copy of the GNU General Public License
 # along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
 
-from math import log, sqrt
+from math import factorial, log, sqrt
+import asyncio
+import binascii
+from collections import OrderedDict
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import hashlib
+import json
 import logging
+import os
 import struct
+import zlib
 
+import numpy as np
 import serial
 
+from .emulator import Dac, fifo_depths
+
 
 logger = logging.getLogger(__name__)
 
@@ -44,6 +57,106 @@ def discrete_compensate(c):
         raise ValueError("Only splines up to cubic order are supported.")
 
 
+def _binomial_polynomials(order):
+    """``C(x, k)`` as polynomials in ``x`` for ``k <= order``."""
+    basis = [np.polynomial.Polynomial([1.])]
+    for k in range(1, order + 1):
+        basis.append(basis[-1]*np.polynomial.Polynomial([1. - k, 1.])/k)
+    return basis
+
+
+def quantize_spline(coef, duration, widths=(0, 1, 2, 2), search=1):
+    """Jointly quantize compensated spline coefficients.
+
+    Rounding the coefficients independently leads to a deviation that
+    grows like ``C(n, k)`` with the number of steps ``n``. Instead, the
+    highest order coefficient is rounded (trying the ``search`` nearest
+    neighbors as well) and the rounding error is successively compensated
+    by the lower order coefficients before rounding them. Each
+    compensation is a least squares fit at Chebyshev nodes over the
+    duration of the line, approximating the minimax deviation.
+
+    Args:
+        coef (list[float]): Accumulator coefficients after
+            :func:`discrete_compensate` in units of the least significant
+            bit of the accumulator output.
+        duration (int): Number of steps the line is executed for.
+        widths (list[int]): Widths of the coefficients in multiples of 16
+            bits, see :meth:`Segment.pack`.
+        search (int): Number of neighbors of the rounded highest order
+            coefficient to try on each side.
+
+    Returns:
+        q (list[float]): Quantized coefficients. :meth:`Segment.pack`
+            packs them exactly.
+        error (float): Maximum absolute deviation of the accumulator
+            output from the unquantized spline over the duration of the
+            line.
+    """
+    order = len(coef) - 1
+    if order < 0:
+        return [], 0.
+    scale = [float(1 << 16*width) for width in widths]
+    basis = _binomial_polynomials(order)
+    last = max(duration - 1, 0)
+    nodes = np.unique(np.rint(last/2*(1 - np.cos(
+        np.linspace(0, np.pi, min(duration, 4*order + 8))))))
+    values = np.array([b(nodes) for b in basis])
+
+    def error(residual):
+        # extrema are at the ends or next to the roots of the derivative
+        x = [0., float(last)]
+        for root in residual.deriv().roots():
+            if abs(root.imag) < 1e-9 and 0 < root.real < last:
+                x += [np.floor(root.real), np.ceil(root.real)]
+        return float(np.abs(residual(np.array(x))).max())
+
+    best = None
+    top = round(coef[order]*scale[order])
+    for d in range(-search, search + 1):
+        q = [0.]*(order + 1)
+        q[order] = (top + d)/scale[order]
+        residual = (q[order] - coef[order])*basis[order]
+        for k in range(order - 1, -1, -1):
+            a = values[:k + 1].T
+            norm = np.abs(a).max(axis=0)
+            fix = np.linalg.lstsq(a/norm, -residual(nodes), rcond=None)[0]
+            q[k] = round((coef[k] + fix[k]/norm[k])*scale[k])/scale[k]
+            residual = residual + (q[k] - coef[k])*basis[k]
+        e = error(residual)
+        if best is None or e < best[1]:
+            best = q, e
+    return best
+
+
+def dirty_ranges(old, new, gap=0):
+    """Find the ranges of 16 bit words that differ between two memory
+    images.
+
+    Args:
+        old (bytes): Previous memory content. Words beyond its end are
+            considered different.
+        new (bytes): New memory content.
+        gap (int): Merge ranges that are separated by at most this many
+            unchanged words.
+
+    Returns:
+        ranges (list[tuple[int, int]]): Start and end (exclusive) word
+            addresses of the ranges in ``new`` that need to be written.
+    """
+    new = np.frombuffer(new, "<u2")
+    n = min(len(old)//2, len(new))
+    diff = np.ones(len(new) + 2, np.int8)
+    diff[0] = diff[-1] = 0
+    diff[1:n + 1] = new[:n] != np.frombuffer(old, "<u2", n)
+    edges = np.flatnonzero(np.diff(diff))
+    start, end = edges[::2], edges[1::2]
+    keep = start[1:] - end[:-1] > gap
+    start = np.concatenate([start[:1], start[1:][keep]])
+    end = np.concatenate([end[:-1][keep], end[-1:]])
+    return list(zip(start.tolist(), end.tolist()))
+
+
 class CRC:
     """Generic and simple table driven CRC calculator.
 
@@ -56,15 +169,51 @@ class CRC:
 
     Handle any variation on those details outside this class.
 
+    Long messages are processed with a vectorized slice-by-N table engine:
+    blocks of ``slices`` data words are reduced with one table per position
+    and the block checksums are then combined pairwise using the linearity
+    of the CRC. For CRC-16-CCITT and CRC-32 the C implementations in
+    :mod:`binascii` and :mod:`zlib` are used.
+
     >>> r = CRC(0x1814141AB)(b"123456789")  # crc-32q
     >>> assert r == 0x3010BF7F, hex(r)
+
+    Args:
+        poly (int): Full polynomial.
+        data_width (int): Width of the message words in bits.
+        slices (int): Number of data words per block in the vectorized
+            engine. Must be a power of two.
+        threshold (int): Minimum message length for the vectorized engine.
+            Defaults to a value suitable for the CRC and data widths.
     """
-    def __init__(self, poly, data_width=8):
+    def __init__(self, poly, data_width=8, slices=16, threshold=None):
         self.poly = poly
         self.crc_width = poly.bit_length() - 1
         self.data_width = data_width
         self._table = [self._one(i << self.crc_width - data_width)
                        for i in range(1 << data_width)]
+        self.slices = slices
+        if threshold is None:
+            threshold = 2048 if self.crc_width == data_width else 256
+        self.threshold = threshold
+        self._accel = None
+        if data_width == 8:
+            if poly == 0x11021:
+                self._accel = self._crc_hqx
+            elif poly == 0x104c11db7:
+                self._accel = self._crc32
+        self._powers = []
+        self._tables = {}
+        self._dtype = None
+        if data_width == 8 and 8 <= self.crc_width <= 64:
+            self._dtype = np.min_scalar_type((1 << self.crc_width) - 1)
+            self._powers.append([self._step(1 << i)
+                                 for i in range(self.crc_width)])
+            self._index = np.arange(slices)
+            self._slices = np.array([
+                self._apply_tables(self._advance_tables(slices - 1 - i),
+                                   np.array(self._table, self._dtype))
+                for i in range(slices)], self._dtype)
 
     def _one(self, i):
         for j in range(self.data_width):
@@ -73,7 +222,99 @@ class CRC:
                 i ^= self.poly
         return i
 
+    def _step(self, crc, data=0):
+        p = data ^ crc >> self.crc_width - self.data_width
+        q = crc << self.data_width & (1 << self.crc_width) - 1
+        return self._table[p] ^ q
+
+    @staticmethod
+    def _apply(cols, crc):
+        r = 0
+        for col in cols:
+            if crc & 1:
+                r ^= col
+            crc >>= 1
+        return r
+
+    def _power(self, i):
+        # linear map advancing the CRC by 2**i zero words
+        while len(self._powers) <= i:
+            cols = self._powers[-1]
+            self._powers.append([self._apply(cols, col) for col in cols])
+        return self._powers[i]
+
+    def _advance(self, crc, n):
+        i = 0
+        while n:
+            if n & 1:
+                crc = self._apply(self._power(i), crc)
+            n >>= 1
+            i += 1
+        return crc
+
+    def _advance_tables(self, n):
+        # byte lookup tables advancing the CRC by n zero words
+        try:
+            return self._tables[n]
+        except KeyError:
+            pass
+        cols = [self._advance(1 << i, n) for i in range(self.crc_width)]
+        cols += [0]*(-len(cols) % 8)
+        tables = []
+        for i in range(0, self.crc_width, 8):
+            table = [0]*256
+            for j in range(1, 256):
+                k = j & -j
+                table[j] = table[j ^ k] ^ cols[i + k.bit_length() - 1]
+            tables.append(np.array(table, self._dtype))
+        self._tables[n] = tables
+        return tables
+
+    def _apply_tables(self, tables, crc):
+        r = tables[0][crc & 0xff]
+        for i, table in enumerate(tables[1:]):
+            r ^= table[crc >> 8*(i + 1) & 0xff]
+        return r
+
+    def _fast(self, msg, crc):
+        n = self.slices
+        data = np.frombuffer(msg, np.uint8)
+        pad = -len(data) % n
+        if pad:
+            # leading zeros do not change a CRC with zero initial value
+            data = np.concatenate([np.zeros(pad, np.uint8), data])
+        r = np.bitwise_xor.reduce(
+            self._slices[self._index, data.reshape(-1, n)], axis=1)
+        while len(r) > 1:
+            if len(r) & 1:
+                r = np.concatenate([np.zeros(1, self._dtype), r])
+            r = r.reshape(-1, 2)
+            r = self._apply_tables(self._advance_tables(n), r[:, 0]) ^ r[:, 1]
+            n *= 2
+        return int(r[0]) ^ self._advance(crc, len(msg))
+
+    @staticmethod
+    def _crc_hqx(msg, crc):
+        return binascii.crc_hqx(msg, crc)
+
+    @staticmethod
+    def _crc32(msg, crc):
+        crc = int("{:032b}".format(crc)[::-1], 2)
+        crc = zlib.crc32(bytes(msg).translate(_bit_reverse), crc ^ 0xffffffff)
+        return int("{:032b}".format(crc ^ 0xffffffff)[::-1], 2)
+
     def __call__(self, msg, crc=0):
+        if self._accel is not None or (self._dtype is not None and
+                                       len(msg) >= self.threshold):
+            if not isinstance(msg, (bytes, bytearray, memoryview)):
+                msg = bytes(msg)
+            if self._accel is not None:
+                return self._accel(msg, crc)
+            return self._fast(msg, crc)
+        if self.crc_width == self.data_width:
+            for data in msg:
+                crc = self._table[data ^ crc]
+            return crc
         for data in msg:
             p = data ^ crc >> self.crc_width - self.data_width
             q = crc << self.data_width & (1 << self.crc_width) - 1
@@ -81,7 +322,12 @@ class CRC:
         return crc
 
 
+_bit_reverse = bytes(int("{:08b}".format(i)[::-1], 2) for i in range(256))
+
+
 crc8 = CRC(0x107)
+crc16 = CRC(0x11021)
+crc32 = CRC(0x104c11db7)
 
 
 class Segment:
@@ -94,7 +340,13 @@ class Segment:
         out_scale (float): Steps per Volt.
         cordic_gain (float): CORDIC amplitude gain.
         addr (int): Address assigned to this segment.
-        data (bytes): Serialized segment data.
+        data (bytearray): Serialized segment data.
+        calls (list[tuple[int, Segment]]): Byte offsets of the addresses of
+            the call lines in :attr:`data` and the segments they call.
+        errors (list[tuple[int, float]]): Byte offset in :attr:`data` at the
+            time it was appended and maximum quantization deviation (in
+            units of the DAC output resolution) of each line appended with
+            ``optimize``. See :func:`quantize_spline`.
     """
     max_time = 1 << 16  # uint16 timer
     max_val = 1 << 15  # int16 DAC
@@ -105,8 +357,10 @@ class Segment:
         cordic_gain *= sqrt(1 + 2**(-2*i))
 
     def __init__(self):
-        self.data = b""
+        self.data = bytearray()
         self.addr = None
+        self.calls = []
+        self.errors = []
 
     def line(self, typ, duration, data, trigger=False, silence=False,
              aux=False, shift=0, jump=False, clear=False, wait=False):
@@ -130,6 +384,8 @@ class Segment:
         """
         assert len(data) % 2 == 0, data
         assert len(data)//2 <= 14
+        if not 0 <= duration < self.max_time:
+            raise ValueError("line duration out of range, see span()")
         # assert dt*(1 << shift) > 1 + len(data)//2
         header = (
             1 + len(data)//2 | (typ << 4) | (trigger << 6) | (silence << 7) |
@@ -138,6 +394,144 @@ class Segment:
         )
         self.data += struct.pack("<HH", header, duration) + data
 
+    def lines(self):
+        """Byte offsets of the lines in :attr:`data`.
+
+        Returns:
+            offsets (list[int]): Offset of each line header.
+        """
+        offsets = []
+        i = 0
+        while i < len(self.data):
+            offsets.append(i)
+            i += 2 + 2*(self.data[i] & 0xf)
+        return offsets
+
+    def repeat(self, lines, count, jump=False):
+        """Append a line that repeats the preceding lines.
+
+        The repeat line is executed by the memory parser and takes four
+        cycles to read after each execution of the repeated lines.
+        Repeats can not be nested.
+
+        Args:
+            lines (int): Number of preceding lines to repeat.
+            count (int): Total number of executions of these lines. Up to
+                :attr:`max_time`.
+            jump (bool): Return to the frame address table after the last
+                execution.
+        """
+        offsets = self.lines()
+        if not 0 < lines <= len(offsets):
+            raise ValueError("invalid number of lines to repeat")
+        if not 0 < count <= self.max_time:
+            raise ValueError("repeat count out of range")
+        start = offsets[-lines]
+        if any(self._is_repeat(self.data, i) for i in offsets[-lines:]):
+            raise ValueError("repeats can not be nested")
+        words = (len(self.data) - start)//2 + 3
+        self.line(typ=2, duration=count & 0xffff,
+                  data=struct.pack("<H", words), jump=jump)
+
+    @staticmethod
+    def _is_repeat(data, i):
+        """Whether the line at byte offset ``i`` is a repeat line."""
+        return data[i] >> 4 & 3 == 2 and data[i + 1] >> 1 & 0xf == 0
+
+    def call(self, target):
+        """Append a line that calls another segment.
+
+        Execution continues at the first line of ``target`` up to and
+        including its first line with the ``jump`` flag and then returns to
+        the line after the call line. The call line is executed by the
+        memory parser and takes four cycles to read. The address of
+        ``target`` is filled in by :meth:`Channel.link`.
+
+        Args:
+            target (Segment): Segment to call. It must belong to the same
+                :class:`Channel`.
+        """
+        self.line(typ=2, duration=1, data=b"\x00\x00", shift=1)
+        self.calls.append((len(self.data) - 2, target))
+
+    def _key(self, start=0):
+        """Data from byte offset ``start`` on with the call addresses
+        cleared and the calls relative to ``start``. Segments with equal
+        keys execute identically once linked."""
+        data = bytearray(self.data[start:])
+        calls = []
+        for offset, target in self.calls:
+            if offset >= start:
+                data[offset - start:offset - start + 2] = b"\x00\x00"
+                calls.append((offset - start, id(target)))
+        return bytes(data), tuple(calls)
+
+    def fold(self, max_lines=16):
+        """Fold repeated sequences of lines into repeat lines.
+
+        Consecutive identical copies of a sequence of up to ``max_lines``
+        lines are replaced by a single copy followed by a repeat line (see
+        :meth:`repeat`) if that saves memory. Sequences that contain lines
+        with the ``jump`` flag are not folded. A sequence is only folded if
+        its last line is long enough to hide the additional four cycles
+        needed to read the repeat line, so that the output is unchanged.
+        Segments that already contain repeat or call lines are left
+        untouched.
+
+        Args:
+            max_lines (int): Maximum length of the repeated sequences.
+
+        Returns:
+            saved (int): Number of 16 bit words saved.
+        """
+        offsets = self.lines() + [len(self.data)]
+        lines = [bytes(self.data[a:b]) for a, b in zip(offsets, offsets[1:])]
+        if any(line[0] >> 4 & 3 == 2 for line in lines):
+            return 0
+
+        def cycles(line):
+            header, dt = struct.unpack_from("<HH", line)
+            return (((dt - 1) & 0xffff) + 1) << (header >> 9 & 0xf)
+
+        n = len(lines)
+        data = bytearray()
+        i = 0
+        while i < n:
+            best = None
+            for p in range(1, min(max_lines, (n - i)//2) + 1):
+                block = lines[i:i + p]
+                if block[-1][1] >> 5 & 1:  # jump
+                    break
+                k = 1
+                while (k < self.max_time and i + (k + 1)*p <= n and
+                        lines[i + k*p:i + (k + 1)*p] == block):
+                    k += 1
+                words = sum(len(line) for line in block)//2
+                saved = (k - 1)*words - 3
+                if k < 2 or saved <= 0 or (best and saved <= best[0]):
+                    continue
+                # the parser needs two cycles plus one per word to read
+                # the next line; the repeat line adds four
+                after = [block[0]]
+                if i + k*p < n:
+                    after.append(lines[i + k*p])
+                if cycles(block[-1]) >= 6 + max(
+                        line[0] & 0xf for line in after):
+                    best = saved, p, k
+            if best is None:
+                data += lines[i]
+                i += 1
+                continue
+            saved, p, k = best
+            block = b"".join(lines[i:i + p])
+            data += block
+            data += struct.pack("<HHH", 2 | 2 << 4, k & 0xffff,
+                                len(block)//2 + 3)
+            i += k*p
+        saved = (len(self.data) - len(data))//2
+        self.data = data
+        return saved
+
     @staticmethod
     def pack(widths, values):
         """Pack spline data.
@@ -167,21 +561,32 @@ class Segment:
                          values, widths, ud, fmt, e)
             raise e
 
-    def bias(self, amplitude=[], **kwargs):
+    def _quantize(self, coef, duration):
+        """Jointly quantize amplitude coefficients and record the error."""
+        coef, error = quantize_spline(coef, duration or self.max_time)
+        self.errors.append((len(self.data), error))
+        return coef
+
+    def bias(self, amplitude=[], optimize=False, **kwargs):
         """Append a bias line to this segment.
 
         Args:
             amplitude (list[float]): Amplitude coefficients in in Volts and
                 increasing powers of ``1/(2**shift*clock_period)``.
                 Discrete time compensation will be applied.
+            optimize (bool): Quantize the coefficients jointly to minimize
+                the deviation over the duration of the line instead of
+                rounding them independently. See :func:`quantize_spline`.
             **kwargs: Passed to :meth:`line`.
         """
         coef = [self.out_scale*a for a in amplitude]
         discrete_compensate(coef)
+        if optimize:
+            coef = self._quantize(coef, kwargs["duration"])
         data = self.pack([0, 1, 2, 2], coef)
         self.line(typ=0, data=data, **kwargs)
 
-    def dds(self, amplitude=[], phase=[], **kwargs):
+    def dds(self, amplitude=[], phase=[], optimize=False, **kwargs):
         """Append a DDS line to this segment.
 
         Args:
@@ -193,17 +598,209 @@ class Segment:
                 ``phase[0]`` in ``turns``,
                 ``phase[1]`` in ``turns/clock_period``,
                 ``phase[2]`` in ``turns/(clock_period**2*2**shift)``.
+            optimize (bool): Quantize the amplitude coefficients jointly,
+                see :meth:`bias`.
             **kwargs: Passed to :meth:`line`.
         """
         scale = self.out_scale/self.cordic_gain
         coef = [scale*a for a in amplitude]
         discrete_compensate(coef)
+        if optimize:
+            coef = self._quantize(coef, kwargs["duration"])
         if phase:
             assert len(amplitude) == 4
         coef += [p*self.max_val*2 for p in phase]
         data = self.pack([0, 1, 2, 2, 0, 1, 1], coef)
         self.line(typ=1, data=data, **kwargs)
 
+    def span(self, target, duration, shift=0, trigger=False, wait=False,
+             clear=False, **kwargs):
+        """Append a bias or DDS line of arbitrary duration.
+
+        Lines of less than :attr:`max_time` steps are appended unchanged.
+        Longer lines are split into several lines with the same output,
+        up to coefficient quantization:
+
+        * If the output is constant (amplitude without derivatives, DDS
+          without chirp), the line is split into a line with the smallest
+          sufficient ``shift`` (up to 15) and a short line with no shift
+          for the remainder. The DDS frequency is not affected by the
+          shift.
+        * Otherwise the line is split into lines of equal duration and
+          shift. The amplitude and DDS frequency coefficients of each line
+          are those of the original line at the start of that line.
+
+        Only the first line carries ``trigger`` and ``clear``, only the last
+        line carries ``wait``.
+
+        Args:
+            target (str): ``"bias"`` or ``"dds"``.
+            duration (int): Duration of the line in units of
+                ``clock_period*2**shift``.
+            shift (int): Duration and spline evolution exponent.
+            trigger, wait, clear: See :meth:`line`.
+            **kwargs: Passed to :meth:`bias` or :meth:`dds`.
+
+        Returns:
+            lines (int): Number of lines appended.
+        """
+        append = getattr(self, target)
+        max_steps = self.max_time - 1
+        if duration <= max_steps:
+            append(duration=duration, shift=shift, trigger=trigger,
+                   wait=wait, clear=clear, **kwargs)
+            return 1
+        amplitude = kwargs.pop("amplitude", [])
+        phase = kwargs.pop("phase", None)
+        if any(amplitude[1:]) or (phase and any(phase[2:])):
+            n = -(-duration//max_steps)
+            pieces = [(shift, (duration + i)//n) for i in range(n)]
+        else:
+            pieces = self._hold(duration << shift)
+        offset = 0
+        for i, (shift_i, steps) in enumerate(pieces):
+            # derivatives at the start of this line
+            m = offset >> shift
+            data = dict(kwargs, amplitude=[
+                sum(a*m**(j - k)/factorial(j - k)
+                    for j, a in enumerate(amplitude) if j >= k)
+                for k in range(len(amplitude))])
+            if phase is not None:
+                data["phase"] = list(phase)
+                if len(phase) > 2:
+                    data["phase"][1] += m*phase[2]
+            append(duration=steps, shift=shift_i,
+                   trigger=trigger and i == 0, clear=clear and i == 0,
+                   wait=wait and i == len(pieces) - 1, **data)
+            offset += steps << shift_i
+        return len(pieces)
+
+    def _hold(self, cycles):
+        """Split a constant line into lines of at most :attr:`max_time`
+        steps.
+
+        Returns:
+            pieces (list[tuple[int, int]]): Shift and duration of each line.
+        """
+        # the following line must be read during the last line
+        min_cycles = 2 + 15
+        max_steps = self.max_time - 1
+        pieces = []
+        while cycles > max_steps:
+            shift = min(15, (cycles >> 16).bit_length())
+            steps = min(cycles >> shift, max_steps)
+            rest = cycles - (steps << shift)
+            if 0 < rest < min_cycles:
+                steps -= -(-(min_cycles - rest) >> shift)
+            pieces.append((shift, steps))
+            cycles -= steps << shift
+        if cycles:
+            pieces.append((0, cycles))
+        return pieces
+
+    def line_array(self, typ, duration, data, trigger=False, silence=False,
+                   aux=False, shift=0, jump=False, clear=False, wait=False):
+        """Append many lines to this segment.
+
+        Vectorized equivalent of calling :meth:`line` once for each row of
+        ``data``. The resulting segment data is identical.
+
+        Args:
+            typ (int): Output module to target with these lines.
+            duration (array[int]): Durations of the lines. See :meth:`line`.
+            data (array[int]): 16 bit data words of shape
+                ``(lines, words)``. See :meth:`pack_array`.
+            trigger, silence, aux, shift, jump, clear, wait: Scalars or
+                arrays broadcastable to ``(lines,)``. See :meth:`line`.
+        """
+        data = np.asarray(data, np.uint16)
+        n, words = data.shape
+        assert words <= 14
+        duration = np.broadcast_to(np.asarray(duration, np.int64), (n,))
+        if np.any((duration < 0) | (duration >= self.max_time)):
+            raise ValueError("line duration out of range")
+        header = 1 + words | typ << 4
+        for flag, offset in ((trigger, 6), (silence, 7), (aux, 8),
+                             (shift, 9), (jump, 13), (clear, 14),
+                             (wait, 15)):
+            header = header | np.asarray(flag, np.int64) << offset
+        lines = np.empty(n, [("header", "<u2"), ("duration", "<u2"),
+                             ("data", "<u2", (words,))])
+        lines["header"] = header
+        lines["duration"] = duration
+        lines["data"] = data
+        self.data += lines.tobytes()
+
+    @staticmethod
+    def pack_array(widths, values):
+        """Pack spline data for many lines.
+
+        Vectorized equivalent of :meth:`pack`.
+
+        Args:
+            widths (list[int]): Widths of values in multiples of 16 bits.
+            values (array[float]): Values to pack. Shape ``(lines, n)``.
+
+        Returns:
+            data (array[uint16]): Packed data of shape ``(lines, words)``.
+        """
+        values = np.asarray(values, np.float64)
+        words = []
+        for width, value in zip(widths, values.T):
+            value = np.rint(value * (1 << 16*width))
+            limit = 1 << 16*width + 15
+            if not np.all((value >= -limit) & (value < limit)):
+                logger.error("can not pack %s as %s", value, width)
+                raise ValueError("value out of range")
+            value = value.astype(np.int64)
+            for i in range(width + 1):
+                words.append(value >> 16*i & 0xffff)
+        data = np.empty((len(values), len(words)), np.uint16)
+        for i, word in enumerate(words):
+            data[:, i] = word
+        return data
+
+    def bias_array(self, amplitude, duration, **kwargs):
+        """Append many bias lines to this segment.
+
+        Vectorized equivalent of calling :meth:`bias` for each line.
+
+        Args:
+            amplitude (array[float]): Amplitude coefficients of shape
+                ``(lines, order + 1)``. See :meth:`bias`.
+            duration (array[int]): Line durations. See :meth:`line`.
+            **kwargs: Passed to :meth:`line_array`.
+        """
+        coef = self.out_scale*np.asarray(amplitude, np.float64).T
+        discrete_compensate(coef)
+        data = self.pack_array([0, 1, 2, 2], coef.T)
+        self.line_array(typ=0, duration=duration, data=data, **kwargs)
+
+    def dds_array(self, amplitude, duration, phase=None, **kwargs):
+        """Append many DDS lines to this segment.
+
+        Vectorized equivalent of calling :meth:`dds` for each line.
+
+        Args:
+            amplitude (array[float]): Amplitude coefficients of shape
+                ``(lines, order + 1)``. See :meth:`dds`.
+            duration (array[int]): Line durations. See :meth:`line`.
+            phase (array[float]): Phase/frequency/chirp coefficients of
+                shape ``(lines, n)``. See :meth:`dds`.
+            **kwargs: Passed to :meth:`line_array`.
+        """
+        amplitude = np.asarray(amplitude, np.float64)
+        scale = self.out_scale/self.cordic_gain
+        coef = scale*amplitude.T
+        discrete_compensate(coef)
+        if phase is not None:
+            phase = np.asarray(phase, np.float64)
+            if phase.shape[1]:
+                assert amplitude.shape[1] == 4
+            coef = np.concatenate([coef, phase.T*self.max_val*2])
+        data = self.pack_array([0, 1, 2, 2, 0, 1, 1], coef.T)
+        self.line_array(typ=1, duration=duration, data=data, **kwargs)
+
 
 class Channel:
     """PDQ2 Channel.
@@ -212,15 +809,29 @@ class Channel:
         num_frames (int): Number of frames supported.
         max_data (int): Number of 16 bit data words per channel.
         segments (list[Segment]): Segments added to this channel.
+        entry (list[Segment]): Frame entry segments as last serialized or
+            updated.
+        shared (int): Number of 16 bit words saved by sharing segment data
+            during the last :meth:`place`.
+        retired (list[Segment]): Segments removed by :meth:`release` whose
+            memory is not yet reused, see :meth:`reclaim`.
+        stack_depth (int): Return stack depth of the memory parser.
     """
+    stack_depth = 4
+
     def __init__(self, max_data, num_frames):
         self.max_data = max_data
         self.num_frames = num_frames
         self.segments = []
+        self.shared = 0
+        self.entry = [None] * num_frames
+        self.retired = []
 
     def clear(self):
         """Remove all segments."""
         self.segments.clear()
+        self.retired.clear()
+        self.entry = [None] * self.num_frames
 
     def new_segment(self):
         """Create and attach a new :class:`Segment` to this channel.
@@ -232,21 +843,296 @@ class Channel:
         self.segments.append(segment)
         return segment
 
+    def share(self):
+        """Find segments that can share memory with other segments.
+
+        A segment whose data is identical to the data of another segment or
+        to a suffix of it can be placed within that other segment. Execution
+        then continues identically up to and including the jump back to the
+        frame address table. Call lines are only identical if they call the
+        same segment.
+
+        Returns:
+            shared (dict): Mapping from ``id()`` of each segment that does not
+                need its own memory to the segment that holds its data and
+                the offset (in 16 bit words) of its data within that segment.
+        """
+        lengths = sorted(set(len(segment.data) for segment in self.segments
+                             if segment.data))
+        suffixes = {}
+        shared = {}
+        for segment in sorted(self.segments, key=lambda s: -len(s.data)):
+            if not segment.data or id(segment) in shared:
+                continue
+            size = len(segment.data)
+            host = suffixes.get(segment._key())
+            if host is not None and host[0] is not segment:
+                shared[id(segment)] = host
+                continue
+            for length in lengths:
+                if length > size:
+                    break
+                suffixes.setdefault(segment._key(size - length),
+                                    (segment, (size - length)//2))
+        return shared
+
     def place(self):
         """Place segments contiguously.
 
         Assign segment start addresses and determine length of data.
+        Segments that can share the memory of other segments (see
+        :meth:`share`) are placed within those.
 
         Returns:
             addr (int): Amount of memory in use on this channel.
         """
+        shared = self.share()
         addr = self.num_frames
         for segment in self.segments:
-            segment.addr = addr
-            addr += len(segment.data)//2
+            if id(segment) not in shared:
+                segment.addr = addr
+                addr += len(segment.data)//2
+        self.shared = 0
+        for segment in self.segments:
+            if id(segment) in shared:
+                host, offset = shared[id(segment)]
+                segment.addr = host.addr + offset
+                self.shared += len(segment.data)//2
+        logger.debug("shared %i words", self.shared)
         assert addr <= self.max_data, addr
         return addr
 
+    def find(self, segment):
+        """Find a placed segment that can hold the data of a segment.
+
+        Args:
+            segment (Segment): Segment to find a host for.
+
+        Returns:
+            addr (int): Address within a placed segment where the data of
+                ``segment`` can be found. ``None`` if there is none.
+        """
+        size = len(segment.data)
+        if not size:
+            return None
+        key = segment._key()
+        for other in self.segments:
+            start = len(other.data) - size
+            if (other.addr is not None and start >= 0 and
+                    other._key(start) == key):
+                return other.addr + start//2
+        return None
+
+    def free(self):
+        """Determine the unused memory.
+
+        The memory of the :attr:`retired` segments is in use.
+
+        Returns:
+            free (list[tuple[int, int]]): Start and end (exclusive) addresses
+                of the unused memory ranges after the frame address table.
+        """
+        used = sorted((segment.addr, segment.addr + len(segment.data)//2)
+                      for segment in self.segments + self.retired
+                      if segment.addr is not None)
+        free = []
+        addr = self.num_frames
+        for start, end in used:
+            if start > addr:
+                free.append((addr, start))
+            addr = max(addr, end)
+        if addr < self.max_data:
+            free.append((addr, self.max_data))
+        return free
+
+    def allocate(self, segment, best_fit=False):
+        """Place a segment into unused memory and add it to this channel.
+
+        Already placed segments are not moved.
+
+        Args:
+            segment (Segment): Segment to place.
+            best_fit (bool): Use the smallest sufficient unused memory range
+                instead of the first one.
+
+        Returns:
+            success (bool): Whether there was sufficient contiguous unused
+                memory. If not, the segment is not added.
+        """
+        size = len(segment.data)//2
+        free = [(start, end) for start, end in self.free()
+                if end - start >= size]
+        if not free:
+            return False
+        if best_fit:
+            free.sort(key=lambda r: r[1] - r[0])
+        segment.addr = free[0][0]
+        self.segments.append(segment)
+        return True
+
+    def release(self, segment):
+        """Remove a segment and the segments called only by it.
+
+        Called segments that are frame entry segments (see :attr:`entry`)
+        or that are still called by other segments are kept.
+
+        The removed segments may still be executing. They are added to
+        :attr:`retired` and their memory is not reused by :meth:`allocate`
+        before :meth:`reclaim`.
+
+        Args:
+            segment (Segment): Segment to remove.
+        """
+        self.segments.remove(segment)
+        self.retired.append(segment)
+        for offset, target in segment.calls:
+            if (target in self.segments and target not in self.entry and
+                    not any(other is target for s in self.segments
+                            for o, other in s.calls)):
+                self.release(target)
+
+    def reclaim(self):
+        """Make the memory of the :attr:`retired` segments available.
+
+        Only call this when none of them can be executing anymore.
+        """
+        self.retired.clear()
+
+    def outline(self, segments=None, max_lines=16):
+        """Move sequences of lines that occur repeatedly into shared
+        fragments.
+
+        Sequences of up to ``max_lines`` lines that occur more than once in
+        the given segments are greedily replaced by lines calling a single
+        copy of them (see :meth:`Segment.call`) if that saves memory. The
+        copies are added to this channel as new segments. Sequences
+        containing lines with the ``jump`` flag, repeat lines or call lines
+        are not moved. A sequence is only moved where the line preceding it
+        is long enough to hide the additional four cycles needed to read the
+        call line, so that the output is unchanged. Segments that contain
+        repeat lines are left untouched.
+
+        Args:
+            segments (list[Segment]): Segments to outline. If unspecified,
+                all segments of this channel are used.
+            max_lines (int): Maximum length of the moved sequences.
+
+        Returns:
+            saved (int): Number of 16 bit words saved.
+        """
+        if segments is None:
+            segments = self.segments
+        segments = [segment for segment in segments
+                    if not any(segment._is_repeat(segment.data, i)
+                               for i in segment.lines())]
+        ids = {}
+        code = []
+        for segment in segments:
+            offsets = segment.lines() + [len(segment.data)]
+            calls = dict(segment.calls)
+            code.append([(bytes(segment.data[a:b]), calls.get(a + 4))
+                         for a, b in zip(offsets, offsets[1:])])
+
+        def cycles(line):
+            header, dt = struct.unpack_from("<HH", line)
+            return (((dt - 1) & 0xffff) + 1) << (header >> 9 & 0xf)
+
+        def movable(line):
+            return not (line[0] >> 4 & 3 == 2 or line[1] >> 5 & 1)
+
+        saved = 0
+        while True:
+            # occurrences of all candidate sequences, in order
+            found = {}
+            for k, lines in enumerate(code):
+                for i in range(1, len(lines)):
+                    prev, first = lines[i - 1][0], lines[i][0]
+                    # the parser needs two cycles plus one per word to read
+                    # the next line; the call line adds four
+                    if not (movable(prev) and movable(first) and
+                            cycles(prev) >= 6 + (first[0] & 0xf)):
+                        continue
+                    key = ()
+                    for line, target in lines[i:i + max_lines]:
+                        if not movable(line):
+                            break
+                        key += ids.setdefault(line, len(ids)),
+                        found.setdefault(key, []).append((k, i))
+            best = None
+            for key, where in found.items():
+                if len(where) < 2:
+                    continue
+                # the line preceding an occurrence must not be replaced
+                used = []
+                for k, i in where:
+                    if not used or used[-1][0] != k or i > used[-1][1]:
+                        used.append((k, i + len(key)))
+                words = sum(len(line) for line, target in
+                            code[where[0][0]][where[0][1]:
+                                              where[0][1] + len(key)])//2
+                gain = (len(used) - 1)*words - 3*len(used)
+                if gain > 0 and (best is None or gain > best[0]):
+                    best = gain, key, used
+            if best is None:
+                break
+            gain, key, used = best
+            saved += gain
+            fragment = self.new_segment()
+            for k, end in reversed(used):
+                lines = code[k]
+                i = end - len(key)
+                if not fragment.data:
+                    fragment.data = bytearray(b"".join(
+                        line for line, target in lines[i:end]))
+                    fragment.data[len(fragment.data) -
+                                  len(lines[end - 1][0]) + 1] |= 1 << 5
+                call = Segment()
+                call.call(fragment)
+                lines[i:end] = [(bytes(call.data), fragment)]
+        for segment, lines in zip(segments, code):
+            segment.data = bytearray()
+            segment.calls = []
+            for line, target in lines:
+                segment.data += line
+                if target is not None:
+                    segment.calls.append((len(segment.data) - 2, target))
+        logger.debug("outlined %i words", saved)
+        return saved
+
+    def link(self):
+        """Fill in the addresses of the segments called by call lines.
+
+        The segments must be placed.
+
+        Raises:
+            ValueError: If a called segment does not belong to this channel,
+                does not end with a line with the ``jump`` flag, or if calls
+                are recursive or nested deeper than :attr:`stack_depth`.
+        """
+        members = set(id(segment) for segment in self.segments)
+        depths = {}
+
+        def depth(segment, active=()):
+            if id(segment) in active:
+                raise ValueError("recursive call")
+            if id(segment) not in depths:
+                depths[id(segment)] = max(
+                    [1 + depth(target, active + (id(segment),))
+                     for offset, target in segment.calls], default=0)
+            return depths[id(segment)]
+
+        for segment in self.segments:
+            for offset, target in segment.calls:
+                offsets = target.lines()
+                if id(target) not in members or target.addr is None:
+                    raise ValueError("called segment not in channel")
+                if not offsets or not target.data[offsets[-1] + 1] >> 5 & 1:
+                    raise ValueError("called segment does not end with a "
+                                     "jump")
+                struct.pack_into("<H", segment.data, offset, target.addr)
+            if depth(segment) > self.stack_depth:
+                raise ValueError("calls nested too deeply")
+
     def table(self, entry=None):
         """Generate the frame address table.
 
@@ -273,22 +1159,377 @@ class Channel:
                 table[i] = frame.addr
         return struct.pack("<" + "H"*self.num_frames, *table)
 
-    def serialize(self, entry=None):
+    def serialize(self, entry=None, outline=False):
         """Serialize the memory for this channel.
 
         Places the segments contiguously in memory after the frame table.
         Allocates and assigns segment and frame table addresses.
         Serializes segment data and prepends frame address table.
+        Identical segment data is only stored once, see :meth:`place`.
+        Call lines are linked, see :meth:`link`.
 
         Args:
             entry (list[Segment]): See :meth:`table`.
+            outline (bool): Move repeated sequences of lines into shared
+                fragments before placing. See :meth:`outline`.
 
         Returns:
             data (bytes): Channel memory data.
         """
+        if entry is None:
+            entry = self.segments[:self.num_frames]
+        self.entry = list(entry) + [None] * (self.num_frames - len(entry))
+        if outline:
+            self.outline()
         self.place()
-        data = b"".join([segment.data for segment in self.segments])
-        return self.table(entry) + data
+        self.link()
+        shared = self.share()
+        data = b"".join([segment.data for segment in self.segments
+                         if id(segment) not in shared])
+        return self.table(self.entry) + data
+
+
+class Framer:
+    """Escape, frame and checksum data for the PDQ2 USB interface.
+
+    Data is escaped and framed into a reusable buffer and written to the
+    device in chunks of at most :attr:`chunk_size` bytes. The escaped
+    message is never materialized and the data is not copied for
+    checksumming.
+
+    Args:
+        dev (file-like): Device to write to. Must consume the data passed
+            to its ``write()`` before returning.
+        chunk_size (int): Maximum number of bytes per device write.
+        crc (CRC): Checksum to track.
+
+    Attributes:
+        max_frame (int): Maximum frame length. ``None``: unlimited.
+        readable (bool): Whether data can be read back. The USB interface
+            is write-only.
+    """
+    escape = b"\xa5"
+    start = b"\xa5\x02"
+    end = b"\xa5\x03"
+    max_frame = None
+    readable = False
+
+    def __init__(self, dev, chunk_size=1 << 12, crc=crc8):
+        self.dev = dev
+        self.chunk_size = chunk_size
+        self.crc = crc
+        self._buf = bytearray(chunk_size)
+        self._fill = 0
+
+    def _flush(self):
+        if not self._fill:
+            return
+        msg = memoryview(self._buf)[:self._fill]
+        written = self.dev.write(msg)
+        if isinstance(written, int):
+            assert written == len(msg), (written, len(msg))
+        self._fill = 0
+
+    def _put(self, data):
+        n = len(data)
+        if self._fill + n < self.chunk_size:
+            self._buf[self._fill:self._fill + n] = data
+            self._fill += n
+            return
+        while data:
+            n = min(len(data), self.chunk_size - self._fill)
+            self._buf[self._fill:self._fill + n] = data[:n]
+            self._fill += n
+            data = data[n:]
+            if self._fill == self.chunk_size:
+                self._flush()
+
+    def write(self, data, checksum=0):
+        """Write one frame.
+
+        Args:
+            data (list[bytes]): Buffers to write. They are concatenated
+                in the frame.
+            checksum (int): Checksum before the frame.
+
+        Returns:
+            checksum (int): Checksum after the frame.
+        """
+        self._put(self.start)
+        for part in data:
+            checksum = self.crc(part, checksum)
+            view = memoryview(part)
+            escapes = np.flatnonzero(np.frombuffer(view, np.uint8) ==
+                                     self.escape[0])
+            i = 0
+            for j in escapes.tolist():
+                # the escape byte and its duplicate
+                self._put(view[i:j + 1])
+                self._put(self.escape)
+                i = j + 1
+            self._put(view[i:])
+        self._put(self.end)
+        self._flush()
+        return checksum
+
+    def flush(self):
+        """Flush the device."""
+        self.dev.flush()
+
+    def close(self):
+        """Close the device."""
+        self.dev.close()
+
+
+class SPIFramer:
+    """Frame and checksum data for the PDQ2 SPI interface.
+
+    The PDQ2 is an SPI slave (mode 0, MSB first) on the ``frame`` pins of
+    the control port (``cs_n``, ``clk``, ``mosi``). While ``cs_n`` is
+    asserted, SPI data takes priority over the USB data. Frames are
+    delimited by ``cs_n`` and the data is not escaped. Each frame is
+    written as a single transfer of at most :attr:`max_frame` bytes.
+    Memory writes are split accordingly by :meth:`Pdq2.write_mem`.
+
+    Data is read back on MISO which is driven on the ``aux`` pin of a
+    board only if ``aux_miso`` is set in its configuration register, see
+    :meth:`Pdq2.set_config`.
+
+    Args:
+        dev (spidev.SpiDev): ``spidev`` style device configured for mode 0.
+            Must implement ``writebytes2(data)`` and ``xfer2(data)``
+            (returning the bytes read) and must keep ``cs_n`` asserted
+            for the entire transfer.
+        max_frame (int): Maximum number of bytes per transfer. The Linux
+            ``spidev`` driver limits transfers to its ``bufsiz`` module
+            parameter (4096 bytes by default).
+        crc (CRC): Checksum to track.
+
+    Attributes:
+        readable (bool): Whether data can be read back.
+    """
+    readable = True
+
+    def __init__(self, dev, max_frame=1 << 12, crc=crc8):
+        self.dev = dev
+        self.max_frame = max_frame
+        self.crc = crc
+        self._buf = bytearray(max_frame)
+
+    def _frame(self, data, checksum, pad=0):
+        n = 0
+        for part in data:
+            m = len(part)
+            if n + m + pad > self.max_frame:
+                raise ValueError("frame exceeds {} bytes".format(
+                    self.max_frame))
+            self._buf[n:n + m] = part
+            checksum = self.crc(part, checksum)
+            n += m
+        self._buf[n:n + pad] = bytes(pad)
+        return memoryview(self._buf)[:n + pad], checksum
+
+    def write(self, data, checksum=0):
+        """Write one frame.
+
+        Args:
+            data (list[bytes]): Buffers to write. They are concatenated
+                in the frame.
+            checksum (int): Checksum before the frame.
+
+        Returns:
+            checksum (int): Checksum after the frame.
+        """
+        msg, checksum = self._frame(data, checksum)
+        self.dev.writebytes2(msg)
+        return checksum
+
+    def read(self, data, length, checksum=0):
+        """Write a frame and read back data.
+
+        The frame is padded with ``length + 1`` zero bytes: the data is
+        read back one byte after the byte that requests it. The padding is
+        not included in the checksum.
+
+        Args:
+            data (list[bytes]): Buffers to write. They are concatenated
+                in the frame.
+            length (int): Number of bytes to read.
+            checksum (int): Checksum before the frame.
+
+        Returns:
+            data (bytes): Data read.
+            checksum (int): Checksum after the frame.
+        """
+        msg, checksum = self._frame(data, checksum, length + 1)
+        return bytes(self.dev.xfer2(msg)[len(msg) - length:]), checksum
+
+    def flush(self):
+        """Flush the device. Transfers are synchronous."""
+        pass
+
+    def close(self):
+        """Close the device."""
+        self.dev.close()
+
+
+class ProgramCache:
+    """Cache of channel memory images of wavesynth programs.
+
+    Entries are kept in memory and evicted least recently used first once
+    their total size exceeds ``max_bytes``. If a ``path`` is given, all
+    entries are also stored there and entries not in memory are looked up
+    there.
+
+    An entry is the list of memory images of the channels used, stored as
+    raw bytes.
+
+    Args:
+        max_bytes (int): Maximum total size of the entries kept in memory.
+        path (str): Directory for the on-disk tier. ``None`` to disable.
+
+    Attributes:
+        version (int): Version of the serializer. It is part of every key
+            and is incremented whenever the memory image of a program
+            changes, invalidating stale entries in the on-disk tier.
+        size (int): Total size of the entries in memory.
+        hits (int): Number of successful lookups.
+        misses (int): Number of failed lookups.
+    """
+    version = 1
+
+    def __init__(self, max_bytes=1 << 26, path=None):
+        self.max_bytes = max_bytes
+        self.path = path
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+        self._entries = OrderedDict()
+        self.size = 0
+        self.hits = self.misses = 0
+
+    @classmethod
+    def key(cls, program, channels, num_frames, freq, max_data, fold=False,
+            outline=False):
+        """Compute the cache key of a wavesynth program.
+
+        Args:
+            program (list): Wavesynth program.
+            channels (list[int]): Channel indices used.
+            num_frames (int): Number of frames supported.
+            freq (float): Sample clock frequency.
+            max_data (list[int]): Memory size of each channel used.
+            fold (bool): Repeated lines are folded.
+            outline (bool): Repeated sequences of lines are outlined.
+
+        Returns:
+            key (str): Hex SHA-256 digest of the canonical JSON encoding of
+                :attr:`version` and the arguments.
+        """
+        data = json.dumps([cls.version, program, list(channels), num_frames,
+                           freq, list(max_data), fold, outline],
+                          sort_keys=True, separators=(",", ":"),
+                          default=lambda o: o.tolist())
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + ".bin")
+
+    def _insert(self, key, images):
+        self._entries[key] = images
+        self.size += sum(map(len, images))
+        while self.size > self.max_bytes and self._entries:
+            key, images = self._entries.popitem(last=False)
+            self.size -= sum(map(len, images))
+
+    def get(self, key):
+        """Look up an entry.
+
+        Args:
+            key (str): Cache key.
+
+        Returns:
+            images (list[bytes]): Memory images. ``None`` if not found.
+        """
+        images = self._entries.get(key)
+        if images is not None:
+            self._entries.move_to_end(key)
+        elif self.path is not None:
+            try:
+                with open(self._file(key), "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                pass
+            else:
+                n, = struct.unpack_from("<I", data)
+                sizes = struct.unpack_from("<" + "I"*n, data, 4)
+                images = []
+                start = 4*(n + 1)
+                for size in sizes:
+                    images.append(data[start:start + size])
+                    start += size
+                self._insert(key, images)
+        if images is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return list(images)
+
+    def put(self, key, images):
+        """Add an entry.
+
+        Args:
+            key (str): Cache key.
+            images (list[bytes]): Memory images to store.
+        """
+        images = [bytes(image) for image in images]
+        if key in self._entries:
+            self.size -= sum(map(len, self._entries.pop(key)))
+        self._insert(key, images)
+        if self.path is not None:
+            tmp = self._file(key) + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(struct.pack("<I" + "I"*len(images), len(images),
+                                    *map(len, images)))
+                for image in images:
+                    f.write(image)
+            os.replace(tmp, self._file(key))
+
+    def clear(self):
+        """Remove all entries from memory."""
+        self._entries.clear()
+        self.size = 0
+
+
+def _channel_program(program, index):
+    """Extract the data of a single channel from a wavesynth program."""
+    return [[dict(line, channel_data=line["channel_data"][index:index + 1])
+             for line in frame] for frame in program]
+
+
+def _serialize_channel(channel, program, fold=False, outline=False):
+    """Clear a :class:`Channel`, append a single channel wavesynth program
+    to it and serialize it.
+
+    Module level to be usable with process pools.
+
+    Args:
+        channel (Channel or tuple): The channel or its ``max_data`` and
+            ``num_frames`` to create a new one.
+        program (list): Single channel wavesynth program.
+        fold (bool): Fold repeated lines. See :meth:`Segment.fold`.
+        outline (bool): Outline repeated sequences of lines. See
+            :meth:`Channel.outline`.
+
+    Returns:
+        channel (Channel): The channel.
+        data (bytes): Channel memory image.
+    """
+    if not isinstance(channel, Channel):
+        channel = Channel(*channel)
+    channel.clear()
+    for frame in program:
+        Pdq2.program_frame([channel.new_segment()], frame, fold)
+    return channel, channel.serialize(outline=outline)
 
 
 class Pdq2:
@@ -305,6 +1546,35 @@ class Pdq2:
         num_boards (int): Number of boards in this stack.
         num_dacs (int): Number of DAC outputs per board.
         num_frames (int): Number of frames supported.
+        delta (bool): Only write the parts of the channel memories that
+            changed since they were last written. See
+            :meth:`write_mem_delta`.
+        delta_gap (int): Merge changed ranges separated by at most this
+            many unchanged 16 bit words into one write.
+        cache (ProgramCache): Cache for serialized programs. ``None`` to
+            disable caching. See :meth:`program`.
+        track (bool): Skip register writes, memory writes and flushes
+            that would not change the state of the device as recorded in
+            :attr:`config`, :attr:`frame`, :attr:`checksum` and
+            :attr:`shadow`. This assumes that the device is not written
+            by other means. See :meth:`validate`.
+        fold (bool): Fold repeated sequences of lines into repeat lines
+            when serializing programs. See :meth:`Segment.fold`.
+        outline (bool): Move sequences of lines that occur repeatedly
+            within a channel into shared fragments that are called when
+            serializing programs. See :meth:`Channel.outline`.
+        transport (Framer or SPIFramer): Transport to use. If passed,
+            ``url``, ``dev`` and ``crc`` are ignored. Defaults to a
+            :class:`Framer` (USB) on ``dev``.
+        checked (bool): Verify the channel memory writes of programs with
+            the checksum register and repair corrupted ranges. Requires a
+            transport with a read path. See :meth:`write_mem_checked`.
+        crc (CRC): Checksum of the boards: :data:`crc8`, :data:`crc16` or
+            :data:`crc32` for a ``crc_width`` of 8, 16 or 32 bits of
+            :class:`gateware.comm.Protocol`.
+        fifo (int): Depth of the line FIFOs of the boards, used by
+            :meth:`preview`. ``None`` for the depth the gateware uses for
+            ``num_dacs`` (:data:`host.emulator.fifo_depths`).
 
     Attributes:
         num_channels (int): Number of channels in this stack.
@@ -312,16 +1582,30 @@ class Pdq2:
         num_dacs (int): Number of DAC outputs per board.
         num_frames (int): Number of frames supported.
         channels (list[Channel]): List of :class:`Channel` in this stack.
+        shadow (list[bytearray]): Copy of the last written memory content
+            of each channel. ``None`` if unknown.
+        config (list[int]): Last written configuration register value of
+            each board. ``None`` if unknown.
+        frame (list[int]): Last written frame register value of each board.
+            ``None`` if unknown.
+        checksum (int): Expected value of the checksum register of the
+            boards.
+        transport (Framer or SPIFramer): Transport in use.
     """
     freq = 50e6
 
     _mem_sizes = [None, (20,), (10, 10), (8, 6, 6)]  # 10kx16 units
 
     def __init__(self, url=None, dev=None, num_boards=3, num_dacs=3,
-                 num_frames=32):
-        if dev is None:
-            dev = serial.serial_for_url(url)
-        self.dev = dev
+                 num_frames=32, delta=False, delta_gap=4, cache=None,
+                 track=False, fold=False, outline=False, transport=None,
+                 checked=False, crc=crc8, fifo=None):
+        if transport is None:
+            if dev is None:
+                dev = serial.serial_for_url(url)
+            transport = Framer(dev, crc=crc)
+        self.transport = transport
+        self.dev = transport.dev
         self.checksum = 0
         self.num_boards = num_boards
         self.num_dacs = num_dacs
@@ -331,6 +1615,20 @@ class Pdq2:
         self.channels = [Channel(m[j] << 11, num_frames)
                          for i in range(num_boards)
                          for j in range(num_dacs)]
+        self.delta = delta
+        self.delta_gap = delta_gap
+        self.shadow = [None] * self.num_channels
+        self.cache = cache
+        self.track = track
+        self.fold = fold
+        self.outline = outline
+        self.checked = checked
+        self.fifo = fifo
+        self.config = [None] * self.num_boards
+        self.frame = [None] * self.num_boards
+        self._flushed = True
+        # single channel programs of channels loaded from the cache
+        self._uncached = {}
 
     def get_num_boards(self):
         return self.num_boards
@@ -348,22 +1646,20 @@ class Pdq2:
         self.freq = float(freq)
 
     def close(self):
-        """Close the USB device handle."""
-        self.dev.close()
+        """Close the device handle."""
+        self.transport.close()
         del self.dev
 
-    def write(self, data):
-        """Write data to the PDQ2 board over USB/parallel.
+    def write(self, *data):
+        """Write a frame to the PDQ2 stack.
 
         Args:
-            data (bytes): Data to write.
+            *data (bytes): Data to write. Multiple buffers are concatenated
+                into a single frame without copying.
         """
         logger.debug("> %r", data)
-        msg = b"\xa5\x02" + data.replace(b"\xa5", b"\xa5\xa5") + b"\xa5\x03"
-        written = self.dev.write(msg)
-        if isinstance(written, int):
-            assert written == len(msg), (written, len(msg))
-        self.checksum = crc8(data, self.checksum)
+        self.checksum = self.transport.write(data, self.checksum)
+        self._flushed = False
 
     def _cmd(self, board, is_mem, adr, we):
         return (adr << 0) | (is_mem << 2) | (board << 3) | (we << 7)
@@ -371,13 +1667,108 @@ class Pdq2:
     def write_reg(self, board, adr, data):
         """Write to a configuration register
 
+        If :attr:`track` is set, writes to the configuration and frame
+        registers that would not change them are skipped.
+
         Args:
             board (int): Board to write to (0-0xe), 0xf for all boards.
             adr (int): Register address to write to (0-3)
-            data (int): Data to write (1 byte)
+            data (int): Data to write (1 byte, the checksum register is
+                as wide as the checksum of the transport)
+        """
+        boards = range(self.num_boards) if board == 0xf else [board]
+        regs = {0: self.config, 2: self.frame}.get(adr)
+        if self.track and regs is not None and all(
+                regs[i] == data for i in boards):
+            logger.debug("skipping reg[%#04x] <- %#04x", adr, data)
+            return
+        self.write(bytes([self._cmd(board, False, adr, True)]),
+                   data.to_bytes(self._reg_bytes(adr, True), "little"))
+        if adr == 0 and data & 1:
+            # reset: registers revert to their unknown reset values, the
+            # checksum register is cleared
+            self.config = [None] * self.num_boards
+            self.frame = [None] * self.num_boards
+            if board == 0xf:
+                self.checksum = 0
+        elif regs is not None:
+            for i in boards:
+                regs[i] = data
+
+    def read_reg(self, board, adr):
+        """Read a configuration register.
+
+        The USB interface is write-only. Register reads require a
+        transport with a read path (:class:`SPIFramer`) and ``aux_miso``
+        set in the configuration register of the board.
+
+        The command byte is followed by one byte per byte of register
+        width (``crc_width//8`` for the checksum register) that clocks out
+        the register data and one more byte. The board that is read
+        includes the command byte and the last byte in its checksum but not
+        the bytes that clock out the register data. The other boards
+        include all bytes. :attr:`checksum` follows the board that is read.
+
+        Args:
+            board (int): Board to read from (0-0xe).
+            adr (int): Register address to read from (0-3).
+
+        Returns:
+            data (int): Register value (1 byte, the checksum register is as
+                wide as the checksum of the transport, the status register
+                see :meth:`read_status`).
+
+        Raises:
+            NotImplementedError: The transport is write-only.
         """
-        self.write(struct.pack(
-            "<BB", self._cmd(board, False, adr, True), data))
+        if not 0 <= board < 0xf:
+            raise ValueError("can only read from a single board")
+        cmd = bytes([self._cmd(board, False, adr, False)])
+        data, checksum = self._read([cmd], self._reg_bytes(adr))
+        self.checksum = self.transport.crc(b"\x00", checksum)
+        return int.from_bytes(data, "little")
+
+    def _read(self, data, length):
+        if not self.transport.readable:
+            raise NotImplementedError("the transport is write-only")
+        return self.transport.read(data, length, self.checksum)
+
+    def _reg_bytes(self, adr, we=False):
+        if adr == 1:
+            return self.transport.crc.crc_width//8
+        if adr == 3 and not we:
+            return 1 + 2*self.num_dacs
+        return 1
+
+    def read_status(self, board=0):
+        """Read the status register of a board.
+
+        The status register holds the USB data rate and, for each channel,
+        the number of times the line sequencer had to wait for the memory
+        parser (``underruns``, saturating at 255) and the highest number of
+        lines in the line FIFO (``level_max``). See
+        :class:`gateware.dac.Dac`. Requires a transport with a read path,
+        see :meth:`read_reg`.
+
+        Args:
+            board (int): Board to read from (0-0xe).
+
+        Returns:
+            status (dict): ``rate``, ``underruns`` and ``level_max``. The
+                latter are lists with one entry per channel.
+        """
+        data = self.read_reg(board, 3).to_bytes(self._reg_bytes(3),
+                                                "little")
+        return dict(rate=data[0], underruns=list(data[1::2]),
+                    level_max=list(data[2::2]))
+
+    def clear_status(self, board=0xf):
+        """Clear the underrun and FIFO level counters.
+
+        Args:
+            board (int): Board to clear (0-0xe), 0xf for all boards.
+        """
+        self.write_reg(board, 3, 0)
 
     def set_config(self, reset=False, clk2x=False, enable=True,
                    trigger=False, aux_miso=False, aux_dac=0b111, board=0xf):
@@ -401,8 +1792,57 @@ class Pdq2:
                        (trigger << 3) | (aux_miso << 4) | (aux_dac << 5))
 
     def set_checksum(self, crc=0, board=0xf):
-        """Set/reset the checksum register."""
+        """Set/reset the checksum register.
+
+        Setting the checksum register of all boards also sets
+        :attr:`checksum`.
+        """
+        if self.track and board == 0xf and self.checksum == crc:
+            logger.debug("skipping checksum reset")
+            return
         self.write_reg(board, 1, crc)
+        if board == 0xf:
+            self.checksum = crc
+
+    def validate(self, board=0):
+        """Validate the recorded device state.
+
+        Reads the checksum register of a board and compares it to
+        :attr:`checksum`. A mismatch means that the board has not received
+        the data exactly as it was sent and the recorded state is
+        discarded.
+
+        Args:
+            board (int): Board to read the checksum from (0-0xe).
+
+        Returns:
+            valid (bool): Whether the recorded state is valid.
+        """
+        if self._check(board):
+            return True
+        self.invalidate()
+        return False
+
+    def _check(self, board):
+        """Compare the checksum register of a board to :attr:`checksum`.
+
+        On a mismatch, :attr:`checksum` is set to follow the board.
+        """
+        # the register is read after the command byte is accounted for
+        expect = self.transport.crc(
+            bytes([self._cmd(board, False, 1, False)]), self.checksum)
+        checksum = self.read_reg(board, 1)
+        if checksum == expect:
+            return True
+        logger.warning("checksum mismatch: %#04x != %#04x", checksum, expect)
+        self.checksum = self.transport.crc(b"\x00", checksum)
+        return False
+
+    def invalidate(self):
+        """Discard the recorded register and memory state."""
+        self.config = [None] * self.num_boards
+        self.frame = [None] * self.num_boards
+        self.shadow = [None] * self.num_channels
 
     def set_frame(self, frame, board=0xf):
         """Set the current frame."""
@@ -411,19 +1851,192 @@ class Pdq2:
     def write_mem(self, channel, data, start_addr=0):
         """Write to channel memory.
 
+        If the frame length of the transport is limited, the data is split
+        into as few frames as possible, each covering whole words.
+
         Args:
             channel (int): Channel index to write to. Assumes every board in
                 the stack has :attr:`num_dacs` DAC outputs.
             data (bytes): Data to write to memory.
-            start_addr (int): Start address to write data to.
+            start_addr (int): Start address to write data to. In bytes.
         """
         board, dac = divmod(channel, self.num_dacs)
-        self.write(struct.pack("<BH", self._cmd(board, True, dac, True),
-                               start_addr) + data)
+        cmd = self._cmd(board, True, dac, True)
+        n = len(data)
+        if self.transport.max_frame is not None:
+            n = min(n, self.transport.max_frame - 3 & ~1)
+        if n == len(data):
+            self.write(struct.pack("<BH", cmd, start_addr), data)
+        else:
+            view = memoryview(data)
+            for i in range(0, len(data), n):
+                self.write(struct.pack("<BH", cmd, start_addr + i),
+                           view[i:i + n])
+        shadow = self.shadow[channel]
+        if shadow is None and start_addr == 0:
+            shadow = self.shadow[channel] = bytearray()
+        if shadow is not None and start_addr <= len(shadow):
+            shadow[start_addr:start_addr + len(data)] = data
+        else:
+            self.shadow[channel] = None
+
+    def write_mem_checked(self, channel, data, start_addr=0, min_size=64,
+                          retries=3):
+        """Write to channel memory and verify the write with the checksum
+        register.
+
+        The checksum registers are reset with :meth:`set_checksum`, the
+        data is written and the checksum register of the board is read
+        back and compared to :attr:`checksum`. On a mismatch, the range is
+        bisected: both halves are rewritten and checked separately. Ranges
+        of ``min_size`` bytes or less and single words are rewritten up to
+        ``retries`` times. Only the ranges whose writes fail are
+        retransmitted again.
+
+        Requires a transport with a read path, see :meth:`read_reg`.
+
+        Args:
+            channel (int): Channel index to write to.
+            data (bytes): Data to write to memory.
+            start_addr (int): Start address to write data to. In bytes.
+            min_size (int): Size below which ranges are not bisected
+                further. In bytes.
+            retries (int): Number of rewrites of a range of ``min_size``
+                bytes or less.
+
+        Returns:
+            retransmitted (int): Number of data bytes rewritten.
+
+        Raises:
+            IOError: A range could not be written within ``retries``.
+        """
+        board = channel // self.num_dacs
+        view = memoryview(data)
+        written = 0
+        # ranges to write and their number of failed writes
+        pending = [(0, len(data), 0)]
+        while pending:
+            start, end, failed = pending.pop()
+            self.set_checksum()
+            self.write_mem(channel, view[start:end], start_addr + start)
+            written += end - start
+            if self._check(board):
+                continue
+            logger.info("channel %i: write of [%#06x, %#06x) failed", channel,
+                        start_addr + start, start_addr + end)
+            # bisect at a word boundary, single words are not bisected
+            mid = start + (end - start)//4*2
+            if end - start > min_size and mid > start:
+                pending.extend([(mid, end, 0), (start, mid, 0)])
+            elif failed < retries:
+                pending.append((start, end, failed + 1))
+            else:
+                raise IOError("channel {}: write of [{:#06x}, {:#06x}) "
+                              "failed".format(channel, start_addr + start,
+                                              start_addr + end))
+        return written - len(data)
+
+    def write_mem_delta(self, channel, data):
+        """Write a channel memory image, skipping unchanged data.
+
+        The image is compared to the :attr:`shadow` copy of the memory
+        content. Only the changed ranges of 16 bit words are written.
+        Ranges separated by at most :attr:`delta_gap` unchanged words are
+        merged to amortize the command overhead. If the memory content is
+        unknown, the entire image is written.
+
+        This assumes that the channel memory has not been written by other
+        means since the last write through this object.
+
+        Args:
+            channel (int): Channel index to write to.
+            data (bytes): Memory image starting at address zero.
 
-    def program_segments(self, segments, data):
+        Returns:
+            written (int): Number of data bytes written.
+            saved (int): Number of data bytes not written.
+        """
+        if self.shadow[channel] is None:
+            ranges = [(0, len(data)//2)]
+        else:
+            ranges = dirty_ranges(self.shadow[channel], data, self.delta_gap)
+        write = self.write_mem_checked if self.checked else self.write_mem
+        written = 0
+        for start, end in ranges:
+            write(channel, data[2*start:2*end], 2*start)
+            written += 2*(end - start)
+        saved = len(data) - written
+        logger.debug("channel %i: wrote %i bytes in %i ranges, saved %i bytes",
+                     channel, written, len(ranges), saved)
+        return written, saved
+
+    def read_mem(self, channel, start_addr, length):
+        """Read from channel memory.
+
+        Requires a transport with a read path, see :meth:`read_reg`. The
+        data is read in as few frames as the transport allows. The command
+        and address bytes of each frame are included in the checksum of
+        the board, the padding bytes that clock out the data are not.
+
+        Args:
+            channel (int): Channel index to read from.
+            start_addr (int): Start address to read from. In bytes.
+            length (int): Number of bytes to read.
+
+        Returns:
+            data (bytes): Memory content.
+        """
+        board, dac = divmod(channel, self.num_dacs)
+        cmd = self._cmd(board, True, dac, False)
+        n = length
+        if self.transport.max_frame is not None:
+            n = min(n, self.transport.max_frame - 4)
+        data = bytearray()
+        for i in range(0, length, max(n, 1)):
+            chunk, self.checksum = self._read(
+                [struct.pack("<BH", cmd, start_addr + i)],
+                min(n, length - i))
+            data += chunk
+        return bytes(data)
+
+    def verify(self, channel, data=None, repair=True):
+        """Verify a channel memory image and rewrite mismatching ranges.
+
+        The memory is read back with :meth:`read_mem` and compared to the
+        image. Mismatching ranges separated by at most :attr:`delta_gap`
+        matching words are merged and rewritten.
+
+        Args:
+            channel (int): Channel index to verify.
+            data (bytes): Memory image starting at address zero. Defaults
+                to the :attr:`shadow` copy of the memory content.
+            repair (bool): Rewrite the mismatching ranges.
+
+        Returns:
+            ranges (list[tuple[int, int]]): Start and end (exclusive) word
+                addresses of the mismatching ranges.
+        """
+        if data is None:
+            data = self.shadow[channel]
+            if data is None:
+                raise ValueError("memory content unknown")
+        mem = self.read_mem(channel, 0, len(data))
+        ranges = dirty_ranges(mem, data, self.delta_gap)
+        if ranges:
+            logger.warning("channel %i: %i mismatching ranges", channel,
+                           len(ranges))
+        if repair:
+            for start, end in ranges:
+                self.write_mem(channel, data[2*start:2*end], 2*start)
+        return ranges
+
+    @staticmethod
+    def program_segments(segments, data):
         """Append the wavesynth lines to the given segments.
 
+        Lines of :attr:`Segment.max_time` or more steps are split, see
+        :meth:`Segment.span`.
+
         Args:
             segments (list[Segment]): List of :class:`Segment` to append the
                 lines to.
@@ -437,16 +2050,42 @@ class Pdq2:
             duration = line["duration"]
             trigger = line.get("trigger", False)
             for segment, data in zip(segments, line["channel_data"]):
+                data = dict(data)
                 silence = data.pop("silence", False)
                 if len(data) != 1:
                     raise ValueError("only one target per channel and line "
                                      "supported")
                 for target, target_data in data.items():
-                    getattr(segment, target)(
-                        shift=shift, duration=duration, trigger=trigger,
-                        silence=silence, **target_data)
+                    segment.span(target, shift=shift, duration=duration,
+                                 trigger=trigger, silence=silence,
+                                 **target_data)
 
-    def program(self, program, channels=None):
+    @staticmethod
+    def program_frame(segments, frame, fold=False):
+        """Append a wavesynth frame to the given segments.
+
+        An empty line is appended to stall the memory reader before jumping
+        through the frame table.
+
+        Args:
+            segments (list[Segment]): List of :class:`Segment` to append the
+                lines to.
+            frame (list): List of wavesynth lines.
+            fold (bool): Fold repeated lines. See :meth:`Segment.fold`.
+        """
+        Pdq2.program_segments(segments, frame)
+        # append an empty line to stall the memory reader before jumping
+        # through the frame table (`wait` does not prevent reading
+        # the next line)
+        for segment in segments:
+            segment.line(typ=3, data=b"", trigger=True, duration=1, aux=1,
+                         jump=True)
+            if fold:
+                saved = segment.fold()
+                if saved:
+                    logger.debug("folded %i words", saved)
+
+    def program(self, program, channels=None, executor=None):
         """Serialize a wavesynth program and write it to the channels
         in the stack.
 
@@ -461,30 +2100,265 @@ class Pdq2:
         can be reliably parked in the frame address table.
         The first line of each frame is mandatorily triggered.
 
+        If :attr:`delta` is set, only the changed parts of the channel
+        memories are written, see :meth:`write_mem_delta`.
+
+        If an ``executor`` is given, the channels are serialized
+        concurrently in it, one task per channel. Each task receives only
+        the data of its channel. With a
+        :class:`concurrent.futures.ProcessPoolExecutor` this scales with the
+        number of channels and processors. The :class:`Channel` objects
+        returned by the tasks replace those in :attr:`channels` and the
+        memories are written in channel order as the tasks complete.
+
+        If :attr:`fold` is set, repeated sequences of lines are folded into
+        repeat lines, see :meth:`Segment.fold`. If :attr:`outline` is set,
+        sequences of lines that occur repeatedly within a channel are stored
+        once and called, see :meth:`Channel.outline`.
+
+        If a :attr:`cache` is set, the memory images are looked up there
+        first and stored there after serialization. On a hit the program is
+        not serialized but the cached memory images are written. The
+        :class:`Channel` objects of the channels are then only rebuilt when
+        they are needed, by :meth:`update_frame`.
+
         Args:
             program (list): Wavesynth program to serialize.
             channels (list[int]): Channel indices to use. If unspecified, all
                 channels are used.
+            executor (concurrent.futures.Executor): Executor to serialize the
+                channels in. If unspecified, the channels are serialized
+                in the calling thread.
+        """
+        if channels is None:
+            channels = range(self.num_channels)
+        chs = [self.channels[i] for i in channels]
+        key, images = self._lookup(program, channels)
+        if images is None:
+            for channel in channels:
+                self._uncached.pop(channel, None)
+            images = self._serialize(program, chs, executor)
+            if key is not None:
+                images = list(images)
+                self.cache.put(key, [data for ch, data in images])
+        else:
+            images = zip(chs, images)
+        written = saved = 0
+        for channel, (ch, data) in zip(channels, images):
+            self.channels[channel] = ch
+            w, s = self._write_channel(channel, data)
+            written, saved = written + w, saved + s
+        if self.delta:
+            logger.info("wrote %i bytes, saved %i bytes", written, saved)
+
+    def _lookup(self, program, channels):
+        """Look up the memory images of a program in the :attr:`cache`.
+
+        On a hit, the channels are cleared and rebuilt when needed, see
+        :meth:`_rebuild`.
+
+        Returns:
+            key (str): Cache key. ``None`` without a cache.
+            images (list[bytes]): Memory images of the channels. ``None`` if
+                not found.
+        """
+        if self.cache is None:
+            return None, None
+        key = self.cache.key(program, channels, self.num_frames, self.freq,
+                             [self.channels[i].max_data for i in channels],
+                             self.fold, self.outline)
+        images = self.cache.get(key)
+        if images is not None:
+            for index, channel in enumerate(channels):
+                self.channels[channel].clear()
+                self._uncached[channel] = copy.deepcopy(
+                    _channel_program(program, index))
+        return key, images
+
+    def _serialize(self, program, chs, executor=None):
+        if executor is None:
+            for channel in chs:
+                channel.clear()
+            for frame in program:
+                segments = [c.new_segment() for c in chs]
+                self.program_frame(segments, frame, self.fold)
+            return ((ch, ch.serialize(outline=self.outline)) for ch in chs)
+        futures = [executor.submit(_serialize_channel,
+                                   (ch.max_data, ch.num_frames),
+                                   _channel_program(program, index),
+                                   self.fold, self.outline)
+                   for index, ch in enumerate(chs)]
+        return (future.result() for future in futures)
+
+    def serialize_channel(self, channel, program, index):
+        """Serialize the data of a single channel in a wavesynth program.
+
+        The :class:`Channel` is cleared, each frame is appended to a fresh
+        :class:`Segment` and the channel is serialized, as in
+        :meth:`program`.
+
+        Args:
+            channel (int): Channel index to serialize.
+            program (list): Wavesynth program to serialize.
+            index (int): Index of the channel data within the
+                ``channel_data`` list of each line.
+
+        Returns:
+            data (bytes): Channel memory image.
+        """
+        self._uncached.pop(channel, None)
+        ch, data = _serialize_channel(self.channels[channel],
+                                      _channel_program(program, index),
+                                      self.fold, self.outline)
+        return data
+
+    def _write_channel(self, channel, data):
+        if self.track and self.shadow[channel] == data:
+            logger.debug("channel %i: unchanged", channel)
+            return 0, len(data)
+        if self.delta:
+            return self.write_mem_delta(channel, data)
+        if self.checked:
+            self.write_mem_checked(channel, data)
+        else:
+            self.write_mem(channel, data)
+        return len(data), 0
+
+    def _rebuild(self, channel):
+        """Rebuild a :class:`Channel` whose memory image was loaded from the
+        cache."""
+        program = self._uncached.pop(channel, None)
+        if program is not None:
+            self.channels[channel], data = _serialize_channel(
+                self.channels[channel], program, self.fold, self.outline)
+
+    def update_frame(self, frame, frame_program, channels=None,
+                     best_fit=False, compact=False):
+        """Serialize a single wavesynth frame and write it to the channels
+        in the stack, leaving the other frames untouched.
+
+        The new segments are placed into unused channel memory, written,
+        and then activated by rewriting the frame address table entry. The
+        segments previously used by the frame and the fragments called only
+        by them are released afterwards (see :meth:`Channel.release`) but
+        their memory is only reused after the next update on the channel.
+        The memory of a frame that is currently being executed is thus not
+        overwritten by this update or by the next one. Call
+        :meth:`Channel.reclaim` to reuse it earlier if the frames
+        previously updated are known to be idle.
+
+        If the unused memory of a channel is too fragmented to hold a new
+        segment, nothing is written and :class:`ValueError` is raised. With
+        ``compact``, such channels are compacted instead: their segments are
+        placed contiguously and the whole channel memory is rewritten,
+        including the frame that may currently be executing. Disable the
+        channels (:meth:`disable`) before compacting.
+
+        Args:
+            frame (int): Frame index to update.
+            frame_program (list): Wavesynth lines for the frame.
+            channels (list[int]): Channel indices to use. If unspecified, all
+                channels are used.
+            best_fit (bool): Place segments into the smallest sufficient
+                unused memory range. See :meth:`Channel.allocate`.
+            compact (bool): Compact channels without sufficient contiguous
+                unused memory.
+
+        Raises:
+            ValueError: A channel has insufficient contiguous unused memory
+                and ``compact`` is not set.
         """
+        if not 0 <= frame < self.num_frames:
+            raise ValueError("invalid frame index")
         if channels is None:
             channels = range(self.num_channels)
+        for channel in channels:
+            self._rebuild(channel)
         chs = [self.channels[i] for i in channels]
-        for channel in chs:
-            channel.clear()
-        for frame in program:
-            segments = [c.new_segment() for c in chs]
-            self.program_segments(segments, frame)
-            # append an empty line to stall the memory reader before jumping
-            # through the frame table (`wait` does not prevent reading
-            # the next line)
-            for segment in segments:
-                segment.line(typ=3, data=b"", trigger=True, duration=1, aux=1,
-                             jump=True)
-        for channel, ch in zip(channels, chs):
-            self.write_mem(channel, ch.serialize())
+        segments = [Segment() for ch in chs]
+        self.program_frame(segments, frame_program, self.fold)
+        # place all segments before writing anything
+        placed = []
+        found = set()
+        for channel, ch, segment in zip(channels, chs, segments):
+            addr = ch.find(segment)
+            if addr is not None:
+                segment.addr = addr
+                ch.segments.append(segment)
+                found.add(id(segment))
+            elif not ch.allocate(segment, best_fit):
+                if compact:
+                    continue
+                for ch, segment in placed:
+                    ch.segments.remove(segment)
+                    segment.addr = None
+                raise ValueError("insufficient contiguous memory on "
+                                 "channel {}".format(channel))
+            placed.append((ch, segment))
+        for channel, ch, segment in zip(channels, chs, segments):
+            old = ch.entry[frame]
+            # the segments released by the previous update are reused
+            # from now on, the ones released below after the next update
+            ch.reclaim()
+            if segment.addr is not None:
+                if id(segment) not in found:
+                    self.write_mem(channel, segment.data, 2*segment.addr)
+                self.write_mem(channel, struct.pack("<H", segment.addr),
+                               2*frame)
+                ch.entry[frame] = segment
+                if old is not None and old not in ch.entry:
+                    ch.release(old)
+            else:
+                ch.entry[frame] = segment
+                if old is not None and old not in ch.entry:
+                    ch.release(old)
+                ch.segments.append(segment)
+                logger.info("channel %i: compacting", channel)
+                self._write_channel(channel, ch.serialize(ch.entry))
+
+    def preview(self, channel, frame, t0, t1, n):
+        """Preview the output of a channel.
+
+        The output is computed from the last written memory content of the
+        channel (:attr:`shadow`) with the software model of the DAC
+        (:class:`host.emulator.Dac`) with line FIFOs of depth
+        :attr:`fifo`. The frame is assumed to be started
+        at time zero with the trigger asserted throughout. Each sample is
+        evaluated directly, so long frames can be previewed sparsely.
+
+        Args:
+            channel (int): Channel index.
+            frame (int): Frame index.
+            t0 (float): Start time in seconds.
+            t1 (float): End time in seconds (inclusive).
+            n (int): Number of samples.
+
+        Returns:
+            t (array[float]): Sample times in seconds, rounded to clock
+                cycles.
+            v (array[float]): Output in Volt.
+        """
+        if self.shadow[channel] is None:
+            raise ValueError("channel memory content unknown")
+        if not 0 <= frame < self.num_frames:
+            raise ValueError("invalid frame index")
+        cycles = np.rint(np.linspace(t0, t1, n)*self.freq).astype(np.int64)
+        fifo = self.fifo
+        if fifo is None:
+            fifo = fifo_depths[self.num_dacs]
+        out = Dac(bytes(self.shadow[channel]), fifo).evaluate(cycles, frame)
+        return cycles/self.freq, out/Segment.out_scale
 
     def flush(self):
-        self.dev.flush()
+        """Flush the device.
+
+        If :attr:`track` is set, the flush is skipped if nothing has been
+        written since the last flush.
+        """
+        if self.track and self._flushed:
+            return
+        self.transport.flush()
+        self._flushed = True
 
     def disable(self, **kwargs):
         self.set_config(enable=False, **kwargs)
@@ -496,3 +2370,128 @@ class Pdq2:
 
     def ping(self):
         return True
+
+
+class AsyncPdq2:
+    """
+    PDQ stack with non-blocking commands for use with :mod:`asyncio`.
+
+    All writes to the device are executed in order by a single writer thread
+    of a wrapped :class:`Pdq2`. Serialization is executed in the default
+    executor of the event loop and overlaps with the writes.
+
+    Args:
+        *args: Passed to :class:`Pdq2`.
+        **kwargs: Passed to :class:`Pdq2`.
+
+    Attributes:
+        pdq (Pdq2): The wrapped synchronous PDQ stack. It must not be
+            used while commands of this object are pending.
+    """
+    def __init__(self, *args, **kwargs):
+        self.pdq = Pdq2(*args, **kwargs)
+        self._writer = ThreadPoolExecutor(max_workers=1)
+
+    def _submit(self, executor, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(executor, partial(func, *args, **kwargs))
+
+    async def _complete(self, future):
+        # a call that has been started always completes, e.g. to keep the
+        # framing and the checksum consistent
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            await asyncio.wait([future])
+            raise
+
+    def _write(self, func, *args, **kwargs):
+        return self._complete(self._submit(self._writer, func, *args,
+                                           **kwargs))
+
+    async def program(self, program, channels=None):
+        """Serialize a wavesynth program and write it to the channels
+        in the stack.
+
+        The channels are serialized one at a time (see
+        :meth:`Pdq2.serialize_channel`). The memory of each channel is
+        written as soon as it is serialized, while the following channels
+        are being serialized.
+
+        The :attr:`Pdq2.cache` of the wrapped stack is used as in
+        :meth:`Pdq2.program`: on a hit the cached memory images are written
+        and nothing is serialized. After a miss, the images are stored once
+        all channels are serialized.
+
+        If cancelled, the write in progress is completed and no further
+        channels are written. The channels that have not been written yet
+        retain their previous memory content but their :class:`Channel`
+        may already describe the new program.
+
+        Args:
+            program (list): Wavesynth program to serialize.
+            channels (list[int]): Channel indices to use. If unspecified, all
+                channels are used.
+        """
+        if channels is None:
+            channels = range(self.pdq.num_channels)
+        writes = []
+        try:
+            key, images = await self._complete(self._submit(
+                None, self.pdq._lookup, program, channels))
+            if images is not None:
+                writes = [self._writer.submit(self.pdq._write_channel,
+                                              channel, data)
+                          for channel, data in zip(channels, images)]
+            else:
+                images = []
+                for index, channel in enumerate(channels):
+                    data = await self._complete(self._submit(
+                        None, self.pdq.serialize_channel, channel, program,
+                        index))
+                    images.append(data)
+                    writes.append(self._writer.submit(
+                        self.pdq._write_channel, channel, data))
+                if key is not None:
+                    await self._complete(self._submit(
+                        None, self.pdq.cache.put, key, images))
+            written = saved = 0
+            for write in writes:
+                w, s = await self._complete(asyncio.wrap_future(write))
+                written, saved = written + w, saved + s
+        except asyncio.CancelledError:
+            # writes that have not been started yet are cancelled
+            pending = [asyncio.wrap_future(write) for write in writes
+                       if not write.cancel()]
+            if pending:
+                await asyncio.wait(pending)
+            raise
+        if self.pdq.delta:
+            logger.info("wrote %i bytes, saved %i bytes", written, saved)
+
+    async def set_config(self, **kwargs):
+        """Set the configuration register. See :meth:`Pdq2.set_config`."""
+        await self._write(self.pdq.set_config, **kwargs)
+
+    async def set_checksum(self, crc=0, board=0xf):
+        """Set/reset the checksum register."""
+        await self._write(self.pdq.set_checksum, crc, board)
+
+    async def set_frame(self, frame, board=0xf):
+        """Set the current frame."""
+        await self._write(self.pdq.set_frame, frame, board)
+
+    async def flush(self):
+        """Wait for all pending writes and flush the device."""
+        await self._write(self.pdq.flush)
+
+    async def disable(self, **kwargs):
+        await self._write(self.pdq.disable, **kwargs)
+
+    async def enable(self, **kwargs):
+        await self._write(self.pdq.enable, **kwargs)
+
+    async def close(self):
+        """Wait for all pending writes and close the device handle."""
+        await self._write(self.pdq.close)
+        self._writer.shutdown()
@@ -27,6 +27,10 @@ def _main():
     parser.add_argument("-x", "--xilinx", default=None)
     parser.add_argument("-c", "--config", default=[],
                         type=int, action="append")
+    parser.add_argument("-k", "--crc-width", default=8, type=int,
+                        choices=[8, 16, 32], help="checksum width")
+    parser.add_argument("-f", "--fifo", default=None, type=int,
+                        help="line FIFO depth (default: by channel count)")
     args = parser.parse_args()
 
     if not args.config:
@@ -34,7 +38,9 @@ def _main():
     for config in args.config:
         mems = [None, (20,), (10, 10), (8, 6, 6)][config]
         platform = Platform()
-        pdq = Pdq2(platform, mem_depths=[i << 10 for i in mems])
+        pdq = Pdq2(platform, mem_depths=[i << 10 for i in mems],
+                   crc_width=args.crc_width,
+                   fifo=args.fifo)
         platform.build(pdq, build_name="pdq2_{}ch".format(config),
                        toolchain_path=args.xilinx)
 
@@ -0,0 +1,149 @@
+# Copyright 2013-2016 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+
+import numpy as np
+
+from host.pdq2 import Pdq2, AsyncPdq2
+
+
+class FakeDevice:
+    """Write-only device with limited throughput (bytes per second)."""
+    def __init__(self, rate=1e6):
+        self.rate = rate
+        self.data = bytearray()
+
+    @property
+    def written(self):
+        return len(self.data)
+
+    def write(self, data):
+        time.sleep(len(data)/self.rate)
+        self.data += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def random_program(num_channels, num_frames=8, num_lines=40, seed=0):
+    rng = np.random.RandomState(seed)
+    program = []
+    for i in range(num_frames):
+        frame = []
+        for j in range(num_lines):
+            channel_data = []
+            for k in range(num_channels):
+                amplitude = (rng.uniform(-1, 1, 4)*[5, 1e-2, 1e-5, 1e-8]
+                             ).tolist()
+                if k % 3 == 2:
+                    channel_data.append({"dds": {
+                        "amplitude": amplitude,
+                        "phase": rng.uniform(-.25, .25, 3).tolist()}})
+                else:
+                    channel_data.append({"bias": {"amplitude": amplitude}})
+            frame.append({"duration": int(rng.randint(1, 1 << 16)),
+                          "trigger": j == 0, "channel_data": channel_data})
+        program.append(frame)
+    return program
+
+
+def bench_sync(program, rate):
+    dev = FakeDevice(rate)
+    p = Pdq2(dev=dev)
+    t0 = time.perf_counter()
+    p.program(program)
+    p.set_config(enable=True)
+    p.flush()
+    return time.perf_counter() - t0, bytes(dev.data)
+
+
+async def ticker(interval=1e-3):
+    """Measure the longest event loop stall."""
+    stall = 0.
+    t = time.perf_counter()
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            t, dt = time.perf_counter(), time.perf_counter() - t
+            stall = max(stall, dt - interval)
+    except asyncio.CancelledError:
+        return stall
+
+
+async def bench_async(program, rate):
+    dev = FakeDevice(rate)
+    p = AsyncPdq2(dev=dev)
+    tick = asyncio.ensure_future(ticker())
+    await asyncio.sleep(0)
+    t0 = time.perf_counter()
+    await p.program(program)
+    await p.set_config(enable=True)
+    await p.flush()
+    t = time.perf_counter() - t0
+    tick.cancel()
+    stall = await tick
+    await p.close()
+    return t, bytes(dev.data), stall
+
+
+async def cancel(program, delay, rate=1e6):
+    """Cancel program() after `delay` and program again."""
+    dev = FakeDevice(rate)
+    p = AsyncPdq2(dev=dev)
+    task = asyncio.ensure_future(p.program(program))
+    await asyncio.sleep(delay)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    else:
+        assert False
+    cancelled = bytes(dev.data)
+    await p.program(program)
+    await p.set_config(enable=True)
+    await p.flush()
+    await p.close()
+    return cancelled, bytes(dev.data[len(cancelled):])
+
+
+if __name__ == "__main__":
+    program = random_program(9)
+    for rate in 1e6, 4e6:
+        t_sync, data_sync = min(bench_sync(program, rate) for i in range(3))
+        t_async, data_async, stall = min(
+            asyncio.run(bench_async(program, rate)) for i in range(3))
+        # the same frames in the same order
+        assert data_sync == data_async
+        print("{:d} bytes at {:.3g} B/s: program() {:.3g} s (blocking), "
+              "AsyncPdq2.program() {:.3g} s (max event loop stall {:.3g} s)"
+              .format(len(data_sync), rate, t_sync, t_async, stall))
+
+    # cancellation completes the write in progress and stops there
+    for delay in 0, .01, .04:
+        cancelled, rest = asyncio.run(cancel(program, delay))
+        assert len(cancelled) < len(data_sync)
+        assert data_sync.startswith(cancelled)
+        assert not cancelled or cancelled.endswith(b"\xa5\x03")
+        # the checksum and framing remain consistent
+        assert rest == data_sync
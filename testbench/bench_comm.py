@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+from io import BytesIO
+
+from migen import *
+import numpy as np
+
+from gateware.pdq2 import Pdq2Sim
+from host.pdq2 import Pdq2
+
+
+def bench(msg, depth):
+    tb = Pdq2Sim(mem_depths=[depth])
+    b = tb.dut.comm.ftdi_bus
+    cycles = []
+
+    @passive
+    def count():
+        n = 0
+        while True:
+            yield
+            n += 1
+            if (yield b.stb) and (yield b.ack):
+                cycles.append(n)
+
+    mem = []
+
+    def read():
+        # wait for the reset generator
+        for i in range(1 << 7):
+            yield
+        yield from tb.write(msg)
+        for i in range(10):
+            yield
+        for i in range(depth):
+            mem.append((yield tb.dut.dacs[0].parser.mem[i]))
+
+    run_simulation(tb, [read(), count()])
+    return len(msg)/(cycles[-1] - cycles[0] + 1), bytes(
+        np.array(mem, "<u2").data)
+
+
+if __name__ == "__main__":
+    depth = 1 << 9
+    data = np.random.RandomState(0).bytes(2*depth)
+    dev = BytesIO()
+    Pdq2(dev=dev, num_dacs=1).write_mem(0, data)
+    msg = dev.getvalue()
+
+    rate, mem = bench(msg, depth)
+    assert mem == data
+    # the protocol handler accepts a byte every cycle, the FT245R reader
+    # in front of it is the limit
+    assert rate == 1, rate
+    print("{:.3g} bytes/cycle".format(rate))
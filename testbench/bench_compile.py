@@ -0,0 +1,46 @@
+# Copyright 2013-2016 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import os
+import time
+
+from host.pdq2 import Pdq2
+from testbench.bench_async import random_program
+
+
+def bench(num_boards, executor=None):
+    program = random_program(3*num_boards)
+    dev = BytesIO()
+    p = Pdq2(dev=dev, num_boards=num_boards)
+    t0 = time.perf_counter()
+    p.program(program, executor=executor)
+    return time.perf_counter() - t0, dev.getvalue()
+
+
+if __name__ == "__main__":
+    workers = os.cpu_count()
+    with ProcessPoolExecutor(workers) as executor:
+        bench(1, executor)  # start the workers
+        for num_boards in 1, 3, 9, 15:
+            t_serial, serial = bench(num_boards)
+            t_pool, pool = bench(num_boards, executor)
+            assert serial == pool
+            print("{:2d} boards: serial {:.3g} s, {:d} processes {:.3g} s, "
+                  "speedup {:.3g}".format(num_boards, t_serial, workers,
+                                          t_pool, t_serial/t_pool))
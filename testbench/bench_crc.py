@@ -0,0 +1,51 @@
+# Copyright 2013-2016 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+
+from host.pdq2 import crc8
+
+
+def reference(msg, crc=0, self=crc8):
+    # the plain per-byte table loop
+    for data in msg:
+        p = data ^ crc >> self.crc_width - self.data_width
+        q = crc << self.data_width & (1 << self.crc_width) - 1
+        crc = self._table[p] ^ q
+    return crc
+
+
+def rate(f, msg, duration=.2):
+    n = 0
+    t0 = time.perf_counter()
+    while True:
+        r = f(msg, 0x5a)
+        n += 1
+        t = time.perf_counter() - t0
+        if t > duration:
+            return r, n*len(msg)/t/1e6
+
+
+if __name__ == "__main__":
+    for size in 1 << 10, 1 << 16, 1 << 20:
+        msg = os.urandom(size)
+        a, ref = rate(reference, msg)
+        b, fast = rate(crc8, msg)
+        assert a == b
+        print("{:d} KiB: reference {:.3g} MB/s, crc8 {:.3g} MB/s".format(
+            size >> 10, ref, fast))
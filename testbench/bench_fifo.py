@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+from migen import *
+import numpy as np
+
+from gateware.dac import Dac
+from host import pdq2, emulator
+
+
+# a cubic bias line is 11 words long
+long_duration = 200
+
+
+class TB(Module):
+    def __init__(self, mem, fifo):
+        self.submodules.dac = Dac(fifo=fifo)
+        self.dac.parser.mem.init = [int(i) for i in mem]
+        self.dac.parser.frame.reset = 0
+        self.comb += [
+                self.dac.parser.start.eq(1),
+                self.dac.parser.arm.eq(1),
+                self.dac.out.arm.eq(1),
+                self.dac.out.trigger.eq(1),
+        ]
+
+
+def burst(n, duration):
+    """A long line followed by `n` short cubic lines."""
+    channel = pdq2.Channel(1 << 12, 8)
+    segment = channel.new_segment()
+    segment.bias(amplitude=[.1], duration=long_duration, trigger=True)
+    for i in range(n):
+        segment.bias(amplitude=[.1, 1e-3, 1e-5, 1e-7], duration=duration)
+    segment.line(typ=3, data=b"", duration=1, jump=True)
+    return channel.serialize()
+
+
+def called(duration):
+    """A long line, a call of a short line and a short line."""
+    channel = pdq2.Channel(1 << 12, 8)
+    inner = pdq2.Segment()
+    inner.bias(amplitude=[.2], duration=duration, jump=True)
+    outer = channel.new_segment()
+    outer.bias(amplitude=[.1], duration=long_duration, trigger=True)
+    outer.call(inner)
+    outer.bias(amplitude=[.1, 1e-3, 1e-5, 1e-7], duration=duration)
+    outer.line(typ=3, data=b"", duration=1, jump=True)
+    channel.segments.append(inner)
+    return channel.serialize([outer])
+
+
+def late(mem, fifo, cycles):
+    """Number of lines accepted after the previous line has finished,
+    except after the last line of the frame."""
+    end = emulator.parse_frame(np.frombuffer(mem, "<u2"), 0)[-1].addr
+    schedule = emulator.Dac(mem, fifo).schedule(cycles)
+    return sum(a > b + (line.duration << line.shift) and line.addr != end
+               for (b, line), (a, _) in zip(schedule, schedule[1:]))
+
+
+def simulate(mem, fifo, cycles):
+    tb = TB(np.frombuffer(mem, "<u2"), fifo)
+    counters = []
+
+    def run():
+        for i in range(cycles):
+            yield
+        counters.append((yield tb.dac.underruns))
+        counters.append((yield tb.dac.level_max))
+
+    run_simulation(tb, run())
+    return counters
+
+
+def underruns(n, duration, fifo):
+    mem = burst(n, duration)
+    # stop after the burst but before the long line is executed again
+    cycles = 20 + long_duration + (n + 1)*max(duration, 12)
+    counters = simulate(mem, fifo, cycles)
+    # compare with the late lines in the model
+    assert counters[0] == late(mem, fifo, cycles), counters
+    return counters
+
+
+def min_duration(n, fifo, hi=16):
+    """Shortest sustained line duration without underruns."""
+    lo = 0
+    while hi - lo > 1:
+        d = (lo + hi)//2
+        if underruns(n, d, fifo)[0]:
+            lo = d
+        else:
+            hi = d
+    return hi
+
+
+if __name__ == "__main__":
+    fifos = [0] + sorted(set(emulator.fifo_depths[1:]))
+    print("minimum duration (cycles) of n cubic lines after a long line")
+    print("  n " + "".join(" fifo={:<3d}".format(f) for f in fifos))
+    for n in 4, 16, 64:
+        d = [min_duration(n, fifo) for fifo in fifos]
+        print("{:3d} ".format(n) + "".join("{:9d}".format(i) for i in d))
+        # reading a line is the limit without a FIFO
+        assert d[0] == 12, d
+        assert d == sorted(d, reverse=True), d
+    # the FIFO fills during the long line
+    counters = underruns(16, 1, 16)
+    assert counters[1] == 16, counters
+    # returning from a call is not the end of the frame
+    for fifo in fifos:
+        mem = called(2)
+        cycles = 2*long_duration + 50
+        counters = simulate(mem, fifo, cycles)
+        assert counters[0] == late(mem, fifo, cycles), (fifo, counters)
+        if not fifo:
+            # the lines after the call and after its return, twice
+            assert counters[0] == 4, counters
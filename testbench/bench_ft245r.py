@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+from itertools import count
+import random
+
+from migen import *
+from migen.genlib.record import Record
+
+from gateware.ft245r import Ft245r_rx, SimFt245r_rx_w, ft245r_layout
+
+
+class TB(Module):
+    def __init__(self, data, clk2x):
+        # 50 MHz, 100 MHz with the clock doubler
+        self.clk = 10. if clk2x else 20.
+        self.pads = Record(ft245r_layout)
+        self.submodules.ft245r = SimFt245r_rx_w(self.pads, data, self.clk)
+        self.submodules.dut = Ft245r_rx(self.pads, 20.,
+                                        clk2x=Constant(clk2x))
+        self.received = []
+        self.cycles = []
+
+    def read(self, n, stall=0.):
+        source = self.dut.source
+        for i in count():
+            yield source.ack.eq(random.random() >= stall)
+            yield
+            if (yield source.stb) and (yield source.ack):
+                self.received.append((yield source.data))
+                self.cycles.append(i)
+                if len(self.received) == n:
+                    break
+
+
+def bench(clk2x, n=200, stall=0.):
+    random.seed(0)
+    data = [random.randrange(256) for i in range(n)]
+    tb = TB(data, clk2x)
+    run_simulation(tb, [tb.ft245r.run(), tb.read(n, stall)])
+    assert tb.received == data
+    assert not tb.ft245r.errors, tb.ft245r.errors
+    cycles = tb.cycles[-1] - tb.cycles[0]
+    return (n - 1)/cycles, (n - 1)/(cycles*tb.clk*1e-9)
+
+
+if __name__ == "__main__":
+    for clk2x in False, True:
+        for stall in 0., .5:
+            per_cycle, rate = bench(clk2x, stall=stall)
+            print("clk2x {:d}, stall {:g}: {:.3g} bytes/cycle, "
+                  "{:.3g} MB/s".format(clk2x, stall, per_cycle, rate/1e6))
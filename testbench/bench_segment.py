@@ -0,0 +1,52 @@
+# Copyright 2013-2016 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+import numpy as np
+
+from host.pdq2 import Segment
+
+
+def bench(n):
+    rng = np.random.RandomState(0)
+    amplitude = rng.uniform(-1, 1, (n, 4))*[5, 1e-2, 1e-5, 1e-8]
+    phase = rng.uniform(-.25, .25, (n, 3))*[1, 1e-2, 1e-5]
+    duration = rng.randint(1, 1 << 16, n)
+    trigger = rng.randint(0, 2, n).astype(bool)
+
+    t0 = time.perf_counter()
+    a = Segment()
+    for ai, di, ti in zip(amplitude.tolist(), duration.tolist(),
+                          trigger.tolist()):
+        a.bias(amplitude=ai, duration=di, trigger=ti)
+    for ai, pi, di in zip(amplitude.tolist(), phase.tolist(),
+                          duration.tolist()):
+        a.dds(amplitude=ai, phase=pi, duration=di, shift=3)
+    t1 = time.perf_counter()
+    b = Segment()
+    b.bias_array(amplitude, duration, trigger=trigger)
+    b.dds_array(amplitude, duration, phase=phase, shift=3)
+    t2 = time.perf_counter()
+
+    print("{:d} lines: line() {:.3g} lines/s, *_array() {:.3g} lines/s".format(
+        2*n, 2*n/(t1 - t0), 2*n/(t2 - t1)))
+
+
+if __name__ == "__main__":
+    for n in 10000, 100000:
+        bench(n//2)
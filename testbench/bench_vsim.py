@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+from io import BytesIO
+import time
+
+from migen import run_simulation
+import numpy as np
+
+from gateware.pdq2 import Pdq2Sim
+from host import cli
+from testbench import vsim
+
+
+def migen(mem, cycles, **kwargs):
+    def run(n):
+        for i in range(n):
+            yield
+
+    tb = Pdq2Sim(**kwargs)
+    t0 = time.perf_counter()
+    run_simulation(tb, [tb.write(mem), tb.record(), run(cycles)])
+    t = time.perf_counter() - t0
+    return np.array(tb.outputs, np.uint16), cycles/t
+
+
+if __name__ == "__main__":
+    buf = BytesIO()
+    cli.main(buf)
+    mem = buf.getvalue()
+
+    backends = vsim.available()
+    if not backends:
+        print("verilator not found")
+    # memory depths with three, two and one channels per board
+    for mems in (8, 6, 6), (10, 10), (20,):
+        mem_depths = [i << 10 for i in mems]
+        ref_cycles = 2000
+        ref, speed = migen(mem, ref_cycles, mem_depths=mem_depths)
+        print("{} channels: run_simulation(): {:.3g} cycles/s".format(
+            len(mems), speed))
+        for backend in backends:
+            with backend(mem_depths=mem_depths) as sim:
+                sim.write(mem)
+                sim.record()
+                t0 = time.perf_counter()
+                sim.run(ref_cycles)
+                t_build = time.perf_counter() - t0
+                assert np.array_equal(sim.outputs, ref)
+                cycles = 10**6
+                sim.run(cycles)
+                assert sim.outputs.shape == (cycles, len(mems))
+                print("{} channels: {}: {:.3g} cycles/s (build {:.3g} s)"
+                      .format(len(mems), backend.__name__,
+                              sim.cycles_per_second, t_build))
@@ -27,8 +27,8 @@ from host import pdq2
 
 
 class TB(Module):
-    def __init__(self, mem=None):
-        self.submodules.dac = Dac()
+    def __init__(self, mem=None, fifo=0):
+        self.submodules.dac = Dac(fifo=fifo)
         if mem is not None:
             self.dac.parser.mem.init = [int(i) for i in mem]
         self.outputs = []
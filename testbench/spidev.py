@@ -0,0 +1,122 @@
+# Copyright 2013-2016 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Software stand-in for a ``spidev`` device connected to a PDQ2 stack."""
+
+import numpy as np
+
+from host.pdq2 import Pdq2, crc8
+
+
+class SimSpidev:
+    """Software stand-in for a ``spidev`` device connected to a PDQ2 stack.
+
+    Models the registers, the checksum and the channel memories of each
+    board as written and read by :class:`gateware.comm.Protocol` through
+    the SPI interface. Each transfer is one frame. All boards receive all
+    frames and checksum all bytes except those that request data to be
+    read back.
+
+    Args:
+        num_boards (int): Number of boards in the stack.
+        num_dacs (int): Number of DAC outputs per board.
+        crc (CRC): Checksum of the boards.
+
+    Attributes:
+        regs (list[list[int]]): Configuration, checksum, frame and status
+            registers of each board. The status register holds the USB
+            data rate and the counters of each channel, see
+            :meth:`host.pdq2.Pdq2.read_status`.
+        mems (list[bytearray]): Memory of each channel.
+        transfers (int): Number of transfers.
+        bytes (int): Number of bytes transferred.
+    """
+    def __init__(self, num_boards=3, num_dacs=3, crc=crc8):
+        self.num_dacs = num_dacs
+        self.crc = crc
+        m = Pdq2._mem_sizes[num_dacs]
+        self.regs = [[0, 0, 0, 0] for i in range(num_boards)]
+        self.mems = [bytearray(2*(m[j] << 11))
+                     for i in range(num_boards) for j in range(num_dacs)]
+        self.transfers = 0
+        self.bytes = 0
+
+    def _frame(self, board, msg, miso):
+        regs = self.regs[board]
+        cmd = msg[0]
+        adr, is_mem, we = cmd & 3, cmd >> 2 & 1, cmd >> 7
+        match = cmd >> 3 & 0xf in (board, 0xf)
+        regs[1] = self.crc(msg[:1], regs[1])
+        if not match:
+            regs[1] = self.crc(msg[1:], regs[1])
+        elif not is_mem:
+            if len(msg) < 2:
+                return
+            n = self.crc.crc_width//8 if adr == 1 else 1
+            if adr == 3 and not we:
+                n = 1 + 2*self.num_dacs
+            if we:
+                if adr == 1:
+                    regs[1] = int.from_bytes(msg[1:1 + n], "little")
+                else:
+                    regs[1] = self.crc(msg[1:2], regs[1])
+                if adr in (0, 2):
+                    regs[adr] = msg[1]
+                elif adr == 3:
+                    # clear the counters
+                    regs[3] &= 0xff
+                if adr == 0 and msg[1] & 1:
+                    # reset
+                    regs[:3] = [0, 0, 0]
+            elif regs[0] & 0x10:  # aux_miso
+                data = regs[adr].to_bytes(n, "little")
+                miso[2:2 + n] = data[:len(msg) - 2]
+            regs[1] = self.crc(msg[1 + n:], regs[1])
+        elif adr < self.num_dacs:
+            mem = self.mems[board*self.num_dacs + adr]
+            regs[1] = self.crc(msg[1:3], regs[1])
+            start = int.from_bytes(msg[1:3], "little")
+            data = msg[3:]
+            if we:
+                regs[1] = self.crc(data, regs[1])
+            addrs = (start + np.arange(len(data))) % len(mem)
+            view = np.frombuffer(mem, np.uint8)
+            if we:
+                view[addrs] = np.frombuffer(data, np.uint8)
+            elif regs[0] & 0x10:  # aux_miso
+                miso[4:] = view[addrs[:-1]].tobytes()
+
+    def _transfer(self, data):
+        msg = bytes(data)
+        miso = bytearray(len(msg))
+        self.transfers += 1
+        self.bytes += len(msg)
+        if msg:
+            for board in range(len(self.regs)):
+                self._frame(board, msg, miso)
+        return miso
+
+    def writebytes2(self, data):
+        """Write data in one transfer."""
+        self._transfer(data)
+
+    def xfer2(self, data):
+        """Write data in one transfer and return the data read."""
+        return list(self._transfer(data))
+
+    def close(self):
+        pass
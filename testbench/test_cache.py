@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from io import BytesIO
+import os
+import tempfile
+
+import numpy as np
+
+from host.pdq2 import Pdq2, AsyncPdq2, ProgramCache
+from testbench.test_update import random_frame
+
+
+def pdq(cache, **kwargs):
+    return Pdq2(dev=BytesIO(), num_boards=1, num_dacs=3, num_frames=8,
+                cache=cache, **kwargs)
+
+
+if __name__ == "__main__":
+    rng = np.random.RandomState(0)
+    programs = [[random_frame(rng, 10) for i in range(3)] for j in range(3)]
+
+    # misses and hits
+    cache = ProgramCache()
+    ref = pdq(None)
+    ref.program(programs[0])
+    a = pdq(cache)
+    a.program(programs[0])
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert cache.size == sum(map(len, ref.shadow))
+    b = pdq(cache)
+    b.program(programs[0])
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert b.shadow == ref.shadow
+    assert b.dev.getvalue() == ref.dev.getvalue()
+
+    # the options that change the images are part of the key
+    key = ProgramCache.key(programs[0], range(3), 8, Pdq2.freq, [1, 2, 3])
+    assert key != ProgramCache.key(programs[1], range(3), 8, Pdq2.freq,
+                                   [1, 2, 3])
+    assert key != ProgramCache.key(programs[0], range(3), 8, Pdq2.freq,
+                                   [1, 2, 3], fold=True)
+    assert key != ProgramCache.key(programs[0], range(3), 8, Pdq2.freq,
+                                   [1, 2, 3], outline=True)
+    pdq(cache, outline=True).program(programs[0])
+    assert (cache.hits, cache.misses) == (1, 2)
+    pdq(cache, fold=True).program(programs[0])
+    assert (cache.hits, cache.misses) == (1, 3)
+
+    # frame updates after a hit rebuild the channels
+    new = random_frame(rng, 5)
+    a.update_frame(1, new)
+    b.update_frame(1, new)
+    assert b.shadow == a.shadow
+    assert b.dev.getvalue()[len(ref.dev.getvalue()):] == \
+        a.dev.getvalue()[len(ref.dev.getvalue()):]
+    # and do not alter the cached images
+    c = pdq(cache)
+    c.program(programs[0])
+    assert c.shadow == ref.shadow
+
+    # least recently used entries are evicted
+    sizes = []
+    for program in programs:
+        p = pdq(None)
+        p.program(program)
+        sizes.append(sum(map(len, p.shadow)))
+    cache = ProgramCache(max_bytes=2*max(sizes))
+    pdq(cache).program(programs[0])
+    pdq(cache).program(programs[1])
+    pdq(cache).program(programs[0])
+    assert cache.size == sizes[0] + sizes[1]
+    pdq(cache).program(programs[2])
+    assert cache.size <= cache.max_bytes
+    assert cache.size == sizes[0] + sizes[2]
+    assert (cache.hits, cache.misses) == (1, 3)
+    pdq(cache).program(programs[1])
+    assert (cache.hits, cache.misses) == (1, 4)
+    pdq(cache).program(programs[2])
+    assert (cache.hits, cache.misses) == (2, 4)
+
+    # the on-disk tier holds the raw images
+    with tempfile.TemporaryDirectory() as path:
+        cache = ProgramCache(max_bytes=0, path=path)
+        pdq(cache).program(programs[0])
+        assert cache.size == 0
+        files = os.listdir(path)
+        assert len(files) == 1 and files[0].endswith(".bin")
+        with open(os.path.join(path, files[0]), "rb") as f:
+            data = f.read()
+        assert data.endswith(b"".join(ref.shadow))
+        cache = ProgramCache(path=path)
+        b = pdq(cache)
+        b.program(programs[0])
+        assert (cache.hits, cache.misses) == (1, 0)
+        assert b.shadow == ref.shadow
+        # a new serializer version invalidates all entries
+        class NewCache(ProgramCache):
+            version = ProgramCache.version + 1
+        cache = NewCache(path=path)
+        pdq(cache).program(programs[0])
+        assert (cache.hits, cache.misses) == (0, 1)
+
+    # the asynchronous interface shares the cache
+    async def program_async(p, *programs):
+        for program in programs:
+            await p.program(program)
+        await p.flush()
+
+    cache = ProgramCache()
+    ref = pdq(None)
+    ref.program(programs[0])
+    ref.program(programs[1])
+    ref.update_frame(1, new)
+    a = AsyncPdq2(dev=BytesIO(), num_boards=1, num_dacs=3, num_frames=8,
+                  cache=cache)
+    asyncio.run(program_async(a, programs[0], programs[0]))
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert a.pdq.shadow == c.shadow
+    # a program serialized after a hit replaces the cached channels
+    asyncio.run(program_async(a, programs[1]))
+    assert (cache.hits, cache.misses) == (1, 2)
+    a.pdq.update_frame(1, new)
+    assert a.pdq.shadow == ref.shadow
+    b = pdq(cache)
+    b.program(programs[1])
+    assert (cache.hits, cache.misses) == (2, 2)
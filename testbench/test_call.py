@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+from migen import *
+import numpy as np
+
+from host import pdq2
+from host.emulator import Dac
+from testbench.dac import TB
+
+
+def pulse(segment, **kwargs):
+    segment.bias(amplitude=[0, .05], duration=12)
+    segment.dds(amplitude=[1, 0, -1e-3, 0], phase=[0, .05], duration=10)
+    segment.bias(amplitude=[.5], duration=15, shift=1, **kwargs)
+
+
+def ramp(segment, **kwargs):
+    segment.bias(amplitude=[.2, -.01], duration=25, **kwargs)
+
+
+def frame(channel, body):
+    segment = channel.new_segment()
+    segment.bias(amplitude=[.3], duration=10, trigger=True)
+    body(segment)
+    segment.bias(amplitude=[-.3], duration=10)
+    segment.line(typ=3, data=b"", trigger=True, duration=1, jump=True)
+    return segment
+
+
+def once(segment):
+    pulse(segment)
+    ramp(segment)
+    segment.bias(amplitude=[-.1], duration=20)
+
+
+def twice(segment):
+    once(segment)
+    once(segment)
+
+
+def unrolled(outline=False):
+    channel = pdq2.Channel(1 << 12, 8)
+    entry = [frame(channel, twice), frame(channel, once)]
+    if outline:
+        assert channel.outline() > 0
+    return channel.serialize(entry)
+
+
+def called():
+    channel = pdq2.Channel(1 << 12, 8)
+    inner = pdq2.Segment()
+    ramp(inner, jump=True)
+    outer = pdq2.Segment()
+    pulse(outer)
+    outer.call(inner)
+    outer.bias(amplitude=[-.1], duration=20, jump=True)
+
+    def body(segment):
+        segment.call(outer)
+        segment.repeat(1, 2)
+
+    entry = [frame(channel, body), frame(channel, lambda s: s.call(outer))]
+    channel.segments += [inner, outer]
+    return channel.serialize(entry)
+
+
+def simulate(mem, cycles, frame):
+    tb = TB(list(np.frombuffer(mem, "<u2")))
+    tb.dac.parser.frame.reset = frame
+    run_simulation(tb, tb.run(cycles))
+    return np.array(tb.outputs, np.uint16).view(np.int16)
+
+
+if __name__ == "__main__":
+    cycles = 400
+    # TB.run() starts at cycle 6 and triggers at cycle 21
+    trigger = np.zeros(cycles, np.bool_)
+    trigger[21] = True
+    ref = unrolled()
+    mems = [called(), unrolled(outline=True)]
+    for mem in mems:
+        assert len(mem) < len(ref)
+    for frame in range(2):
+        out = simulate(ref, cycles, frame)
+        assert np.any(out)
+        for mem in mems:
+            assert np.array_equal(simulate(mem, cycles, frame), out)
+            assert np.array_equal(
+                Dac(mem).run(cycles, frame, start=6, trigger=trigger), out)
@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+# Copyright 2013-2016 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+from host.pdq2 import Pdq2, SPIFramer
+from testbench.spidev import SimSpidev
+
+
+class NoisySpidev(SimSpidev):
+    """Corrupts a memory byte in the next ``faults`` writes covering it."""
+    def __init__(self, addr, faults, **kwargs):
+        super().__init__(**kwargs)
+        self.addr = addr
+        self.faults = faults
+
+    def _transfer(self, data):
+        msg = bytearray(data)
+        start = int.from_bytes(msg[1:3], "little")
+        if (self.faults and msg[0] & 0x84 == 0x84 and
+                start <= self.addr < start + len(msg) - 3):
+            msg[3 + self.addr - start] ^= 0x10
+            self.faults -= 1
+        return super()._transfer(msg)
+
+
+def upload(image, faults, addr=5000, **kwargs):
+    dev = NoisySpidev(addr=addr, faults=faults, num_boards=2, num_dacs=3)
+    pdq = Pdq2(num_boards=2, num_dacs=3, transport=SPIFramer(dev))
+    pdq.set_config(aux_miso=True, enable=False)
+    retransmitted = pdq.write_mem_checked(4, image, **kwargs)
+    assert dev.mems[4][:len(image)] == image
+    assert pdq.validate(1)
+    return retransmitted
+
+
+if __name__ == "__main__":
+    image = np.random.RandomState(0).bytes(1 << 13)
+    assert upload(image, 0) == 0
+    # the whole image, then one half and one quarter
+    assert upload(image, 1) == len(image)
+    assert upload(image, 3) == len(image)*7//4
+    # down to 64 bytes and three retries
+    assert upload(image, 8 + 2) == 2*len(image) - 128 + 3*64
+    try:
+        upload(image, 8 + 3)
+    except IOError:
+        pass
+    else:
+        assert False
+
+    # bisection ends at single words: 3001, 1500, 752, 376, 188, 94, 48,
+    # 24, 12, 6, 2 bytes and three retries
+    for min_size in 0, 1, 2:
+        upload(image[:3001], 11 + 2, addr=1001, min_size=min_size)
+        try:
+            upload(image[:3001], 11 + 3, addr=1001, min_size=min_size)
+        except IOError:
+            pass
+        else:
+            assert False
+
+    # checked program uploads
+    dev = NoisySpidev(addr=100, faults=2, num_boards=1, num_dacs=3)
+    pdq = Pdq2(num_boards=1, num_dacs=3, transport=SPIFramer(dev),
+               checked=True)
+    pdq.set_config(aux_miso=True, enable=False)
+    program = [[{"trigger": True, "duration": 100, "channel_data": [
+        {"bias": {"amplitude": [0, 1e-3*i, 0, 1e-6]}}]} for i in range(30)]]
+    pdq.program(program, channels=[0])
+    data = pdq.shadow[0]
+    assert dev.mems[0][:len(data)] == data
+    assert pdq.verify(0, repair=False) == []
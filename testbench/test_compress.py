@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+# Copyright 2013-2016 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+from io import BytesIO
+
+import numpy as np
+
+from host.compile import compress
+from host.emulator import Dac
+from host.pdq2 import Pdq2, Segment
+
+
+def check(t, v, tolerance):
+    c = compress(t, v, tolerance)
+    assert c.error <= tolerance
+    assert np.abs(c.output - v).max() == c.error
+
+    # the predicted output is the emulated output
+    p = Pdq2(dev=BytesIO(), num_boards=1, num_dacs=1)
+    p.program([c.lines])
+    dac = Dac(bytes(p.shadow[0]))
+    cycles = np.rint(t*p.freq).astype(np.int64)
+    cycles -= cycles[0]
+    first = dac.schedule(int(cycles[-1]) + 100)[0][0]
+    out = dac.evaluate(first + 2 + cycles)
+    assert np.array_equal(out/Segment.out_scale, c.output)
+    return c
+
+
+if __name__ == "__main__":
+    rs = np.random.RandomState(0)
+    t = np.arange(20000)/Pdq2.freq
+    for v, tolerance in [
+            (np.sin(2*np.pi*1e5*t)*3 + (t > 2e-4), 1e-3),
+            (np.sin(2*np.pi*1e5*t)*3, 3e-4),
+            (rs.normal(size=len(t))[::20], 1e-3),
+    ]:
+        c = check(t[::len(t)//len(v)], v, tolerance)
+        print(c)
+        assert c.ratio > 1
+    # slow traces need dac_divider
+    t = np.sort(rs.choice(10**7, 300, replace=False))/Pdq2.freq
+    c = check(t, 2*np.sin(300*t), 1e-3)
+    print(c)
+    assert max(line.get("dac_divider", 1) for line in c.lines) > 1
@@ -1,16 +1,19 @@
 import logging
+import os
+
 from migen import *
 
 from misoc.cores.liteeth_mini.mac.crc import LiteEthMACCRCEngine
-from host.pdq2 import crc8
+from gateware.comm import crc_polynomials
+from host.pdq2 import CRC, crc8, crc16, crc32
 
 logger = logging.getLogger(__name__)
 
 
 class TB(Module):
-    def __init__(self, polynom=0x07):
+    def __init__(self, polynom=0x07, width=8):
         self.submodules.crc = LiteEthMACCRCEngine(
-            data_width=8, width=8, polynom=polynom)
+            data_width=8, width=width, polynom=polynom)
         self.din = Signal(8)
         self.comb += self.crc.data.eq(self.din[::-1])
         self.sync += self.crc.last.eq(self.crc.next)
@@ -30,3 +33,22 @@ if __name__ == "__main__":
     m = b"123456789"
     run_simulation(tb, tb.run_data(m, out), vcd_name="crc.vcd")
     assert out[-1] == crc8(m)
+
+    for width, crc in (8, crc8), (16, crc16), (32, crc32):
+        # long enough for the vectorized engine of crc8, not a multiple of
+        # the number of slices
+        tb = TB(crc_polynomials[width], width)
+        out = []
+        m = os.urandom(crc8.threshold + 13)
+        run_simulation(tb, tb.run_data(m, out))
+        assert out[-1] == crc(m)
+        assert out[-1] == crc(m[500:], crc(m[:500]))
+        # crc16 and crc32 use binascii and zlib, force the vectorized engine
+        fast = CRC(crc.poly, threshold=0)
+        fast._accel = None
+        assert fast(m) == out[-1]
+        assert fast(m[500:], fast(m[:500])) == out[-1]
+        # and the table loop
+        slow = CRC(crc.poly, threshold=len(m) + 1)
+        slow._accel = None
+        assert slow(m) == out[-1]
@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+import copy
+from io import BytesIO
+
+import numpy as np
+
+from host.pdq2 import Pdq2, SPIFramer, dirty_ranges
+from testbench.spidev import SimSpidev
+from testbench.test_update import random_frame
+
+
+class RecordingSpidev(SimSpidev):
+    """Records the byte ranges of all memory writes."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.writes = []
+
+    def _transfer(self, data):
+        msg = bytes(data)
+        if msg and msg[0] >> 2 & 1 and msg[0] >> 7:
+            start = int.from_bytes(msg[1:3], "little")
+            self.writes.append((msg[0] & 3, start, start + len(msg) - 3))
+        return super()._transfer(data)
+
+
+def reference_ranges(old, new, gap):
+    """Word ranges of `new` that differ from `old`, merged across at most
+    `gap` unchanged words."""
+    old = np.frombuffer(old, "<u2")
+    new = np.frombuffer(new, "<u2")
+    ranges = []
+    for i in range(len(new)):
+        if i < len(old) and old[i] == new[i]:
+            continue
+        if ranges and i - ranges[-1][1] <= gap:
+            ranges[-1][1] = i + 1
+        else:
+            ranges.append([i, i + 1])
+    return [tuple(r) for r in ranges]
+
+
+def spi(delta_gap=4):
+    # large enough for every range to be written in one transfer
+    dev = RecordingSpidev(num_boards=1, num_dacs=3)
+    pdq = Pdq2(num_boards=1, num_dacs=3, num_frames=8, delta=True,
+               delta_gap=delta_gap, transport=SPIFramer(dev, 1 << 16))
+    return dev, pdq
+
+
+def reprogram(dev, pdq, program):
+    """Program and return the previous and the new memory images."""
+    old = [mem and bytes(mem) for mem in pdq.shadow]
+    ref = Pdq2(dev=BytesIO(), num_boards=1, num_dacs=3, num_frames=8)
+    ref.program(program)
+    images = [bytes(mem) for mem in ref.shadow]
+    del dev.writes[:]
+    pdq.program(program)
+    for channel, image in enumerate(images):
+        assert dev.mems[channel][:len(image)] == image, channel
+        assert pdq.shadow[channel][:len(image)] == image, channel
+    return old, images
+
+
+def check_writes(dev, pdq, old, images):
+    expect = []
+    for channel, (a, b) in enumerate(zip(old, images)):
+        ranges = dirty_ranges(a, b, pdq.delta_gap)
+        assert ranges == reference_ranges(a, b, pdq.delta_gap), channel
+        expect.extend((channel, 2*i, 2*j) for i, j in ranges)
+    assert dev.writes == expect, (dev.writes, expect)
+    return expect
+
+
+if __name__ == "__main__":
+    rng = np.random.RandomState(0)
+
+    # merging
+    old = bytes(40)
+    new = np.zeros(20, "<u2")
+    new[[2, 3, 8, 14]] = 1
+    new = new.tobytes()
+    assert dirty_ranges(old, new) == [(2, 4), (8, 9), (14, 15)]
+    assert dirty_ranges(old, new, 4) == [(2, 9), (14, 15)]
+    assert dirty_ranges(old, new, 5) == [(2, 15)]
+    assert dirty_ranges(old, old) == []
+    assert dirty_ranges(old[:8], new) == [(2, 20)]
+    assert dirty_ranges(new, new[:20]) == []
+    for i in range(100):
+        a = rng.randint(0, 3, rng.randint(0, 50)).astype("<u2").tobytes()
+        b = rng.randint(0, 3, rng.randint(0, 50)).astype("<u2").tobytes()
+        for gap in 0, 1, 3:
+            assert dirty_ranges(a, b, gap) == reference_ranges(a, b, gap)
+
+    program = [random_frame(rng, 20) for i in range(3)]
+    dev, pdq = spi()
+    # unknown memory content is written entirely
+    old, images = reprogram(dev, pdq, program)
+    assert dev.writes == [(c, 0, len(image))
+                          for c, image in enumerate(images)]
+
+    # a slightly changed program only sends the changed ranges
+    changed = copy.deepcopy(program)
+    changed[1][5]["channel_data"][0]["bias"]["amplitude"][0] += .1
+    changed[2][3]["duration"] += 1
+    old, images = reprogram(dev, pdq, changed)
+    assert images != old
+    writes = check_writes(dev, pdq, old, images)
+    assert 0 < sum(j - i for c, i, j in writes) < sum(map(len, images))//10
+
+    # an unchanged program sends no data
+    old, images = reprogram(dev, pdq, changed)
+    assert images == old
+    assert dev.writes == []
+
+    # a longer image sends the tail
+    longer = copy.deepcopy(changed)
+    longer[2].extend(random_frame(rng, 5)[1:])
+    old, images = reprogram(dev, pdq, longer)
+    assert all(len(b) > len(a) for a, b in zip(old, images))
+    for c, i, j in check_writes(dev, pdq, old, images)[-1:]:
+        assert j == len(images[c])
+
+    # a shorter image leaves the stale tail in memory
+    old, images = reprogram(dev, pdq, changed)
+    assert all(len(b) < len(a) for a, b in zip(old, images))
+    check_writes(dev, pdq, old, images)
+    for c, image in enumerate(images):
+        assert dev.mems[c][len(image):len(old[c])] == old[c][len(image):]
+
+    # the returned statistics and the same result through a BytesIO
+    dev = BytesIO()
+    pdq = Pdq2(dev=dev, num_boards=1, num_dacs=3, num_frames=8, delta=True)
+    pdq.program(program)
+    full = dev.tell()
+    image = bytes(pdq.shadow[0])
+    pdq.program(changed)
+    assert 0 < dev.tell() - full < full//4
+    ranges = dirty_ranges(pdq.shadow[0], image, pdq.delta_gap)
+    written = 2*sum(j - i for i, j in ranges)
+    assert pdq.write_mem_delta(0, image) == (written, len(image) - written)
+    assert pdq.write_mem_delta(0, image) == (0, len(image))
+    assert bytes(pdq.shadow[0]) == image
+    ref = Pdq2(dev=BytesIO(), num_boards=1, num_dacs=3, num_frames=8)
+    ref.program(changed)
+    assert pdq.shadow[1:] == ref.shadow[1:]
@@ -0,0 +1,120 @@
+# Copyright 2013-2016 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+from io import BytesIO
+import time
+
+from migen import *
+import numpy as np
+
+from host import pdq2
+from host.emulator import Dac
+from testbench.dac import TB, _test_program
+
+
+def simulate(mem, cycles, fifo=0):
+    tb = TB(list(np.frombuffer(mem, "<u2")), fifo)
+    run_simulation(tb, tb.run(cycles))
+    return np.array(tb.outputs, np.uint16).view(np.int16)
+
+
+def emulate(mem, cycles, fifo=0):
+    # TB.run() starts at cycle 6 and triggers at cycle 21
+    trigger = np.zeros(cycles, np.bool_)
+    trigger[21] = True
+    return Dac(mem, fifo).run(cycles, start=6, trigger=trigger)
+
+
+def evaluate(mem, t, fifo=0):
+    # as emulate() at the cycles t
+    trigger = np.zeros(t.max() + 1, np.bool_)
+    trigger[21] = True
+    return Dac(mem, fifo).evaluate(t, start=6, trigger=trigger)
+
+
+def random_channel(rng, num_lines=20):
+    channel = pdq2.Channel(1 << 12, 8)
+    segment = channel.new_segment()
+    block = 0
+    for i in range(num_lines):
+        if block and rng.rand() < .15:
+            segment.repeat(rng.randint(1, block + 1), rng.randint(1, 4))
+            block = 0
+        block += 1
+        kwargs = dict(duration=int(rng.choice([1, 2, 3, 5, 20])),
+                      shift=int(rng.choice([0, 0, 1, 3])),
+                      wait=bool(rng.rand() < .1))
+        amplitude = (rng.uniform(-1, 1, 4)*[3, 1e-2, 1e-4, 1e-6]).tolist()
+        if rng.rand() < .5:
+            segment.bias(amplitude=amplitude[:rng.randint(1, 5)], **kwargs)
+        else:
+            phase = (rng.uniform(-1, 1, 3)*[.5, .05, 1e-4]).tolist()
+            segment.dds(amplitude=amplitude, phase=phase[:rng.randint(4)],
+                        clear=bool(rng.rand() < .3), **kwargs)
+    segment.line(typ=3, data=b"", trigger=True, duration=1, jump=True)
+    return channel.serialize()
+
+
+if __name__ == "__main__":
+    cycles = 400
+    p = pdq2.Pdq2(dev=BytesIO())
+    p.program(_test_program)
+    mems = [p.channels[i].serialize() for i in range(3)]
+    rng = np.random.RandomState(0)
+    mems += [random_channel(rng) for i in range(5)]
+
+    t_sim = t_emu = 0.
+    for mem in mems:
+        t0 = time.perf_counter()
+        sim = simulate(mem, cycles)
+        t1 = time.perf_counter()
+        emu = emulate(mem, cycles)
+        t2 = time.perf_counter()
+        t_sim += t1 - t0
+        t_emu += t2 - t1
+        assert np.array_equal(sim, emu), np.flatnonzero(sim != emu)
+        t = np.sort(rng.choice(cycles, 50, replace=False))
+        assert np.array_equal(evaluate(mem, t), sim[t])
+        for fifo in 2, 4:
+            sim = simulate(mem, cycles, fifo)
+            emu = emulate(mem, cycles, fifo)
+            assert np.array_equal(sim, emu), (fifo, np.flatnonzero(sim != emu))
+            assert np.array_equal(evaluate(mem, t, fifo), sim[t])
+
+    n = len(mems)*cycles
+    print("run_simulation(): {:.3g} samples/s".format(n/t_sim))
+    print("emulator: {:.3g} samples/s (short lines)".format(n/t_emu))
+
+    segment = pdq2.Segment()
+    n = 200
+    segment.bias_array(rng.uniform(-1, 1, (n, 4))*[3, 1e-4, 1e-8, 1e-12],
+                       rng.randint(1000, 60000, n), shift=2)
+    segment.dds_array(rng.uniform(-1, 1, (n, 4))*[3, 1e-4, 1e-8, 1e-12],
+                      rng.randint(1000, 60000, n),
+                      phase=rng.uniform(-1, 1, (n, 3))*[.5, .01, 1e-7])
+    segment.line(typ=3, data=b"", duration=1, jump=True)
+    channel = pdq2.Channel(1 << 14, 8)
+    channel.segments.append(segment)
+    dac = Dac(channel.serialize())
+    cycles = 10**7
+    t0 = time.perf_counter()
+    out = dac.run(cycles)
+    t = time.perf_counter() - t0
+    print("emulator: {:.3g} samples/s (long lines)".format(cycles/t))
+    # unsorted, repeated and boundary cycles
+    t = np.concatenate([rng.randint(0, cycles, 1000), [0, 1, cycles - 1]*2])
+    assert np.array_equal(dac.evaluate(t), out[t])
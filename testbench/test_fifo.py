@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+from io import BytesIO
+
+from migen import *
+import numpy as np
+
+from gateware.dac import Dac
+from host import pdq2
+
+
+def frame(amplitude):
+    return [{"trigger": i == 0, "duration": 10,
+             "channel_data": [{"bias": {"amplitude": [amplitude]}}]}
+            for i in range(6)]
+
+
+class TB(Module):
+    def __init__(self, mem, fifo):
+        self.submodules.dac = Dac(fifo=fifo)
+        self.dac.parser.mem.init = [int(i) for i in mem]
+        self.dac.parser.frame.reset = 0
+        self.comb += [
+                self.dac.parser.start.eq(1),
+                self.dac.parser.arm.eq(1),
+                self.dac.out.arm.eq(1),
+        ]
+        self.outputs = []
+
+    def run(self, events, cycles):
+        for i in range(cycles):
+            self.outputs.append((yield self.dac.out.data))
+            yield self.dac.out.trigger.eq(0)
+            if events.get(i) == "trigger":
+                yield self.dac.out.trigger.eq(1)
+            elif i in events:
+                yield self.dac.parser.frame.eq(events[i])
+            yield
+
+
+if __name__ == "__main__":
+    amplitudes = [.1, .2, .3]
+    p = pdq2.Pdq2(dev=BytesIO(), num_boards=1, num_dacs=1)
+    p.program([frame(a) for a in amplitudes])
+    mem = np.frombuffer(p.channels[0].serialize(), "<u2")
+    levels = [int(round(a*pdq2.Segment.out_scale)) for a in amplitudes]
+
+    for fifo in 0, 2, 4, 16:
+        # frame 0 ends at about cycle 90, the board is parked in the
+        # trailing line until the trigger at 200, frames selected while
+        # parked are played
+        events = {20: "trigger", 150: 2, 200: "trigger", 250: "trigger",
+                  350: 1, 400: "trigger", 450: "trigger"}
+        tb = TB(mem, fifo)
+        run_simulation(tb, tb.run(events, 550))
+        out = tb.outputs
+        assert out[100] == out[240] == levels[0], (fifo, out[100], out[240])
+        assert out[300] == out[440] == levels[2], (fifo, out[300], out[440])
+        assert out[500] == levels[1], (fifo, out[500])
@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+from io import BytesIO
+import struct
+
+import numpy as np
+
+from host.pdq2 import Pdq2, Framer, crc8
+
+
+def reference(data, checksum=0):
+    """Framing as done by Pdq2.write() before the Framer."""
+    msg = b"\xa5\x02" + data.replace(b"\xa5", b"\xa5\xa5") + b"\xa5\x03"
+    return msg, crc8(data, checksum)
+
+
+class Device(BytesIO):
+    """Records the size of every write."""
+    def __init__(self):
+        super().__init__()
+        self.sizes = []
+
+    def write(self, data):
+        self.sizes.append(len(data))
+        return super().write(data)
+
+
+def split(rng, data):
+    """Split data into bytes, bytearray and memoryview parts."""
+    cuts = sorted(rng.randint(0, len(data) + 1, rng.randint(0, 5)))
+    parts = []
+    for i, j in zip([0] + cuts, cuts + [len(data)]):
+        part = data[i:j]
+        parts.append([bytes, bytearray, memoryview][rng.randint(3)](part))
+    return parts
+
+
+if __name__ == "__main__":
+    rng = np.random.RandomState(0)
+    for i in range(300):
+        n = rng.choice([0, 1, 2, 5, 100, 5000])
+        # dense escape bytes, including leading, trailing and runs
+        data = bytes(rng.choice([0xa5, 0x02, 0x03, 0x00, 0xff], n).tolist())
+        if i % 2:
+            data = bytes(rng.randint(0, 256, n).tolist())
+        chunk_size = int(rng.choice([1, 2, 3, 7, 64, 1 << 12]))
+        dev = Device()
+        framer = Framer(dev, chunk_size)
+        checksum = int(rng.randint(256))
+        out = framer.write(split(rng, data), checksum)
+        assert (dev.getvalue(), out) == reference(data, checksum), i
+        assert all(0 < size <= chunk_size for size in dev.sizes)
+
+    # views into larger buffers are framed in place
+    buf = bytearray(b"\xa5\x00\xa5\xa5\x01"*10)
+    dev = Device()
+    Framer(dev).write([memoryview(buf)[3:17], memoryview(buf)[20:]])
+    assert dev.getvalue() == reference(bytes(buf[3:17] + buf[20:]))[0]
+
+    # memory writes
+    data = bytes(rng.choice([0xa5, 0x5a], 1000).tolist())
+    dev = BytesIO()
+    pdq = Pdq2(dev=dev, num_boards=1, num_dacs=3)
+    pdq.write_mem(1, memoryview(data)[2:], 0x1234)
+    msg, checksum = reference(struct.pack("<BH", 0x85, 0x1234) + data[2:])
+    assert dev.getvalue() == msg
+    assert pdq.checksum == checksum
+
+    # the USB interface is write-only
+    assert not Framer.readable
+    try:
+        pdq.read_reg(0, 1)
+    except NotImplementedError:
+        pass
+    else:
+        assert False
@@ -19,14 +19,23 @@ from migen import *
 from migen.sim import run_simulation
 from migen.fhdl import verilog
 from gateware.comm import Protocol
+from host.pdq2 import crc8, crc16, crc32
 
 
 class TB(Module):
-    def __init__(self):
+    def __init__(self, crc=crc8):
+        self.crc = crc
         self.mems = [Memory(16, 4, init=[i]) for i in range(3)]
         self.specials += self.mems
-        self.submodules.proto = Protocol(self.mems)
-        self.comb += self.proto.board.eq(0b0101)
+        self.submodules.proto = Protocol(self.mems, crc.crc_width,
+                                         status_width=24)
+        self.cleared = Signal(2)
+        self.comb += [
+            self.proto.board.eq(0b0101),
+            self.proto.status.eq(0x12343c),
+        ]
+        self.sync += If(self.proto.status_clear,
+                        self.cleared.eq(self.cleared + 1))
 
     def test(self):
         for i in range(10):
@@ -56,6 +65,24 @@ class TB(Module):
             0x00]))
         assert r == [0xa5], r
 
+        # test status read, least significant byte first
+        r = (yield from self.seq([
+            (0 << 7) | (0b0101 << 3) | (0 << 2) | (3 << 0),
+            0x00]))
+        assert r == [0x3c], r
+        r = (yield from self.seq([
+            (0 << 7) | (0b0101 << 3) | (0 << 2) | (3 << 0),
+            0x00, 0x00, 0x00, 0x00]))
+        assert r == [0x3c, 0x34, 0x12], r
+
+        # test status write clears once
+        yield from self.seq([(1 << 7) | (0b0101 << 3) | (0 << 2) | (3 << 0),
+                             0x11, 0x22])
+        r = (yield self.proto.frame)
+        assert r == 0, r
+        r = (yield self.cleared)
+        assert r == 1, r
+
         # test write
         yield from self.seq([
             (1 << 7) | (0b0101 << 3) | (1 << 2) | (0 << 0),
@@ -83,7 +110,9 @@ class TB(Module):
         yield from self.seq([
             (1 << 7) | (0b0101 << 3) | (1 << 2) | (0 << 0),
             0x02, 0x00, 0x01, 0x10, 0x02, 0x20, 0x03, 0x30])
-        r = yield from [(yield self.mems[0][i]) for i in range(1, 4)]
+        r = []
+        for i in range(1, 4):
+            r.append((yield self.mems[0][i]))
         assert r == [0x1001, 0x2002, 0x3003], r
 
         # test multi read
@@ -92,6 +121,22 @@ class TB(Module):
             0x02, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
         assert r == [0x01, 0x10, 0x02, 0x20, 0x03, 0x30], r
 
+        # test checksum write, least significant byte first
+        n = self.crc.crc_width//8
+        crc = 0x9abcdef0 & (1 << self.crc.crc_width) - 1
+        yield from self.seq([(1 << 7) | (0b0101 << 3) | (0 << 2) | (1 << 0)] +
+                            list(crc.to_bytes(n, "little")))
+        r = (yield self.proto.checksum)
+        assert r == crc, hex(r)
+
+        # test checksum read
+        cmd = (0 << 7) | (0b0101 << 3) | (0 << 2) | (1 << 0)
+        r = yield from self.seq([cmd] + [0x00]*(n + 1))
+        crc = self.crc(bytes([cmd]), crc)
+        assert r == list(crc.to_bytes(n, "little")), r
+        r = (yield self.proto.checksum)
+        assert r == self.crc(b"\x00", crc), hex(r)
+
 
     def seq(self, seq):
         yield self.proto.sink.eop.eq(0)
@@ -119,3 +164,6 @@ if __name__ == "__main__":
     tb = TB()
     run_simulation(tb, tb.test(),
                    vcd_name="protocol.vcd")
+    for crc in crc16, crc32:
+        tb = TB(crc=crc)
+        run_simulation(tb, tb.test())
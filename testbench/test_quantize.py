@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+# Copyright 2013-2016 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+from io import BytesIO
+
+import numpy as np
+
+from host.emulator import Dac
+from host.pdq2 import Pdq2, Segment
+
+
+def deviation(amplitude, duration, optimize):
+    """Maximum deviation of the output of a bias line from its spline in
+    units of the DAC resolution."""
+    frame = [
+        {"trigger": True, "duration": 20,
+         "channel_data": [{"bias": {"amplitude": [0]}}]},
+        {"duration": duration, "channel_data": [{"bias": {
+            "amplitude": amplitude, "optimize": optimize}}]},
+        {"duration": 20, "channel_data": [{"bias": {"amplitude": [0]}}]},
+    ]
+    p = Pdq2(dev=BytesIO(), num_boards=1, num_dacs=1)
+    p.program([frame])
+    errors = p.channels[0].segments[0].errors
+    assert len(errors) == optimize
+    dac = Dac(bytes(p.shadow[0]))
+    start = dac.schedule(1000)[1][0]
+    n = np.arange(duration)
+    expect = sum(a*n**k/f for k, (a, f) in enumerate(zip(
+        amplitude, [1, 1, 2, 6])))*Segment.out_scale
+    out = dac.evaluate(start + 2 + n)
+    return np.abs(out - expect).max(), errors
+
+
+if __name__ == "__main__":
+    for amplitude in [
+            [-1, 2.5e-5, -3e-10, 4e-15],
+            [0, 1.2345678e-5, 1.1e-10, -1.23456e-15],
+            [2, -3.3e-5, 7.7e-10],
+    ]:
+        naive, _ = deviation(amplitude, 65535, False)
+        optimized, errors = deviation(amplitude, 65535, True)
+        print("naive {:.3g}, optimized {:.3g}, predicted {:.3g}".format(
+            naive, optimized, errors[0][1]))
+        assert optimized <= naive
+        # the output is the integer part of the accumulator
+        assert optimized <= errors[0][1] + 1
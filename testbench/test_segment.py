@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+from host.pdq2 import Segment
+
+
+flags = "trigger", "silence", "aux", "jump", "clear", "wait"
+
+
+def random_flags(rng, n):
+    kwargs = {flag: rng.randint(0, 2, n).astype(bool) for flag in flags}
+    kwargs["shift"] = rng.randint(0, 16, n)
+    return kwargs
+
+
+def per_line(kwargs, i):
+    return {k: v[i].item() if np.ndim(v) else v for k, v in kwargs.items()}
+
+
+def check(target, duration, amplitude, phase=None, **kwargs):
+    """Compare the lines appended by bias()/dds() and
+    bias_array()/dds_array()."""
+    a = Segment()
+    b = Segment()
+    append = getattr(a, target)
+    for i in range(len(duration)):
+        line = per_line(kwargs, i)
+        if phase is not None:
+            line["phase"] = phase[i].tolist()
+        append(amplitude=amplitude[i].tolist(), duration=int(duration[i]),
+               **line)
+    if target == "bias":
+        b.bias_array(amplitude, duration, **kwargs)
+    else:
+        b.dds_array(amplitude, duration, phase=phase, **kwargs)
+    assert a.data == b.data, (target, amplitude.shape, kwargs.keys())
+    return b
+
+
+if __name__ == "__main__":
+    rng = np.random.RandomState(0)
+    n = 200
+    scale = np.array([5, 1e-2, 1e-5, 1e-8])
+    for order in range(4):
+        amplitude = rng.uniform(-1, 1, (n, order + 1))*scale[:order + 1]
+        # lines with vanishing derivatives
+        amplitude[::3, 1:] = 0
+        duration = rng.randint(0, Segment.max_time, n)
+        # scalar and per line header flags and shifts
+        b = check("bias", duration, amplitude)
+        assert len(b.data) == n*2*(2 + [1, 3, 6, 9][order])
+        check("bias", duration, amplitude, shift=3, trigger=True, aux=True)
+        check("bias", duration, amplitude, **random_flags(rng, n))
+        check("dds", duration, amplitude, **random_flags(rng, n))
+    # dds with phase, frequency and chirp
+    amplitude = rng.uniform(-1, 1, (n, 4))*scale
+    amplitude[::4, 1:] = 0
+    duration = rng.randint(0, Segment.max_time, n)
+    for k in range(4):
+        phase = rng.uniform(-.25, .25, (n, k))*[1, 1e-2, 1e-5][:k]
+        b = check("dds", duration, amplitude, phase=phase,
+                  **random_flags(rng, n))
+        assert len(b.data) == n*2*(2 + 9 + [0, 1, 3, 5][k])
+
+    # the longest line and the durations out of range
+    duration = np.array([0, 1, Segment.max_time - 1])
+    amplitude = rng.uniform(-1, 1, (3, 2))
+    b = check("bias", duration, amplitude)
+    assert np.array_equal(np.frombuffer(b.data, "<u2")[1::5], duration)
+    for duration in -1, Segment.max_time:
+        for f in (lambda: Segment().bias([1.], duration=duration),
+                  lambda: Segment().bias_array([[1.], [1.]], [1, duration])):
+            try:
+                f()
+            except ValueError:
+                pass
+            else:
+                assert False, duration
@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+import copy
+from io import BytesIO
+
+import numpy as np
+
+from host.pdq2 import Pdq2, Channel
+from host.emulator import Dac
+from testbench.test_update import random_frame
+
+
+class UnsharedChannel(Channel):
+    """Channel that stores the data of every segment separately."""
+    def share(self):
+        return {}
+
+
+def images(program, share=True, **kwargs):
+    pdq = Pdq2(dev=BytesIO(), num_boards=1, num_dacs=3, num_frames=8,
+               **kwargs)
+    if not share:
+        pdq.channels = [UnsharedChannel(ch.max_data, ch.num_frames)
+                        for ch in pdq.channels]
+    pdq.program(program)
+    return pdq, [bytes(mem) for mem in pdq.shadow]
+
+
+def trace(mem, frame):
+    return Dac(mem).run(3000, frame)
+
+
+if __name__ == "__main__":
+    rng = np.random.RandomState(0)
+    a = random_frame(rng, 10)
+    b = random_frame(rng, 10)
+    c = random_frame(rng, 10)
+    # identical frames and a frame that is a suffix of another
+    prefix = random_frame(rng, 3)
+    prefix[0]["trigger"] = False
+    # only the data of channel 0 is identical between b and d
+    d = copy.deepcopy(b)
+    for line in d:
+        line["channel_data"][1]["bias"]["amplitude"][0] *= .5
+    program = [a, b, a, prefix + c, c, d, a]
+
+    pdq, shared = images(program)
+    ref, unshared = images(program, share=False)
+    for ch, mem, ref_mem in zip(pdq.channels, shared, unshared):
+        assert len(ref_mem) - len(mem) == 2*ch.shared, ch.shared
+        for frame in range(len(program)):
+            assert np.array_equal(trace(mem, frame), trace(ref_mem, frame))
+    # a twice, c as a suffix, d on channels 0 and 2
+    words = [len(ch.entry[2].data)*2 + len(ch.entry[4].data)
+             for ch in pdq.channels]
+    assert [ch.shared for ch in pdq.channels] == [
+        (words[0] + len(pdq.channels[0].entry[5].data))//2,
+        words[1]//2,
+        (words[2] + len(pdq.channels[2].entry[5].data))//2]
+    assert all(ch.shared == 0 for ch in ref.channels)
+
+    # outlined fragments are shared as well
+    body = random_frame(rng, 3)
+    for line in body:
+        line["duration"] = 3
+    hold = random_frame(rng, 1)[0]
+    program = [(body + [hold])*8, a, (body + [hold])*8]
+    pdq, shared = images(program, outline=True)
+    ref, unshared = images(program, share=False, outline=True)
+    for ch, mem, ref_mem in zip(pdq.channels, shared, unshared):
+        assert ch.shared > 0
+        assert len(ref_mem) - len(mem) == 2*ch.shared, ch.shared
+        for frame in range(len(program)):
+            assert np.array_equal(trace(mem, frame), trace(ref_mem, frame))
@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+# Copyright 2013-2016 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+from io import BytesIO
+
+import numpy as np
+
+from host.emulator import Dac
+from host.pdq2 import Pdq2, Segment
+
+
+def line(duration, target="bias", **kwargs):
+    return {"duration": duration, "channel_data": [{target: kwargs}]}
+
+
+def render(frame):
+    p = Pdq2(dev=BytesIO(), num_boards=1, num_dacs=1)
+    p.program([frame])
+    return Dac(bytes(p.shadow[0]))
+
+
+if __name__ == "__main__":
+    hold, ramp, tail = 10**6 + 3, 400000, 100
+    frame = [
+        dict(line(20, amplitude=[0]), trigger=True),
+        line(hold, amplitude=[1.]),
+        dict(line(ramp//4, amplitude=[1., -4e-5, 1e-11]), dac_divider=4),
+        line(tail, amplitude=[-1.]),
+    ]
+    segment = Segment()
+    assert segment.span("bias", hold, amplitude=[1.]) == 2
+    assert segment.span("bias", ramp, amplitude=[1., -1e-5]) == 7
+
+    dac = render(frame)
+    schedule = dac.schedule(hold + ramp + 1000)
+    start = [t for t, line in schedule]
+    durations = np.diff(start)
+    assert durations[0] == 20
+    # the hold ends and the ramp starts on time
+    assert sum(durations[1:3]) == hold
+    assert sum(durations[3:5]) == ramp
+    assert schedule[5][1].data[0] == round(-Segment.out_scale) % (1 << 16)
+
+    # the ramp follows the spline (with dac_divider 4)
+    t = start[3] + 2 + np.arange(0, ramp, 97)
+    n = (t - t[0]) >> 2
+    expect = (1. - 4e-5*n + 1e-11*n**2/2)*Segment.out_scale
+    out = dac.evaluate(t)
+    assert np.abs(out - expect).max() <= 1.5
+
+    # a long DDS line is identical to the same line split by hand
+    dds = dict(amplitude=[.5, 0, 0, 0], phase=[.1, 1e-3], clear=True)
+    split = [dict(line(20, amplitude=[0]), trigger=True)]
+    split += [line(60000, "dds", **dict(dds, clear=i == 0)) for i in range(5)]
+    split.append(line(tail, amplitude=[0]))
+    long = split[:1] + [line(300000, "dds", **dds)] + split[-1:]
+    t = np.arange(0, 300000 + 1000, 13)
+    assert np.array_equal(render(long).evaluate(t), render(split).evaluate(t))
@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+# Copyright 2013-2016 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+from io import BytesIO
+
+import numpy as np
+
+from host.pdq2 import Pdq2, SPIFramer, crc16, crc32
+from testbench.spidev import SimSpidev
+
+
+def spi(max_frame=1 << 12):
+    dev = SimSpidev(num_boards=2, num_dacs=3)
+    return dev, Pdq2(num_boards=2, num_dacs=3,
+                     transport=SPIFramer(dev, max_frame))
+
+
+if __name__ == "__main__":
+    data = np.random.RandomState(0).bytes(10000)
+
+    dev, pdq = spi()
+    pdq.set_config(aux_miso=True, enable=False)
+    pdq.set_checksum(0)
+    pdq.write_mem(4, data, 6)
+    # one frame per 4093 bytes, each covering whole words
+    assert dev.transfers == 2 + 3
+    assert dev.bytes == 2*2 + 3*3 + len(data)
+    assert dev.mems[4][6:6 + len(data)] == data
+    assert not any(dev.mems[3])
+    assert pdq.shadow[4] is None
+
+    # register readback
+    pdq.set_frame(3, board=1)
+    assert pdq.read_reg(1, 2) == 3
+    assert pdq.read_reg(1, 0) == pdq.config[1]
+    assert pdq.validate(1)
+    # board 0 also checksums the byte that clocked out the data
+    assert dev.regs[0][1] != pdq.checksum
+    pdq.set_checksum(0)
+    assert pdq.validate(0)
+
+    # reads require aux_miso
+    pdq.set_config(aux_miso=False, enable=False, board=1)
+    assert pdq.read_reg(1, 2) == 0
+    assert not pdq.validate(1)
+    pdq.set_config(aux_miso=True, enable=False, board=1)
+    pdq.set_checksum(0)
+    assert pdq.validate(1)
+
+    # the USB transport writes the same data
+    buf = BytesIO()
+    usb = Pdq2(dev=buf, num_boards=2, num_dacs=3)
+    usb.write_mem(4, data, 6)
+    assert len(buf.getvalue()) > len(data) + 3
+    try:
+        usb.read_reg(0, 1)
+    except NotImplementedError:
+        pass
+    else:
+        assert False
+
+    # status register, clearing it keeps the rate
+    dev.regs[1][3] = int.from_bytes(bytes([7, 1, 2, 3, 4, 5, 6]), "little")
+    assert pdq.read_status(1) == dict(rate=7, underruns=[1, 3, 5],
+                                      level_max=[2, 4, 6])
+    pdq.clear_status()
+    assert dev.regs[1][3] == 7 and dev.regs[0][3] == 0
+    assert pdq.validate(1)
+
+    # frames are not escaped and not longer than max_frame
+    dev, pdq = spi(max_frame=16)
+    pdq.write_mem(0, b"\xa5"*100)
+    assert dev.transfers == 9
+    assert dev.mems[0][:100] == b"\xa5"*100
+
+    # wider checksums are read and written least significant byte first
+    for crc in crc16, crc32:
+        dev = SimSpidev(num_boards=1, num_dacs=3, crc=crc)
+        pdq = Pdq2(num_boards=1, num_dacs=3, transport=SPIFramer(dev, crc=crc))
+        pdq.set_config(aux_miso=True, enable=False)
+        pdq.set_checksum(0x89ab)
+        assert dev.regs[0][1] == 0x89ab
+        pdq.write_mem(0, data)
+        assert dev.regs[0][1] == pdq.checksum
+        assert pdq.validate(0)
+        assert pdq.validate(0)
+
+    buf = BytesIO()
+    Pdq2(dev=buf, crc=crc32).set_checksum(0x12345678)
+    assert buf.getvalue() == b"\xa5\x02\xf9\x78\x56\x34\x12\xa5\x03"
@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+from host.pdq2 import Pdq2, SPIFramer
+from testbench.spidev import SimSpidev
+from testbench.test_update import random_frame
+
+
+class CountingFramer(SPIFramer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+        super().flush()
+
+
+def spi():
+    dev = SimSpidev(num_boards=2, num_dacs=3)
+    return dev, Pdq2(num_boards=2, num_dacs=3, num_frames=8, track=True,
+                     transport=CountingFramer(dev))
+
+
+def skipped(dev, f, *args, **kwargs):
+    """Whether the call did not transfer anything."""
+    transfers = dev.transfers
+    f(*args, **kwargs)
+    return dev.transfers == transfers
+
+
+if __name__ == "__main__":
+    rng = np.random.RandomState(0)
+    program = [random_frame(rng, 10) for i in range(3)]
+
+    dev, pdq = spi()
+    assert not skipped(dev, pdq.set_config, aux_miso=True, enable=False)
+    assert dev.regs[1][0] == pdq.config[1]
+    assert skipped(dev, pdq.set_config, aux_miso=True, enable=False)
+    assert not skipped(dev, pdq.set_config, aux_miso=True, enable=True)
+    # per board
+    assert not skipped(dev, pdq.set_frame, 2, board=1)
+    assert pdq.frame == [None, 2]
+    assert skipped(dev, pdq.set_frame, 2, board=1)
+    assert not skipped(dev, pdq.set_frame, 2)
+    assert skipped(dev, pdq.set_frame, 2, board=0)
+    assert [regs[2] for regs in dev.regs] == [2, 2]
+    # checksum resets to the current value
+    assert not skipped(dev, pdq.set_checksum, 0)
+    assert skipped(dev, pdq.set_checksum, 0)
+    assert not skipped(dev, pdq.set_checksum, 0, board=1)
+
+    # unchanged channel images and empty flushes
+    pdq.program(program)
+    assert all(dev.mems[c][:len(m)] == m for c, m in enumerate(pdq.shadow))
+    assert skipped(dev, pdq.program, program)
+    flushes = pdq.transport.flushes
+    pdq.flush()
+    pdq.flush()
+    assert pdq.transport.flushes == flushes + 1
+    # only the channels with data (on board 0) change
+    program[1][3]["duration"] += 1
+    transfers = dev.transfers
+    pdq.program(program)
+    assert dev.transfers == transfers + 3
+    assert all(dev.mems[c][:len(m)] == m for c, m in enumerate(pdq.shadow))
+    pdq.flush()
+    assert pdq.transport.flushes == flushes + 2
+
+    # a reset discards the recorded registers
+    pdq.set_config(reset=True, aux_miso=True, enable=False)
+    assert pdq.config == [None, None] and pdq.frame == [None, None]
+    assert pdq.checksum == 0 and [regs[1] for regs in dev.regs] == [0, 0]
+    assert not skipped(dev, pdq.set_config, aux_miso=True, enable=False)
+
+    # validation, reads are checksummed differently by the other board
+    assert pdq.validate(1)
+    assert skipped(dev, pdq.set_config, aux_miso=True, enable=False)
+    assert skipped(dev, pdq.program, program)
+    # a corrupted byte
+    dev.regs[1][1] ^= 1
+    assert not pdq.validate(1)
+    assert pdq.config == [None, None] and pdq.frame == [None, None]
+    assert pdq.shadow == [None]*pdq.num_channels
+    assert not skipped(dev, pdq.set_config, aux_miso=True, enable=False)
+    transfers = dev.transfers
+    pdq.program(program)
+    assert dev.transfers == transfers + pdq.num_channels
+    # the checksum follows the board after a mismatch
+    assert pdq.validate(1)
+    assert skipped(dev, pdq.program, program)
@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+from io import BytesIO
+import sys
+
+import numpy as np
+
+from host.pdq2 import Pdq2, Segment
+from host.emulator import Dac, fifo_depths
+
+
+def random_frame(rng, num_lines, order=None):
+    frame = []
+    for i in range(num_lines):
+        amplitude = (rng.uniform(-1, 1, 4)*[3, 1e-2, 1e-4, 1e-6]).tolist()
+        n = rng.randint(1, 5, 3) if order is None else [order + 1]*3
+        frame.append({
+            "trigger": i == 0,
+            "duration": int(rng.randint(20, 100)),
+            "channel_data": [{"bias": {"amplitude": amplitude[:k]}}
+                             for k in n],
+        })
+    return frame
+
+
+def frame_bytes(pdq, channel, frame):
+    """Table entry and data of a frame as found in the shadow copy."""
+    ch = pdq.channels[channel]
+    segment = ch.entry[frame]
+    mem = pdq.shadow[channel]
+    addr = 2*segment.addr
+    return (bytes(mem[2*frame:2*frame + 2]),
+            bytes(mem[addr:addr + len(segment.data)]))
+
+
+def output(pdq, channel, frame, cycles=2000):
+    return Dac(bytes(pdq.shadow[channel])).run(cycles, frame)
+
+
+if __name__ == "__main__":
+    rng = np.random.RandomState(0)
+    program = [random_frame(rng, 10) for i in range(4)]
+    pdq = Pdq2(dev=BytesIO(), num_boards=1, num_dacs=3, num_frames=8)
+    pdq.program(program)
+    channels = range(pdq.num_channels)
+    others = [0, 2, 3]
+    ref = {(c, f): frame_bytes(pdq, c, f) for c in channels for f in others}
+    out = {(c, f): output(pdq, c, f) for c in channels for f in others}
+
+    # update frame 1 repeatedly, the other frames are untouched
+    for i in range(30):
+        new = random_frame(rng, int(rng.randint(1, 20)))
+        pdq.update_frame(1, new, best_fit=bool(i % 2))
+        for c in channels:
+            for f in others:
+                assert frame_bytes(pdq, c, f) == ref[c, f], (i, c, f)
+            # the updated frame is as if freshly programmed
+            fresh = Pdq2(dev=BytesIO(), num_boards=1, num_dacs=3,
+                         num_frames=8)
+            fresh.program([program[0], new])
+            assert np.array_equal(output(pdq, c, 1), output(fresh, c, 1))
+            # old segments are released
+            ch = pdq.channels[c]
+            assert len(ch.segments) == len(program), len(ch.segments)
+    for c in channels:
+        for f in others:
+            assert np.array_equal(output(pdq, c, f), out[c, f])
+
+    # the previous copy of a frame is kept until after the next update
+    pdq = Pdq2(dev=BytesIO(), num_boards=1, num_dacs=3, num_frames=8)
+    pdq.program(program)
+    first = [ch.entry[1] for ch in pdq.channels]
+    copies = [(2*s.addr, bytes(s.data)) for s in first]
+    for i in range(2):
+        pdq.update_frame(1, random_frame(rng, 5))
+        for c in channels:
+            addr, data = copies[c]
+            assert pdq.shadow[c][addr:addr + len(data)] == data, (i, c)
+            assert pdq.channels[c].entry[1].addr != first[c].addr
+    # and then reused
+    pdq.update_frame(1, random_frame(rng, 5))
+    assert [ch.entry[1].addr for ch in pdq.channels] == \
+        [s.addr for s in first]
+
+    # without sufficient contiguous memory nothing is written
+    pdq = Pdq2(dev=BytesIO(), num_boards=1, num_dacs=3, num_frames=8)
+    ch = pdq.channels[2]
+    # fill most of the memory of channel 2 with cubic lines of 11 words
+    pdq.program(program[:3] + [random_frame(rng, ch.max_data//16, 3)])
+    gap = ch.free()[-1]
+    gap = gap[1] - gap[0]
+    old = len(ch.entry[1].data)//2
+    # the same amount of data on all channels, the terminating line is
+    # three words long
+    lines = random_frame(rng, (gap - 3)//11 + 1, 3)
+    assert gap < 11*len(lines) + 3 < gap + old
+    shadow = [bytes(mem) for mem in pdq.shadow]
+    segments = [list(ch.segments) for ch in pdq.channels]
+    try:
+        pdq.update_frame(1, lines)
+    except ValueError:
+        pass
+    else:
+        assert False
+    assert [bytes(mem) for mem in pdq.shadow] == shadow
+    assert [ch.segments for ch in pdq.channels] == segments
+    assert all(s.addr is not None for s in ch.segments)
+    # compaction rewrites the channel
+    pdq.update_frame(1, lines, compact=True)
+    fresh = Pdq2(dev=BytesIO(), num_boards=1, num_dacs=3, num_frames=8)
+    fresh.program([program[0], lines])
+    for c in channels:
+        assert np.array_equal(output(pdq, c, 1), output(fresh, c, 1))
+        assert frame_bytes(pdq, c, 0)[1] == frame_bytes(fresh, c, 0)[1]
+
+    # fragments called only by the old segments are released
+    pdq = Pdq2(dev=BytesIO(), num_boards=1, num_dacs=3, num_frames=8,
+               outline=True)
+    body = random_frame(rng, 3)
+    for line in body:
+        line["duration"] = 3
+    hold = random_frame(rng, 1)[0]
+    pdq.program([program[0], (body + [hold])*8])
+    ch = pdq.channels[0]
+    assert len(ch.segments) > 2
+    pdq.update_frame(1, program[1])
+    assert len(ch.segments) == 2, ch.segments
+
+    # the preview models the FIFO depth of the gateware without migen
+    t = np.arange(0, 2000, 7)
+    _, v = pdq.preview(0, 1, t[0]/pdq.freq, t[-1]/pdq.freq, len(t))
+    out = Dac(bytes(pdq.shadow[0]), fifo_depths[3]).evaluate(t, 1)
+    assert np.array_equal(v, out/Segment.out_scale)
+    assert "migen" not in sys.modules
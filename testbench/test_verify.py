@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+# Copyright 2013-2016 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+import queue
+import struct
+import threading
+
+from migen import *
+import numpy as np
+
+from host.pdq2 import Pdq2, SPIFramer
+from testbench.spidev import SimSpidev
+from testbench.test_spi_pdq2 import TB
+
+
+class Spidev:
+    """``spidev`` style device running the transfers through the
+    :class:`misoc.cores.spi.SPIMachine` master of :class:`TB`.
+
+    The master is half-duplex: the command and address bytes and the
+    first padding byte of reads are written, the remaining bytes are read.
+    """
+    def __init__(self, tb):
+        self.tb = tb
+        self.requests = queue.Queue()
+        self.replies = queue.Queue()
+
+    def _transfer(self, data, read):
+        self.requests.put((bytes(data), read))
+        return self.replies.get()
+
+    def writebytes2(self, data):
+        self._transfer(data, False)
+
+    def xfer2(self, data):
+        return list(self._transfer(data, True))
+
+    def close(self):
+        self.requests.put(None)
+
+    def serve(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            msg, read = request
+            n = len(msg)
+            if read:
+                n = 4 if msg[0] & 4 else 2
+            rx = bytearray(n)
+            for i in range(0, n, 4):
+                chunk = msg[i:min(i + 4, n)]
+                yield
+                yield from self.tb.xfer(
+                    int.from_bytes(chunk, "big") << 8*(4 - len(chunk)),
+                    8*len(chunk))
+            for i in range(n, len(msg), 4):
+                k = min(4, len(msg) - i)
+                yield
+                data = yield from self.tb.xfer(0, 0, 8*k)
+                rx += (data & (1 << 8*k) - 1).to_bytes(k, "big")
+            # deassert cs_n
+            for i in range(10):
+                yield
+            self.replies.put(rx)
+
+
+def upload(dev, image):
+    pdq = Pdq2(num_boards=1, num_dacs=2, transport=SPIFramer(dev, 40))
+    pdq.set_config(aux_miso=True, enable=False)
+    pdq.set_checksum(0)
+    pdq.write_mem(1, image)
+    assert pdq.read_mem(1, 0, len(image)) == image
+    assert pdq.read_mem(1, 7, 5) == image[7:12]
+    assert pdq.verify(1) == []
+    # corrupt the memory without updating the shadow copy
+    pdq.write(struct.pack("<BH", pdq._cmd(0, True, 1, True), 11), b"\xff"*3,
+              image[14:16], b"\xff")
+    ranges = pdq.verify(1)
+    assert pdq.verify(1) == []
+    assert pdq.validate(0)
+    checksum = pdq.checksum
+    pdq.close()
+    return ranges, checksum
+
+
+if __name__ == "__main__":
+    image = np.random.RandomState(0).bytes(2*48)
+    ref = upload(SimSpidev(num_boards=1, num_dacs=2), image)
+    assert ref[0] == [(5, 9)], ref
+
+    tb = TB()
+    dev = Spidev(tb)
+    result = []
+
+    def host():
+        try:
+            result.append(upload(dev, image))
+        finally:
+            dev.close()
+
+    thread = threading.Thread(target=host)
+    thread.start()
+    run_simulation(tb, [tb.run_setup(), dev.serve()])
+    thread.join()
+    assert result == [ref], (result, ref)
@@ -0,0 +1,290 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compiled simulation of :class:`gateware.pdq2.Pdq2Base`.
+
+The gateware is converted to Verilog with :func:`migen.fhdl.verilog.convert`
+and simulated under Verilator. The stimulus and recording interface mirrors
+:class:`gateware.pdq2.Pdq2Sim`::
+
+    sim = VerilatorSim()
+    sim.write(buf.getvalue())
+    sim.record()
+    sim.run(10**6)
+    out = np.array(sim.outputs, np.uint16).view(np.int16)
+
+The USB byte stream is driven with the same handshake timing as
+:meth:`gateware.pdq2.Pdq2Sim.write` and the outputs are sampled at the same
+cycles as :meth:`gateware.pdq2.Pdq2Sim.record`. The outputs are therefore
+cycle-identical to :func:`migen.run_simulation` (checked by
+``testbench/bench_vsim.py``).
+
+For the default three channel configuration, ``bench_vsim.py`` measured
+125 cycles/s under :func:`migen.run_simulation` and 1.4e6 to 1.7e6 cycles/s
+under Verilator 5.48 (``-O2``, 15 s build).
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from migen import *
+from migen.fhdl import verilog
+from migen.genlib.record import Record
+import numpy as np
+
+from gateware.pdq2 import Pdq2Base, Pdq2Sim
+
+
+class Pdq2Top(Module):
+    """:class:`gateware.pdq2.Pdq2Base` with flat, named ports.
+
+    Args:
+        **kwargs: Passed to :class:`gateware.pdq2.Pdq2Base`.
+
+    Attributes:
+        ios (set[Signal]): Top level ports.
+    """
+    def __init__(self, **kwargs):
+        ctrl_pads = Record(Pdq2Sim.ctrl_layout)
+        self.submodules.dut = Pdq2Base(ctrl_pads, **kwargs)
+        bus = self.dut.comm.ftdi_bus
+
+        ports = [
+            ("board", ctrl_pads.board, 0),
+            ("frame", ctrl_pads.frame, 0),
+            ("trigger", ctrl_pads.trigger, 0),
+            ("aux", ctrl_pads.aux, 1),
+            ("data", bus.data, 0),
+            ("stb", bus.stb, 0),
+            ("eop", bus.eop, 0),
+            ("ack", bus.ack, 1),
+        ]
+        ports += [("dac{}".format(i), dac.out.data, 1)
+                  for i, dac in enumerate(self.dut.dacs)]
+        self.ios = set()
+        for name, signal, output in ports:
+            port = Signal.like(signal, name_override=name)
+            if output:
+                self.comb += port.eq(signal)
+            else:
+                self.comb += signal.eq(port)
+            self.ios.add(port)
+
+
+# The driver reproduces the timing of Pdq2Sim.write() and Pdq2Sim.record()
+# under run_simulation(): the first byte is presented after the second
+# clock edge, a byte is consumed on every edge with stb and ack asserted,
+# and the outputs are sampled once per cycle after the edge has settled.
+# The records are little endian words: one per DAC and aux.
+
+_verilator_main = """\
+#include <cstdint>
+#include <cstdio>
+#include <cstdlib>
+
+#include "verilated.h"
+#include "V{name}.h"
+
+int main(int argc, char **argv)
+{{
+    if (argc < 4) {{
+        fprintf(stderr, "usage: %s STIMULUS OUTPUTS CYCLES\\n", argv[0]);
+        return 2;
+    }}
+    FILE *fin = fopen(argv[1], "rb");
+    FILE *fout = fopen(argv[2], "wb");
+    unsigned long cycles = strtoul(argv[3], NULL, 0);
+    if (!fin || !fout) {{
+        perror("fopen");
+        return 1;
+    }}
+
+    V{name} *top = new V{name};
+    top->board = 0xf;  // board-inverted
+    top->frame = 0x7;  // pullup on cs_n
+    top->trigger = 1;
+    top->eop = 0;
+    top->stb = 0;
+    top->data = 0;
+    top->sys_rst = 0;
+    top->sys_clk = 0;
+    top->eval();
+
+    int c = fgetc(fin);
+    uint16_t rec[{size}] = {{0}};
+    for (unsigned long n = 1; n <= cycles; n++) {{
+        bool xfer = top->stb && top->ack;
+        top->sys_clk = 1;
+        top->eval();
+        if (xfer)
+            c = fgetc(fin);
+        if (xfer || n == 2) {{
+            top->stb = c != EOF;
+            top->data = c & 0xff;
+        }}
+        top->sys_clk = 0;
+        top->eval();
+{rec}        fwrite(rec, sizeof(rec), 1, fout);
+    }}
+
+    top->final();
+    delete top;
+    fclose(fin);
+    fclose(fout);
+    return 0;
+}}
+"""
+
+
+class VerilatorSim:
+    """Verilator simulation of :class:`gateware.pdq2.Pdq2Base`.
+
+    Requires ``verilator``, ``make`` and a C++ compiler.
+
+    Args:
+        build_dir (str): Directory for the generated sources and the
+            simulation binary. A temporary directory is used (and removed
+            with :meth:`close`) if not given.
+        opt (str): Optimization flag passed to the C++ compiler.
+        **kwargs: Passed to :class:`gateware.pdq2.Pdq2Base`.
+
+    Attributes:
+        outputs (array): DAC output samples, one row of ``len(mem_depths)``
+            unsigned words per cycle. Only populated after :meth:`record`.
+        aux (array): AUX output, one value per cycle.
+        cycles_per_second (float): Simulation speed of the last :meth:`run`,
+            excluding the build.
+    """
+    name = "pdq2"
+
+    def __init__(self, build_dir=None, opt="-O2", **kwargs):
+        self.opt = opt
+        self._tmp = build_dir is None
+        if self._tmp:
+            build_dir = tempfile.mkdtemp(prefix="pdq2_")
+        self.build_dir = build_dir
+        self.kwargs = kwargs
+        self.num_dacs = len(kwargs.get("mem_depths", (0, 0, 0)))
+        self.stimulus = bytearray()
+        self.recording = False
+        self.built = False
+        self.outputs = np.zeros((0, self.num_dacs), np.uint16)
+        self.aux = np.zeros(0, np.uint16)
+        self.cycles_per_second = None
+
+    def write(self, mem):
+        """Append bytes to the USB stimulus stream.
+
+        Args:
+            mem (bytes): Data to write.
+        """
+        self.stimulus += mem
+
+    def record(self):
+        """Record the DAC and AUX outputs during :meth:`run`."""
+        self.recording = True
+
+    def convert(self):
+        """Convert the gateware to Verilog in :attr:`build_dir`.
+
+        Returns:
+            str: Path of the Verilog source.
+        """
+        top = Pdq2Top(**self.kwargs)
+        v = verilog.convert(top, top.ios, name=self.name)
+        filename = os.path.join(self.build_dir, self.name + ".v")
+        with open(filename, "w") as f:
+            f.write(v.main_source)
+        # $readmemh() is relative to the simulation's working directory
+        for data_file, content in v.data_files.items():
+            with open(os.path.join(self.build_dir, data_file), "w") as f:
+                f.write(content)
+        return filename
+
+    def build(self):
+        """Convert and compile the simulation."""
+        source = self.convert()
+        main = os.path.join(self.build_dir, "main.cpp")
+        rec = ["top->dac{}".format(i) for i in range(self.num_dacs)]
+        rec.append("top->aux")
+        rec = "".join("        rec[{}] = {};\n".format(i, port)
+                      for i, port in enumerate(rec))
+        with open(main, "w") as f:
+            f.write(_verilator_main.format(name=self.name,
+                                           size=self.num_dacs + 1, rec=rec))
+        subprocess.check_call([
+            "verilator", "--cc", "--exe", "-Wno-fatal", "-Wno-lint",
+            "-Wno-COMBDLY", "-Wno-INITIALDLY",
+            "--top-module", self.name, "-Mdir", "obj_dir",
+            "-O3", "--x-assign", "fast", "--noassert",
+            "-CFLAGS", self.opt, source, main,
+        ], cwd=self.build_dir)
+        subprocess.check_call([
+            "make", "-s", "-j", str(os.cpu_count() or 1),
+            "-C", "obj_dir", "-f", "V{}.mk".format(self.name),
+        ], cwd=self.build_dir)
+
+    def run(self, cycles):
+        """Simulate a given number of cycles.
+
+        Builds the simulation on first use.
+
+        Args:
+            cycles (int): Number of cycles to simulate.
+        """
+        if not self.built:
+            self.build()
+            self.built = True
+        stimulus = os.path.join(self.build_dir, "stimulus.bin")
+        outputs = os.path.join(self.build_dir, "outputs.bin")
+        with open(stimulus, "wb") as f:
+            f.write(self.stimulus)
+        t0 = time.perf_counter()
+        subprocess.check_call([
+            os.path.join(self.build_dir, "obj_dir", "V" + self.name),
+            stimulus, outputs if self.recording else os.devnull,
+            str(cycles)], cwd=self.build_dir)
+        self.cycles_per_second = cycles/(time.perf_counter() - t0)
+        if self.recording:
+            out = np.fromfile(outputs, "<u2").reshape(-1, self.num_dacs + 1)
+            self.outputs = out[:, :self.num_dacs]
+            self.aux = out[:, self.num_dacs]
+
+    def close(self):
+        """Remove the temporary build directory."""
+        if self._tmp:
+            shutil.rmtree(self.build_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def available():
+    """Compiled simulation backends available on this machine.
+
+    Returns:
+        list[type]: :class:`VerilatorSim` if Verilator is installed.
+    """
+    if shutil.which("verilator") and shutil.which("make"):
+        return [VerilatorSim]
+    return []